@@ -2,9 +2,20 @@
  * Vercel Serverless Function - WhatsApp Webhook (Meta Cloud API)
  * - GET: verifica hub.challenge
  * - POST: opcionalmente valida firma HMAC, resuelve tenant y reenvía al backend
+ *
+ * Con FORWARD_BATCH_WINDOW_MS > 0 los eventos que llegan a la misma instancia dentro de
+ * esa ventana se reenvían juntos (gzip) a BACKEND_BATCH_URL (por defecto
+ * BACKEND_INGEST_URL + "/batch"), respetando FORWARD_BATCH_MAX_EVENTS / _MAX_BYTES
+ * (deben ser <= los límites que publica GET /webhooks/whatsapp/meta/cloud/batch).
+ * Si el backend no tiene el endpoint de lotes, se reenvía evento por evento.
  */
 
 const crypto = require("crypto");
+const zlib = require("zlib");
+
+const FORWARD_BATCH_WINDOW_MS = parseInt(process.env.FORWARD_BATCH_WINDOW_MS || "0", 10);
+const FORWARD_BATCH_MAX_EVENTS = parseInt(process.env.FORWARD_BATCH_MAX_EVENTS || "50", 10);
+const FORWARD_BATCH_MAX_BYTES = parseInt(process.env.FORWARD_BATCH_MAX_BYTES || String(512 * 1024), 10);
 
 function generateRequestId() {
   return `req-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`;
@@ -44,6 +55,89 @@ function validateSignature(rawBody, signature, appSecret) {
   }
 }
 
+function forwardHeaders(sharedSecret, extra) {
+  return {
+    "Content-Type": "application/json",
+    Authorization: `Bearer ${sharedSecret}`,
+    "ngrok-skip-browser-warning": "true",
+    ...extra,
+  };
+}
+
+// Un evento por request (POST /webhooks/whatsapp/meta/cloud)
+async function forwardOne(envelope) {
+  const resp = await fetch(process.env.BACKEND_INGEST_URL, {
+    method: "POST",
+    headers: forwardHeaders(process.env.BACKEND_SHARED_SECRET, {
+      "X-Tenant-ID": envelope.tenant_id,
+      "X-Phone-Number-ID": envelope.phone_number_id || "",
+      "X-Request-ID": envelope.request_id,
+    }),
+    body: JSON.stringify(envelope),
+  });
+  if (!resp.ok) {
+    throw new Error(`Backend responded ${resp.status}`);
+  }
+  return resp.json();
+}
+
+// Lote pendiente de la instancia: [{ envelope, size, resolve, reject }]
+let pending = [];
+let pendingBytes = 0;
+let flushTimer = null;
+
+async function sendBatch(batch) {
+  const batchUrl = process.env.BACKEND_BATCH_URL || `${process.env.BACKEND_INGEST_URL}/batch`;
+  const body = zlib.gzipSync(Buffer.from(JSON.stringify({ events: batch.map((b) => b.envelope) })));
+  const resp = await fetch(batchUrl, {
+    method: "POST",
+    headers: forwardHeaders(process.env.BACKEND_SHARED_SECRET, { "Content-Encoding": "gzip" }),
+    body,
+  });
+  if (resp.status === 404 || resp.status === 405 || resp.status === 413) {
+    // Backend sin endpoint de lotes (o lote fuera de sus límites): evento por evento
+    console.warn(`⚠️ Batch forward ${resp.status}, falling back to single events`);
+    return Promise.all(batch.map((b) => forwardOne(b.envelope)));
+  }
+  if (!resp.ok) {
+    throw new Error(`Backend responded ${resp.status}`);
+  }
+  const data = await resp.json();
+  return data.acks;
+}
+
+async function flushBatch() {
+  clearTimeout(flushTimer);
+  flushTimer = null;
+  const batch = pending;
+  pending = [];
+  pendingBytes = 0;
+  if (batch.length === 0) return;
+  console.log(`📦 Forwarding batch of ${batch.length} events`);
+  try {
+    const acks = await sendBatch(batch);
+    batch.forEach((b, i) => b.resolve(acks[i]));
+  } catch (err) {
+    batch.forEach((b) => b.reject(err));
+  }
+}
+
+// Encola el evento en el lote de la instancia; resuelve con su ack cuando se envía el lote
+function forwardBatched(envelope) {
+  const size = Buffer.byteLength(JSON.stringify(envelope));
+  if (pending.length > 0 && pendingBytes + size > FORWARD_BATCH_MAX_BYTES) {
+    flushBatch();
+  }
+  const ack = new Promise((resolve, reject) => pending.push({ envelope, size, resolve, reject }));
+  pendingBytes += size;
+  if (pending.length >= FORWARD_BATCH_MAX_EVENTS) {
+    flushBatch();
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flushBatch, FORWARD_BATCH_WINDOW_MS);
+  }
+  return ack;
+}
+
 module.exports = async function handler(req, res) {
   const requestId = generateRequestId();
   console.log(`[${requestId}] 🔔 WEBHOOK ${req.method}`);
@@ -112,25 +206,22 @@ module.exports = async function handler(req, res) {
       let senderWaId = null;
       const extractedMessages = [];
 
-      if (body.entry && body.entry.length > 0) {
-        const entry = body.entry[0];
-        if (entry.changes && entry.changes.length > 0) {
-          const change = entry.changes[0];
-          phoneNumberId = change?.value?.metadata?.phone_number_id || change?.value?.metadata?.display_phone_number || entry.id || null;
-          if (change.value && change.value.messages && change.value.messages.length > 0) {
-            senderWaId = change.value.messages[0].from;
-            change.value.messages.forEach((msg) => {
-              extractedMessages.push({
-                from: msg.from,
-                type: msg.type,
-                text: msg.text?.body || msg.type,
-                timestamp: msg.timestamp,
-                id: msg.id,
-              });
+      // Meta puede agrupar varios entry / changes en una entrega
+      (body.entry || []).forEach((entry) => {
+        (entry.changes || []).forEach((change) => {
+          phoneNumberId = phoneNumberId || change?.value?.metadata?.phone_number_id || change?.value?.metadata?.display_phone_number || entry.id || null;
+          (change?.value?.messages || []).forEach((msg) => {
+            senderWaId = senderWaId || msg.from;
+            extractedMessages.push({
+              from: msg.from,
+              type: msg.type,
+              text: msg.text?.body || msg.type,
+              timestamp: msg.timestamp,
+              id: msg.id,
             });
-          }
-        }
-      }
+          });
+        });
+      });
 
       const tenantId = getTenantIdFromPhoneNumberId(phoneNumberId);
       console.log(`[${requestId}] 📱 phone_number_id=${phoneNumberId}, sender=${senderWaId}, tenant=${tenantId}, messages=${extractedMessages.length}`);
@@ -156,15 +247,8 @@ module.exports = async function handler(req, res) {
           request_id: requestId,
         };
 
-        const resp = await fetch(backendUrl, {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-            Authorization: `Bearer ${sharedSecret}`,
-            "X-Tenant-ID": tenantId,
-            "X-Phone-Number-ID": phoneNumberId || "",
-            "X-Request-ID": requestId,
-        "ngrok-skip-browser-warning": "true",
+        const ack = FORWARD_BATCH_WINDOW_MS > 0 ? await forwardBatched(forwardPayload) : await forwardOne(forwardPayload);
+        console.log(`[${requestId}] ✅ Forwarded: queued=${ack?.messages_queued ?? "?"}`);
         return res.status(200).json({ ok: true, received: true, tenant: tenantId, phone_number_id: phoneNumberId, request_id: requestId });
       } catch (err) {
         console.error(`[${requestId}] ❌ Error forwarding:`, err.message);
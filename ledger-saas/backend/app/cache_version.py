@@ -0,0 +1,28 @@
+"""
+Versiones compartidas en BD (tabla cache_versions) para caches en proceso.
+
+Cada escritura relevante incrementa la versión de su clave dentro de la misma
+transacción; los demás workers comparan la versión que cachearon con la de la BD
+y recargan si cambió.
+"""
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .models import CacheVersion
+
+def bump(connection: Connection, name: str) -> None:
+    t = CacheVersion.__table__
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        ins = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(t).values(name=name, version=1)
+        connection.execute(ins.on_conflict_do_update(index_elements=[t.c.name], set_={"version": t.c.version + 1}))
+        return
+    res = connection.execute(update(t).where(t.c.name == name).values(version=t.c.version + 1))
+    if res.rowcount == 0:
+        connection.execute(t.insert().values(name=name, version=1))
+
+def get(db: Session, name: str) -> int:
+    t = CacheVersion.__table__
+    return db.execute(select(t.c.version).where(t.c.name == name)).scalar() or 0
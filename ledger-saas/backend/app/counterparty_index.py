@@ -0,0 +1,172 @@
+"""
+Índice invertido de nombres de contrapartes (tabla counterparty_tokens).
+
+match_counterparty, sin CUIT ni sufijo, antes traía todas las contrapartes del
+tenant y cruzaba tokens en Python. Con este índice sólo se leen las contrapartes
+que comparten al menos un token con el nombre buscado, rankeadas por overlap
+ponderado por IDF; el scoring final sigue siendo el de match_counterparty.
+
+El índice se mantiene con eventos ORM de Counterparty (insert/update/delete),
+así que basta con importar este módulo (lo hace app.match). Opcionalmente indexa
+trigramas de caracteres (COUNTERPARTY_TRIGRAMS=true) para tolerar typos.
+"""
+import math
+import os
+import time
+from weakref import WeakKeyDictionary
+from sqlalchemy import delete, event, func, inspect, insert, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .models import Counterparty, CounterpartyToken
+from .normalize import significant_tokens, char_trigrams
+
+# Configuración desde .env
+COUNTERPARTY_TRIGRAMS = os.getenv("COUNTERPARTY_TRIGRAMS", "false").lower() == "true"
+# Similitud (Jaccard de trigramas) mínima para puntuar un nombre sin tokens en común
+COUNTERPARTY_TRIGRAM_MIN_SIM = float(os.getenv("COUNTERPARTY_TRIGRAM_MIN_SIM", "0.5"))
+# Cuántas contrapartes candidatas se cargan para el scoring final
+COUNTERPARTY_CANDIDATES_LIMIT = int(os.getenv("COUNTERPARTY_CANDIDATES_LIMIT", "50"))
+# Tokens con más postings que esto se ignoran (salvo que sean los únicos)
+COUNTERPARTY_MAX_POSTINGS = int(os.getenv("COUNTERPARTY_MAX_POSTINGS", "5000"))
+
+# N del IDF (contrapartes del tenant): aproximado alcanza para rankear, se cachea por
+# engine (cada BD tiene sus tenants) y se descarta al insertar / borrar contrapartes
+DOC_COUNT_TTL_SECONDS = 300
+DOC_COUNT_MAX_TENANTS = 10000
+_doc_counts: WeakKeyDictionary[Engine, dict[int, tuple[int, float]]] = WeakKeyDictionary()
+
+KIND_WORD = "w"
+KIND_TRIGRAM = "t"
+_TOKEN_LEN = CounterpartyToken.__table__.c.token.type.length
+
+def token_rows(counterparty_id: int, tenant_id: int, normalized_name: str | None) -> list[dict]:
+    """Filas de counterparty_tokens para una contraparte."""
+    rows = [
+        {"counterparty_id": counterparty_id, "tenant_id": tenant_id, "kind": KIND_WORD, "token": t}
+        for t in {t[:_TOKEN_LEN] for t in significant_tokens(normalized_name)}
+    ]
+    if COUNTERPARTY_TRIGRAMS:
+        rows.extend(
+            {"counterparty_id": counterparty_id, "tenant_id": tenant_id, "kind": KIND_TRIGRAM, "token": g}
+            for g in char_trigrams(normalized_name)
+        )
+    return rows
+
+def _reindex(connection: Connection, target: Counterparty) -> None:
+    t = CounterpartyToken.__table__
+    connection.execute(delete(t).where(t.c.counterparty_id == target.id))
+    rows = token_rows(target.id, target.tenant_id, target.normalized_name)
+    if rows:
+        connection.execute(insert(t), rows)
+
+def _forget_doc_count(connection: Connection, tenant_id: int | None) -> None:
+    _doc_counts.get(connection.engine, {}).pop(tenant_id, None)
+
+@event.listens_for(Counterparty, "after_insert")
+def _on_insert(mapper, connection, target):
+    _reindex(connection, target)
+    _forget_doc_count(connection, target.tenant_id)
+
+@event.listens_for(Counterparty, "after_update")
+def _on_update(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.normalized_name.history.has_changes() or state.attrs.tenant_id.history.has_changes():
+        _reindex(connection, target)
+    for tenant_id in (*state.attrs.tenant_id.history.added, *state.attrs.tenant_id.history.deleted):
+        _forget_doc_count(connection, tenant_id)
+
+@event.listens_for(Counterparty, "before_delete")
+def _on_delete(mapper, connection, target):
+    t = CounterpartyToken.__table__
+    connection.execute(delete(t).where(t.c.counterparty_id == target.id))
+    _forget_doc_count(connection, target.tenant_id)
+
+def _doc_count(db: Session, tenant_id: int) -> int:
+    counts = _doc_counts.setdefault(db.get_bind().engine, {})
+    cached = counts.get(tenant_id)
+    now = time.monotonic()
+    if cached and cached[1] > now:
+        return cached[0]
+    n = db.execute(
+        select(func.count()).select_from(Counterparty).where(Counterparty.tenant_id == tenant_id)
+    ).scalar_one()
+    if len(counts) >= DOC_COUNT_MAX_TENANTS:
+        counts.clear()
+    counts[tenant_id] = (n, now + DOC_COUNT_TTL_SECONDS)
+    return n
+
+def _ranked_ids(db: Session, tenant_id: int, kind: str, tokens: set[str], n_docs: int) -> dict[int, float]:
+    """Overlap ponderado por IDF de cada contraparte que comparte algún token."""
+    if not tokens:
+        return {}
+    t = CounterpartyToken.__table__
+    base = (t.c.tenant_id == tenant_id, t.c.kind == kind)
+    df = dict(
+        db.execute(
+            select(t.c.token, func.count())
+            .where(*base, t.c.token.in_(tokens))
+            .group_by(t.c.token)
+        ).all()
+    )
+    if not df:
+        return {}
+    # Tokens muy frecuentes ("maria", "sa") aportan poco y cuestan mucho: se saltean,
+    # salvo que sean todo lo que hay (entonces se usa sólo el más raro)
+    selected = [tok for tok, n in df.items() if n <= COUNTERPARTY_MAX_POSTINGS] or [min(df, key=df.get)]
+    idf = {tok: math.log(1 + n_docs / df[tok]) for tok in selected}
+
+    scores: dict[int, float] = {}
+    for cp_id, tok in db.execute(select(t.c.counterparty_id, t.c.token).where(*base, t.c.token.in_(selected))):
+        scores[cp_id] = scores.get(cp_id, 0.0) + idf[tok]
+    return scores
+
+def candidate_ids(db: Session, tenant_id: int, norm: str, limit: int | None = None) -> list[int]:
+    """IDs de contrapartes candidatas para un nombre normalizado, mejor rankeadas primero."""
+    limit = limit or COUNTERPARTY_CANDIDATES_LIMIT
+    n_docs = max(_doc_count(db, tenant_id), 1)
+
+    def top(scores: dict[int, float]) -> list[int]:
+        return [cp_id for cp_id, _ in sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]]
+
+    ids = top(_ranked_ids(db, tenant_id, KIND_WORD, significant_tokens(norm), n_docs))
+    if COUNTERPARTY_TRIGRAMS:
+        seen = set(ids)
+        ids += [i for i in top(_ranked_ids(db, tenant_id, KIND_TRIGRAM, char_trigrams(norm), n_docs)) if i not in seen]
+    return ids
+
+def trigram_similarity(a: str | None, b: str | None) -> float:
+    """Jaccard de trigramas entre dos nombres normalizados."""
+    ga, gb = char_trigrams(a), char_trigrams(b)
+    if not ga or not gb:
+        return 0.0
+    return len(ga & gb) / len(ga | gb)
+
+def backfill(connection: Connection, chunk_size: int = 1000) -> int:
+    """Indexa las contrapartes sin tokens (BDs anteriores al índice). Devuelve cuántas indexó."""
+    cp, t = Counterparty.__table__, CounterpartyToken.__table__
+    kinds = [KIND_WORD] + ([KIND_TRIGRAM] if COUNTERPARTY_TRIGRAMS else [])
+    done, last_id = 0, 0
+    while True:
+        rows = connection.execute(
+            select(cp.c.id, cp.c.tenant_id, cp.c.normalized_name)
+            .where(
+                cp.c.id > last_id,
+                ~select(t.c.counterparty_id)
+                .where(t.c.counterparty_id == cp.c.id, t.c.kind.in_(kinds))
+                .group_by(t.c.counterparty_id)
+                .having(func.count(func.distinct(t.c.kind)) == len(kinds))
+                .exists(),
+            )
+            .order_by(cp.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return done
+        last_id = rows[-1].id
+        ids = [r.id for r in rows]
+        connection.execute(delete(t).where(t.c.counterparty_id.in_(ids)))
+        params = [p for r in rows for p in token_rows(r.id, r.tenant_id, r.normalized_name)]
+        if params:
+            connection.execute(insert(t), params)
+        done += len(rows)
@@ -0,0 +1,137 @@
+"""
+Executor de extracción (PDF / OCR) fuera del event loop.
+
+upload_receipt, ingest_sale y los webhooks de WhatsApp son async: llamar a PyMuPDF,
+pdfplumber o tesseract directo bloquea el loop y congela todos los requests del worker.
+run(fn, *args) manda la función a un ProcessPoolExecutor acotado:
+
+- EXTRACT_WORKERS procesos (spawn), reciclados cada EXTRACT_MAX_TASKS_PER_CHILD tareas
+  para acotar la memoria
+- a lo sumo EXTRACT_WORKERS tareas enviadas al pool a la vez (semáforo por event loop);
+  el resto espera su turno acá, así el timeout cuenta desde que la tarea arranca y no
+  incluye la espera en cola
+- EXTRACT_TASK_TIMEOUT segundos por tarea: si vence con la tarea corriendo se mata el
+  pool (un PDF colgado no retiene un proceso) y las otras tareas en curso se reintentan
+  una vez en el pool nuevo
+- como mucho EXTRACT_MAX_PENDING tareas en curso + en cola; más allá ExtractionBusy
+- EXTRACT_INLINE=true corre en un thread del proceso (tests / desarrollo)
+
+fn y sus argumentos tienen que ser picklables (funciones de módulo). Las métricas que
+registre fn dentro del worker no llegan a /metrics; las del executor sí:
+extract.queue_depth, extract.task_ms, extract.timeouts, extract.rejected,
+extract.pool_restarts.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from . import metrics
+
+# Configuración desde .env
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_MAX_TASKS_PER_CHILD = int(os.getenv("EXTRACT_MAX_TASKS_PER_CHILD", "50"))
+EXTRACT_TASK_TIMEOUT = float(os.getenv("EXTRACT_TASK_TIMEOUT", "60"))
+EXTRACT_MAX_PENDING = int(os.getenv("EXTRACT_MAX_PENDING", "32"))
+EXTRACT_INLINE = os.getenv("EXTRACT_INLINE", "false").lower() == "true"
+
+class ExtractionBusy(RuntimeError):
+    """Demasiadas extracciones en curso / en cola en este worker."""
+
+_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+_pending = 0
+# Turnos de ejecución por event loop (EXTRACT_WORKERS): lo que se envía al pool arranca enseguida
+_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _loop_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(max(1, EXTRACT_WORKERS))
+    return slots
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=EXTRACT_MAX_TASKS_PER_CHILD or None,
+            )
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Saca de servicio un pool (tarea colgada o worker muerto) matando sus procesos."""
+    global _pool
+    with _lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    # ProcessPoolExecutor no expone terminate(): sin esto shutdown esperaría a la tarea colgada
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+    metrics.inc("extract.pool_restarts")
+
+def _add_pending(delta: int) -> bool:
+    global _pending
+    with _lock:
+        if delta > 0 and _pending >= EXTRACT_MAX_PENDING:
+            return False
+        _pending += delta
+        metrics.set_gauge("extract.queue_depth", _pending)
+        return True
+
+async def run(fn: Callable[..., Any], *args, timeout: float | None = None) -> Any:
+    """Corre fn(*args) en el pool sin bloquear el loop. TimeoutError / ExtractionBusy."""
+    timeout = EXTRACT_TASK_TIMEOUT if timeout is None else timeout
+    if not _add_pending(1):
+        metrics.inc("extract.rejected")
+        raise ExtractionBusy(f"More than {EXTRACT_MAX_PENDING} extractions pending")
+
+    started = time.perf_counter()
+    try:
+        if EXTRACT_INLINE:
+            return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout)
+        async with _loop_slots():
+            return await _run_in_pool(fn, args, timeout)
+    finally:
+        _add_pending(-1)
+        metrics.observe("extract.task_ms", (time.perf_counter() - started) * 1000)
+
+async def _run_in_pool(fn: Callable[..., Any], args: tuple, timeout: float) -> Any:
+    """Un intento en el pool (y un reintento si el pool se reinició por otra tarea)."""
+    for attempt in (1, 2):
+        pool = _get_pool()
+        future = pool.submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except TimeoutError:
+            metrics.inc("extract.timeouts")
+            # Sólo una tarea que está corriendo (colgada) justifica matar el pool; si
+            # todavía no había arrancado, wait_for ya la canceló
+            if future.running():
+                _discard_pool(pool)
+            raise
+        except RuntimeError as e:
+            # Pool reiniciado por otra tarea (o worker muerto / pool cerrado): un reintento
+            if not isinstance(e, BrokenProcessPool) and "after shutdown" not in str(e):
+                raise
+            _discard_pool(pool)
+            if attempt == 2:
+                raise
+
+def shutdown() -> None:
+    """Cierra el pool (shutdown de la app)."""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
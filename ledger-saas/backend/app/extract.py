@@ -1,29 +1,91 @@
+import logging
+import os
 import re
-import pdfplumber
+from contextlib import closing
 from datetime import datetime
 
+from . import doc_formats, metrics
+from .doc_formats import DocFormat, Field, const
+from .pdf_backends import FALLBACK_BACKEND, PDF_OCR_ENABLED, get_backend
+
+logger = logging.getLogger(__name__)
+
+# Incrementar cuando cambie la extracción o el parseo (invalida app.parse_cache)
+PARSER_VERSION = "5"
+
+def _page_caps(raw: str) -> dict[str, int]:
+    caps = {}
+    for item in raw.split(","):
+        if "=" in item:
+            doc_type, n = item.split("=", 1)
+            caps[doc_type.strip()] = int(n)
+    return caps
+
+# Páginas a leer como máximo: PDF_MAX_PAGES mientras el tipo no se reconoce,
+# PDF_PAGE_CAPS ("tipo=n,...") una vez detectado
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "3"))
+PDF_PAGE_CAPS = _page_caps(os.getenv("PDF_PAGE_CAPS", "mp_transfer=2,galicia_movement=2,card_payment=2"))
+
+# Campos con los que un comprobante se da por completo (se deja de leer páginas)
+REQUIRED_FIELDS = {
+    "mp_transfer": ("amount", "datetime", "operation_id"),
+    "galicia_movement": ("amount", "datetime", "operation_id"),
+    "card_payment": ("amount", "datetime", "operation_id"),
+}
+
+def _scan_pages(backend, pdf_path: str) -> str:
+    """
+    Extrae página por página y corta apenas el parser del tipo detectado tiene todos
+    sus REQUIRED_FIELDS o se llega al tope de páginas. Cerrar el generador libera el
+    documento (y las páginas ya leídas) aunque queden páginas sin leer.
+    """
+    parts, read, text, doc_type = [], 0, "", "unknown"
+    with closing(backend.iter_pages(pdf_path)) as pages:
+        for page_text in pages:
+            read += 1
+            if page_text.strip():
+                parts.append(page_text)
+                text = "\n".join(parts).strip()
+                doc_type = detect_doc(text)
+                required = REQUIRED_FIELDS.get(doc_type)
+                if required and all(parse_by_type(doc_type, text).get(f) is not None for f in required):
+                    break
+            if read >= PDF_PAGE_CAPS.get(doc_type, PDF_MAX_PAGES):
+                break
+    metrics.observe("pdf_text.pages_read", read)
+    return text
+
 def extract_text_from_pdf(pdf_path: str) -> str:
-    parts = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            t = page.extract_text() or ""
-            if t.strip():
-                parts.append(t)
-    return "\n".join(parts).strip()
+    """
+    Texto del PDF con el backend rápido (PDF_TEXT_BACKEND, PyMuPDF por default). Si falla
+    o su texto no se reconoce (detect_doc == "unknown"), se usa pdfplumber; si tampoco hay
+    capa de texto (PDF escaneado) se hace OCR de las páginas (PDF_OCR_ENABLED). Las
+    páginas se leen de a una y sólo hasta tener el comprobante completo (ver _scan_pages).
+    """
+    backend = get_backend()
+    if backend.name == FALLBACK_BACKEND:
+        text = _scan_pages(backend, pdf_path)
+    else:
+        text = ""
+        try:
+            text = _scan_pages(backend, pdf_path)
+        except Exception as e:
+            logger.warning(f"⚠️  {backend.name} failed on {pdf_path}: {str(e)}")
+        if not text or detect_doc(text) == "unknown":
+            metrics.inc("pdf_text.fallbacks")
+            text = _scan_pages(get_backend(FALLBACK_BACKEND), pdf_path)
+
+    if not text and PDF_OCR_ENABLED:
+        metrics.inc("pdf_text.ocr_fallbacks")
+        try:
+            text = _scan_pages(get_backend("ocr"), pdf_path)
+        except Exception as e:
+            # Sin tesseract u OCR fallido: queda sin texto (needs_review), como antes
+            logger.warning(f"⚠️  OCR failed on {pdf_path}: {str(e)}")
+    return text
 
 def detect_doc(text: str) -> str:
-    t = (text or "").lower()
-    if "comprobante de transferencia" in t and "mercado pago" in t:
-        return "mp_transfer"
-    if "office banking" in t and "detalle de movimiento" in t:
-        return "galicia_movement"
-    if "comprobante de pago" in t and ("tarjeta de crédito" in t or "tarjeta de credito" in t):
-        return "card_payment"
-    return "unknown"
-
-def _grab(text: str, pattern: str, flags=re.I):
-    m = re.search(pattern, text, flags)
-    return m.group(1).strip() if m else None
+    return doc_formats.detect(text)
 
 def _money_to_float(s: str | None) -> float | None:
     if not s:
@@ -77,99 +139,87 @@ def _parse_dt_es(s: str | None) -> str | None:
         return datetime(int(y), int(mo), int(d), 0, 0, 0).isoformat()
     return None
 
+# Formatos soportados (app.doc_formats): fingerprints + patrones de campos. El orden de
+# registro es el orden de detección.
+MP_TRANSFER = doc_formats.register(DocFormat(
+    name="mp_transfer",
+    fingerprints=(("comprobante de transferencia",), ("mercado pago",)),
+    static={"source_system": "mercado_pago", "doc_type": "transfer", "currency": "ARS", "operation_id_type": "mp_operation"},
+    confidence=(90, 30),
+    fields=(
+        # monto: primera ocurrencia "$ 13.300"
+        Field("amount", r"\$\s*([0-9\.\,]+)", convert=_money_to_float),
+        Field("datetime", r"Comprobante de transferencia\s*\n([^\n]+)", convert=_parse_dt_es),
+        Field("operation_id", r"Número de operación de Mercado Pago\s*\n([0-9]+)"),
+        Field("operation_id", r"N° de operación\s*([0-9]+)"),
+        Field("concept", r"Motivo:\s*([^\n]+)"),
+        Field("payer_name", r"De\s*\n([^\n]+)"),
+        Field("payer_cuit", r"De\s*\n[^\n]+\nCUIT/CUIL:\s*([0-9\-]+)"),
+        Field("payer_bank", r"\b(Mercado Pago)\b", convert=const("Mercado Pago")),
+        Field("payer_account_type", r"(CVU):", flags=0, convert=const("CVU")),  # sensible a mayúsculas
+        Field("payer_account_id", r"CVU:\s*([0-9]+)"),
+        Field("payee_name", r"Para\s*\n([^\n]+)"),
+        Field("payee_cuit", r"Para\s*\n[^\n]+\nCUIT/CUIL:\s*([0-9\-]+)"),
+        Field("payee_bank", r"Para\s*\n[^\n]+\n[^\n]+\n([^\n]+)"),
+        Field("payee_account_type", r"(CBU):", flags=0, convert=const("CBU")),
+        Field("payee_account_id", r"CBU:\s*([0-9]+)"),
+    ),
+))
+
+GALICIA_MOVEMENT = doc_formats.register(DocFormat(
+    name="galicia_movement",
+    fingerprints=(("office banking",), ("detalle de movimiento",)),
+    static={"source_system": "galicia", "doc_type": "movement", "currency": "ARS", "operation_id_type": "receipt_number"},
+    confidence=(85, 25),
+    fields=(
+        # línea típica: "29/12/2025 Débito $ 38.000,00"
+        Field("amount", r"\b(?:Débito|Debito|Crédito|Credito)\b\s*\$\s*([0-9\.\,]+)", convert=_money_to_float),
+        Field("datetime", r"\b(\d{2}/\d{2}/\d{4})\b", convert=_parse_dt_es),
+        Field("direction", r"\b(Débito|Debito)\b", convert=const("debit")),
+        Field("direction", r"\b(Crédito|Credito)\b", convert=const("credit"), default="unknown"),
+        Field("operation_id", r"Número de comprobante\s*\n([0-9]+)"),
+        Field("operation_id", r"Nro\.?\s*Comprobante\s*([0-9]+)"),
+        Field("concept", r"(Trf Inmed Proveed)", convert=const("Trf Inmed Proveed")),
+        Field("concept", r"Tipo de movimiento\s*([^\n]+)"),
+        Field("payer_name", r"Leyendas adicionales\s*\n([^\n]+)"),
+        Field("payer_cuit", r"Leyendas adicionales\s*\n[^\n]+\n([0-9]{11})"),
+        Field("payer_bank", r"(BANCO DE[^\n]+)"),
+    ),
+))
+
+CARD_PAYMENT = doc_formats.register(DocFormat(
+    name="card_payment",
+    fingerprints=(("comprobante de pago",), ("tarjeta de crédito", "tarjeta de credito")),
+    static={"source_system": "card_payment", "doc_type": "card_payment", "currency": "ARS", "operation_id_type": "transaction_number"},
+    confidence=(80, 20),
+    always_review=True,  # CUIT enmascarado requiere base de contrapartes
+    fields=(
+        # el PDF tiene texto duplicado (TToottaall) pero el monto está como "$ 13.176,21"
+        Field("amount", r"\$\s*([0-9\.\,]+)", convert=_money_to_float),
+        Field("datetime", r"Comprobante de pago\s*\n([^\n]+)", convert=_parse_dt_es),
+        Field("operation_id", r"N[úu]mero de transacci[óo]n::?\s*([0-9]+)"),
+        Field("concept", r"TT[íi]ttuulloo::\s*([^\n]+)"),
+        Field("concept", r"T[íi]tulo:\s*([^\n]+)"),
+        Field("payer_name", r"De\s*\n([^\n]+)"),
+        # CUIT enmascarado: aparecen 2 sufijos (pagador y destinatario)
+        Field("payer_cuit_masked", r"CUIT\*+([0-9]{4,5})\*+\b"),
+        Field("payee_name", r"Para\s*\n([^\n]+)"),
+        Field("payee_cuit_masked", r"CUIT\*+([0-9]{4,5})\*+\b", nth=2),
+    ),
+))
+
 def parse_mp_transfer(text: str) -> dict:
-    # monto: primera ocurrencia "$ 13.300"
-    amount_raw = _grab(text, r"\$\s*([0-9\.\,]+)")
-    amount = _money_to_float(amount_raw)
-
-    dt_line = _grab(text, r"Comprobante de transferencia\s*\n([^\n]+)", flags=re.I)
-    dt_iso = _parse_dt_es(dt_line)
-
-    return {
-        "source_system": "mercado_pago",
-        "doc_type": "transfer",
-        "currency": "ARS",
-        "amount": amount,
-        "datetime": dt_iso,
-        "operation_id": _grab(text, r"Número de operación de Mercado Pago\s*\n([0-9]+)") or _grab(text, r"N° de operación\s*([0-9]+)"),
-        "operation_id_type": "mp_operation",
-        "concept": _grab(text, r"Motivo:\s*([^\n]+)"),
-        "payer_name": _grab(text, r"De\s*\n([^\n]+)"),
-        "payer_cuit": _grab(text, r"De\s*\n[^\n]+\nCUIT/CUIL:\s*([0-9\-]+)", flags=re.I),
-        "payer_bank": "Mercado Pago" if re.search(r"\bMercado Pago\b", text, re.I) else None,
-        "payer_account_type": "CVU" if "CVU:" in text else None,
-        "payer_account_id": _grab(text, r"CVU:\s*([0-9]+)"),
-        "payee_name": _grab(text, r"Para\s*\n([^\n]+)"),
-        "payee_cuit": _grab(text, r"Para\s*\n[^\n]+\nCUIT/CUIL:\s*([0-9\-]+)", flags=re.I),
-        "payee_bank": _grab(text, r"Para\s*\n[^\n]+\n[^\n]+\n([^\n]+)", flags=re.I),
-        "payee_account_type": "CBU" if "CBU:" in text else None,
-        "payee_account_id": _grab(text, r"CBU:\s*([0-9]+)"),
-        "needs_review": False if amount is not None else True,
-        "parse_confidence": 90 if amount is not None else 30,
-    }
+    return MP_TRANSFER.parse(text)
 
 def parse_galicia_movement(text: str) -> dict:
-    # línea típica: "29/12/2025 Débito $ 38.000,00"
-    amount_raw = _grab(text, r"\b(?:Débito|Debito|Crédito|Credito)\b\s*\$\s*([0-9\.\,]+)", flags=re.I)
-    amount = _money_to_float(amount_raw)
-
-    dt_raw = _grab(text, r"\b(\d{2}/\d{2}/\d{4})\b")
-    dt_iso = _parse_dt_es(dt_raw)
-
-    direction = "debit" if re.search(r"\bDébito\b|\bDebito\b", text, re.I) else "credit" if re.search(r"\bCrédito\b|\bCredito\b", text, re.I) else "unknown"
-
-    return {
-        "source_system": "galicia",
-        "doc_type": "movement",
-        "currency": "ARS",
-        "amount": amount,
-        "datetime": dt_iso,
-        "direction": direction,
-        "operation_id": _grab(text, r"Número de comprobante\s*\n([0-9]+)", flags=re.I) or _grab(text, r"Nro\.?\s*Comprobante\s*([0-9]+)", flags=re.I),
-        "operation_id_type": "receipt_number",
-        "concept": "Trf Inmed Proveed" if re.search(r"Trf Inmed Proveed", text, re.I) else _grab(text, r"Tipo de movimiento\s*([^\n]+)"),
-        "payer_name": _grab(text, r"Leyendas adicionales\s*\n([^\n]+)", flags=re.I),
-        "payer_cuit": _grab(text, r"Leyendas adicionales\s*\n[^\n]+\n([0-9]{11})", flags=re.I),
-        "payer_bank": _grab(text, r"(BANCO DE[^\n]+)", flags=re.I),
-        "needs_review": False if amount is not None else True,
-        "parse_confidence": 85 if amount is not None else 25,
-    }
+    return GALICIA_MOVEMENT.parse(text)
 
 def parse_card_payment(text: str) -> dict:
-    # el PDF tiene texto duplicado (TToottaall) pero el monto está como "$ 13.176,21"
-    amount_raw = _grab(text, r"\$\s*([0-9\.\,]+)")
-    amount = _money_to_float(amount_raw)
-
-    dt_line = _grab(text, r"Comprobante de pago\s*\n([^\n]+)", flags=re.I)
-    dt_iso = _parse_dt_es(dt_line)
-
-    # CUIT enmascarado: aparecen 2 sufijos
-    masked = re.findall(r"CUIT\*+([0-9]{4,5})\*+\b", text, flags=re.I)
-    payer_suffix = masked[0] if len(masked) >= 1 else None
-    payee_suffix = masked[1] if len(masked) >= 2 else None
-
-    return {
-        "source_system": "card_payment",
-        "doc_type": "card_payment",
-        "currency": "ARS",
-        "amount": amount,
-        "datetime": dt_iso,
-        "operation_id": _grab(text, r"N[úu]mero de transacci[óo]n::?\s*([0-9]+)", flags=re.I),
-        "operation_id_type": "transaction_number",
-        "concept": _grab(text, r"TT[íi]ttuulloo::\s*([^\n]+)", flags=re.I) or _grab(text, r"T[íi]tulo:\s*([^\n]+)", flags=re.I),
-        "payer_name": _grab(text, r"De\s*\n([^\n]+)", flags=re.I),
-        "payer_cuit_masked": payer_suffix,
-        "payee_name": _grab(text, r"Para\s*\n([^\n]+)", flags=re.I),
-        "payee_cuit_masked": payee_suffix,
-        "needs_review": True,  # CUIT enmascarado requiere base de contrapartes
-        "parse_confidence": 80 if amount is not None else 20,
-    }
+    return CARD_PAYMENT.parse(text)
 
 def parse_by_type(doc_type: str, text: str) -> dict:
-    if doc_type == "mp_transfer":
-        return parse_mp_transfer(text)
-    if doc_type == "galicia_movement":
-        return parse_galicia_movement(text)
-    if doc_type == "card_payment":
-        return parse_card_payment(text)
-    return {"needs_review": True, "parse_confidence": 10}
+    return doc_formats.parse(doc_type, text)
+
+def parse_document(text: str) -> dict:
+    """detect_doc + parse_by_type; documentos ambiguos / de baja confianza → needs_review."""
+    return doc_formats.parse_document(text)
@@ -0,0 +1,97 @@
+"""
+Cliente HTTP async compartido (httpx) para descargas de media (Meta Graph API, Twilio).
+
+- Un AsyncClient por event loop con keep-alive y pool de conexiones
+  (HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE): las descargas de un mismo host reusan la
+  conexión TLS en vez de abrir una nueva por request
+- HTTP/2 si está instalado h2 (`pip install httpx[http2]`); HTTP_HTTP2=false lo apaga
+- Como mucho HTTP_MAX_PER_HOST requests simultáneos por host (semáforo por host, el pool
+  de httpx sólo limita el total)
+- download(): el body va a disco por chunks (app.uploads: SHA-256 + UPLOAD_MAX_BYTES)
+
+aclose() en el shutdown de la app.
+"""
+import asyncio
+import os
+from typing import Callable
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import metrics, uploads
+
+# Configuración desde .env
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "8"))
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "auto").lower()  # auto | true | false
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+_host_limits: dict[str, asyncio.Semaphore] = {}
+
+def _http2_available() -> bool:
+    if HTTP_HTTP2 == "false":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        if HTTP_HTTP2 == "true":
+            raise
+        return False
+    return True
+
+def get_client() -> httpx.AsyncClient:
+    """Cliente del event loop actual (se crea la primera vez)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            http2=_http2_available(),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+        _client_loop = loop
+        _host_limits.clear()
+    return _client
+
+def _host_limit(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+    return _host_limits[host]
+
+async def get_json(url: str, **kwargs) -> dict:
+    client = get_client()
+    async with _host_limit(url):
+        resp = await client.get(url, **kwargs)
+    resp.raise_for_status()
+    metrics.inc("http.requests")
+    return resp.json()
+
+async def download(url: str, dest_path: Callable[[str], str], **kwargs) -> tuple[uploads.StoredFile, str]:
+    """
+    GET url por streaming a disco. dest_path(content_type) da el path final (la
+    extensión suele salir del content-type). Devuelve (StoredFile, content_type).
+    """
+    client = get_client()
+    async with _host_limit(url):
+        async with client.stream("GET", url, **kwargs) as resp:
+            resp.raise_for_status()
+            content_type = resp.headers.get("Content-Type", "application/octet-stream").lower()
+            stored = await uploads.save_stream(
+                resp.aiter_bytes(uploads.UPLOAD_CHUNK_BYTES),
+                dest_path(content_type),
+                declared_size=int(resp.headers.get("Content-Length") or 0),
+            )
+    metrics.inc("http.requests")
+    metrics.inc("http.download_bytes", stored.size)
+    return stored, content_type
+
+async def aclose() -> None:
+    global _client, _client_loop
+    client, _client, _client_loop = _client, None, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
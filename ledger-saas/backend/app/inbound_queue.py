@@ -0,0 +1,282 @@
+"""
+Cola durable de mensajes entrantes de WhatsApp sobre la tabla incoming_messages.
+
+El webhook (POST /webhooks/whatsapp/meta/cloud) sólo guarda cada mensaje como "queued"
+y responde; la descarga de media, extracción, parseo y matching los hacen workers:
+
+- claim: compare-and-set sobre la fila (status + lease vencido), así varios workers /
+  procesos comparten la cola sin broker externo ni locks de la BD
+- lease: el worker que toma un mensaje lo tiene por INBOUND_LEASE_SECONDS y lo renueva
+  (heartbeat) cada INBOUND_HEARTBEAT_SECONDS mientras procesa. Si el proceso muere, al
+  vencer el lease otro worker lo vuelve a tomar; si el heartbeat pierde el lease, se
+  cancela el procesamiento
+- reintentos con backoff exponencial (INBOUND_BACKOFF_BASE_SECONDS, tope
+  INBOUND_BACKOFF_MAX_SECONDS, con jitter); después de INBOUND_MAX_ATTEMPTS intentos el
+  mensaje queda "dead" (dead-letter) con el último error
+- estados: queued → processing → done | queued (reintento) | dead
+
+Runner local: main.py arranca INBOUND_WORKERS workers en el event loop de la app;
+con INBOUND_WORKERS=0 se corren aparte con `python -m app.inbound_queue`.
+Métricas: inbound.claimed, inbound.done, inbound.retries, inbound.dead,
+inbound.lease_lost, inbound.process_ms.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .models import IncomingMessage
+
+logger = logging.getLogger(__name__)
+
+# Configuración desde .env
+INBOUND_WORKERS = int(os.getenv("INBOUND_WORKERS", "2"))
+INBOUND_LEASE_SECONDS = float(os.getenv("INBOUND_LEASE_SECONDS", "120"))
+INBOUND_HEARTBEAT_SECONDS = float(os.getenv("INBOUND_HEARTBEAT_SECONDS", "30"))
+INBOUND_MAX_ATTEMPTS = int(os.getenv("INBOUND_MAX_ATTEMPTS", "5"))
+INBOUND_BACKOFF_BASE_SECONDS = float(os.getenv("INBOUND_BACKOFF_BASE_SECONDS", "5"))
+INBOUND_BACKOFF_MAX_SECONDS = float(os.getenv("INBOUND_BACKOFF_MAX_SECONDS", "600"))
+INBOUND_POLL_SECONDS = float(os.getenv("INBOUND_POLL_SECONDS", "2"))
+
+Handler = Callable[[Session, IncomingMessage], Awaitable[None]]
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _claimable(now: datetime):
+    t = IncomingMessage.__table__
+    return or_(
+        and_(t.c.status == "queued", or_(t.c.available_at.is_(None), t.c.available_at <= now)),
+        # Worker caído: el lease venció sin completar
+        and_(t.c.status == "processing", t.c.lease_expires_at < now),
+    )
+
+def backoff_seconds(attempt: int) -> float:
+    """Espera antes del intento attempt + 1 (exponencial con tope y jitter)."""
+    delay = min(INBOUND_BACKOFF_MAX_SECONDS, INBOUND_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def claim(db: Session, owner: str, limit: int = 1) -> list[int]:
+    """Toma hasta limit mensajes disponibles para owner (lease) y devuelve sus ids."""
+    t = IncomingMessage.__table__
+    now = _now()
+    candidates = db.execute(
+        select(t.c.id).where(_claimable(now)).order_by(t.c.id).limit(limit * 4)
+    ).scalars().all()
+    claimed = []
+    for row_id in candidates:
+        # Otro worker puede haberla tomado entre el select y el update: sólo gana uno
+        res = db.execute(
+            update(t)
+            .where(t.c.id == row_id, _claimable(now))
+            .values(
+                status="processing",
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=INBOUND_LEASE_SECONDS),
+                attempts=t.c.attempts + 1,
+            )
+        )
+        db.commit()
+        if res.rowcount == 1:
+            claimed.append(row_id)
+            if len(claimed) >= limit:
+                break
+    metrics.inc("inbound.claimed", len(claimed))
+    return claimed
+
+def heartbeat(db: Session, row_id: int, owner: str) -> bool:
+    """Renueva el lease. False si el mensaje ya no es de owner (lease perdido)."""
+    t = IncomingMessage.__table__
+    res = db.execute(
+        update(t)
+        .where(t.c.id == row_id, t.c.status == "processing", t.c.lease_owner == owner)
+        .values(lease_expires_at=_now() + timedelta(seconds=INBOUND_LEASE_SECONDS))
+    )
+    db.commit()
+    return res.rowcount == 1
+
+def complete(db: Session, row_id: int, owner: str) -> bool:
+    t = IncomingMessage.__table__
+    res = db.execute(
+        update(t)
+        .where(t.c.id == row_id, t.c.status == "processing", t.c.lease_owner == owner)
+        .values(status="done", lease_owner=None, lease_expires_at=None, last_error=None)
+    )
+    db.commit()
+    return res.rowcount == 1
+
+def fail(db: Session, row_id: int, owner: str, error: str) -> str | None:
+    """Reintento con backoff o dead-letter. Devuelve el nuevo estado (None si perdió el lease)."""
+    t = IncomingMessage.__table__
+    attempts = db.execute(select(t.c.attempts).where(t.c.id == row_id)).scalar() or 0
+    if attempts >= INBOUND_MAX_ATTEMPTS:
+        values = {"status": "dead"}
+    else:
+        values = {"status": "queued", "available_at": _now() + timedelta(seconds=backoff_seconds(attempts))}
+    res = db.execute(
+        update(t)
+        .where(t.c.id == row_id, t.c.status == "processing", t.c.lease_owner == owner)
+        .values(lease_owner=None, lease_expires_at=None, last_error=error[:500], **values)
+    )
+    db.commit()
+    if res.rowcount != 1:
+        return None
+    metrics.inc("inbound.dead" if values["status"] == "dead" else "inbound.retries")
+    return values["status"]
+
+def requeue_dead(db: Session) -> int:
+    """Vuelve a encolar los mensajes en dead-letter (con los intentos en cero)."""
+    t = IncomingMessage.__table__
+    res = db.execute(
+        update(t).where(t.c.status == "dead").values(status="queued", attempts=0, available_at=None)
+    )
+    db.commit()
+    return res.rowcount
+
+class Worker:
+    """Loop claim → handler → complete / fail, con heartbeat mientras procesa."""
+
+    def __init__(self, session_factory: Callable[[], Session], handler: Handler, wakeup: asyncio.Event | None = None):
+        self.session_factory = session_factory
+        self.handler = handler
+        self.wakeup = wakeup or asyncio.Event()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def run_once(self) -> bool:
+        """Procesa un mensaje si hay alguno disponible. False si la cola está vacía."""
+        db = self.session_factory()
+        try:
+            ids = claim(db, self.owner)
+        finally:
+            db.close()
+        if not ids:
+            return False
+        await self._process(ids[0])
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Inbound worker error: {str(e)}")
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), INBOUND_POLL_SECONDS)
+            except TimeoutError:
+                pass
+
+    async def _heartbeat(self, row_id: int, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(INBOUND_HEARTBEAT_SECONDS)
+            db = self.session_factory()
+            try:
+                alive = heartbeat(db, row_id, self.owner)
+            finally:
+                db.close()
+            if not alive:
+                metrics.inc("inbound.lease_lost")
+                logger.warning(f"⚠️  Lease lost for inbound message {row_id}, cancelling")
+                task.cancel()
+                return
+
+    async def _process(self, row_id: int) -> None:
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            row = db.get(IncomingMessage, row_id)
+            if row.attempts > INBOUND_MAX_ATTEMPTS:
+                # Vuelve por lease vencido una y otra vez (ej. el proceso muere con este mensaje)
+                fail(db, row_id, self.owner, row.last_error or "Lease expired too many times")
+                return
+            task = asyncio.create_task(self.handler(db, row))
+            beat = asyncio.create_task(self._heartbeat(row_id, task))
+            try:
+                await asyncio.wait({task})
+            finally:
+                beat.cancel()
+                # Shutdown: el mensaje queda "processing" y se retoma al vencer el lease
+                task.cancel()
+            if task.cancelled():
+                return
+            error = task.exception()
+            if error is None:
+                metrics.inc("inbound.done" if complete(db, row_id, self.owner) else "inbound.lease_lost")
+                return
+            db.rollback()
+            status = fail(db, row_id, self.owner, f"{type(error).__name__}: {str(error)}")
+            logger.warning(f"⚠️  Inbound message {row_id} failed ({status}): {str(error)}")
+        finally:
+            db.close()
+            metrics.observe("inbound.process_ms", (time.perf_counter() - started) * 1000)
+
+_wakeup: asyncio.Event | None = None
+_tasks: list[asyncio.Task] = []
+
+def notify() -> None:
+    """Despierta a los workers del proceso (mensaje recién encolado)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def start(handler: Handler, workers: int | None = None) -> None:
+    """Arranca los workers en el event loop actual (startup de la app)."""
+    global _wakeup
+    from .db import SessionLocal
+
+    workers = INBOUND_WORKERS if workers is None else workers
+    if workers <= 0 or _tasks:
+        return
+    _wakeup = asyncio.Event()
+    for _ in range(workers):
+        _tasks.append(asyncio.create_task(Worker(SessionLocal, handler, _wakeup).run()))
+    logger.info(f"✅ Inbound queue: {workers} workers")
+
+async def stop() -> None:
+    global _wakeup
+    tasks = list(_tasks)
+    _tasks.clear()
+    _wakeup = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Workers de la cola de mensajes entrantes de WhatsApp")
+    parser.add_argument("--workers", type=int, default=max(1, INBOUND_WORKERS))
+    parser.add_argument("--requeue-dead", action="store_true", help="Reencolar los mensajes en dead-letter y salir")
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+    from .routers.whatsapp import process_inbound_message
+
+    if args.requeue_dead:
+        db = SessionLocal()
+        try:
+            print(f"✅ Requeued {requeue_dead(db)} messages")
+        finally:
+            db.close()
+        return
+
+    async def run():
+        await start(process_inbound_message, args.workers)
+        await asyncio.gather(*_tasks)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,20 @@
 """
 Módulo de ingest de ventas desde imágenes o PDFs.
-Extrae información estructurada usando OCR (pytesseract) y pdfplumber.
+Extrae información estructurada usando OCR (pytesseract) y app.pdf_backends (PyMuPDF / pdfplumber).
 """
 import re
 from datetime import datetime
 from typing import Dict, Any
 
+# Incrementar cuando cambie la extracción o el parseo (invalida app.parse_cache)
+PARSER_VERSION = "3"
+
 def extract_text_from_image(image_path: str) -> str:
-    """Extrae texto de una imagen usando pytesseract."""
+    """Extrae texto de una imagen (app.ocr: preprocesado + tesserocr / pytesseract)."""
     try:
-        import pytesseract
-        from PIL import Image
-        
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image, lang='spa')
+        from .ocr import image_text
+
+        text = image_text(image_path)
         return text if text else "[No text detected in image]"
     except ImportError:
         return "[ERROR: pytesseract no está instalado. Instala con: pip install pytesseract]"
@@ -21,14 +22,19 @@ def extract_text_from_image(image_path: str) -> str:
         return f"[ERROR OCR: {str(e)}]"
 
 def extract_text_from_pdf_ingest(pdf_path: str) -> str:
-    """Extrae texto de un PDF usando pdfplumber."""
+    """Extrae texto de un PDF (PDF_TEXT_BACKEND; pdfplumber si el backend falla o no devuelve texto)."""
+    from .pdf_backends import FALLBACK_BACKEND, get_backend
+
     try:
-        import pdfplumber
-        
-        text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
+        backend = get_backend()
+        try:
+            text = backend.extract_text(pdf_path)
+        except Exception:
+            if backend.name == FALLBACK_BACKEND:
+                raise
+            text = ""
+        if not text and backend.name != FALLBACK_BACKEND:
+            text = get_backend(FALLBACK_BACKEND).extract_text(pdf_path)
         return text
     except Exception as e:
         return f"[ERROR: {str(e)}]"
@@ -1,17 +1,26 @@
 import os
+from functools import partial
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 from .db import Base, engine, SessionLocal
 from .seed import seed_if_empty
+from .migrations import run_migrations
+from . import executor, http_client, inbound_queue, metrics
 from .routers import auth, receipts, sales, transactions, chat, whatsapp, export, users
 
 load_dotenv()
 
 app = FastAPI(title="Ledger SaaS (POC)")
+app.router.on_shutdown.append(executor.shutdown)
+# Workers de la cola de WhatsApp en este proceso (INBOUND_WORKERS=0: python -m app.inbound_queue)
+app.router.on_startup.append(partial(inbound_queue.start, whatsapp.process_inbound_message))
+app.router.on_shutdown.append(inbound_queue.stop)
+app.router.on_shutdown.append(http_client.aclose)
 
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 SEED_DEMO = os.getenv("SEED_DEMO", "true").lower() in ("1", "true", "yes", "y")
 
@@ -40,6 +49,11 @@ app.add_middleware(
 def health():
     return {"ok": True}
 
+@app.get("/metrics")
+def get_metrics():
+    """Contadores en proceso de este worker (cache de ventas, etc.)."""
+    return metrics.snapshot()
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(receipts.router)
@@ -1,24 +1,22 @@
 import os
 import re
-import unicodedata
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from .models import Transaction, Sale, Counterparty
+from .normalize import parse_iso as _parse_iso, normalize_name, digits_only
+from . import counterparty_index, metrics, sale_cache
+from .vector_score import TxFeatures, rank_arrays
 
 # Configuración desde .env
 AUTO_MATCH_THRESHOLD = int(os.getenv("AUTO_MATCH_THRESHOLD", "85"))
 AUTO_MATCH_GAP = int(os.getenv("AUTO_MATCH_GAP", "10"))
 DATE_WINDOW_HOURS = int(os.getenv("DATE_WINDOW_HOURS", "72"))
-
-def normalize_name(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    for w in [" sa", " srl", " s a", " s r l"]:
-        s = s.replace(w, "")
-    return s.strip()
+# Diferencia de monto (%) aceptada en un strong ID match (comisiones bancarias)
+STRONG_ID_AMOUNT_TOL_PCT = float(os.getenv("STRONG_ID_AMOUNT_TOL_PCT", "3"))
+# Cantidad de candidatos desde la cual el scoring se hace vectorizado (0 = nunca)
+VECTOR_SCORE_MIN_CANDIDATES = int(os.getenv("VECTOR_SCORE_MIN_CANDIDATES", "200"))
 
 def extract_visible_suffix(masked: str | None) -> str | None:
     if not masked:
@@ -27,16 +25,6 @@ def extract_visible_suffix(masked: str | None) -> str | None:
     joined = "".join(digits)
     return joined if len(joined) in (4, 5) else None
 
-def _parse_iso(dt: str | None) -> datetime | None:
-    if not dt:
-        return None
-    try:
-        if "T" in dt:
-            return datetime.fromisoformat(dt)
-        return datetime.fromisoformat(dt + "T00:00:00")
-    except Exception:
-        return None
-
 @dataclass
 class MatchResult:
     id: int | None
@@ -64,39 +52,160 @@ def match_sale(db: Session, tx: Transaction, days_window: int = 2, amount_tol: f
     """
     if tx.amount is None:
         return MatchResult(None, None, 0, "unmatched", method="no_amount", needs_review=False)
-    
-    tx_dt = _parse_iso(tx.datetime)
+
+    index = sale_cache.get_index(db, tx.tenant_id)
+    if index is not None:
+        res = _match_sale_cached(db, index, tx, amount_tol)
+        if res is not None:
+            return res
+
+    # REGLA 1: Strong ID Match - lookup indexado por (tenant_id, external_ref), antes de
+    # cualquier búsqueda de candidatos y sin depender de la ventana de fechas
+    if tx.operation_id:
+        s = db.query(Sale).filter(
+            Sale.tenant_id == tx.tenant_id,
+            Sale.external_ref == tx.operation_id,
+            Sale.status == "open",
+        ).first()
+        strong = _strong_id_check(tx, s, amount_tol) if s else None
+        if strong:
+            return strong
+
+    tx_dt = tx.datetime_ts or _parse_iso(tx.datetime)
     if not tx_dt:
         return MatchResult(None, None, 0, "unmatched", method="no_date", needs_review=False)
 
-    # Calcular ventana de fechas usando DATE_WINDOW_HOURS
-    hours_window = DATE_WINDOW_HOURS / 24.0
-    start = tx_dt - timedelta(days=hours_window)
-    end = tx_dt + timedelta(days=hours_window)
-    
-    # Buscar candidatos por monto
-    candidates = db.query(Sale).filter(
+    start, end = _date_window(tx_dt)
+    # Solo ventas abiertas: una venta ya matcheada no puede ser reclamada por otra transacción
+    amount_filter = (
         Sale.tenant_id == tx.tenant_id,
+        Sale.status == "open",
         Sale.currency == tx.currency,
         Sale.amount >= float(tx.amount) - amount_tol,
         Sale.amount <= float(tx.amount) + amount_tol,
-    ).all()
+    )
 
-    # REGLA 1: Strong ID Match
+    # Buscar candidatos por monto dentro de la ventana (usa ix_sales_candidate)
+    candidates = db.query(Sale).filter(*amount_filter, Sale.datetime_ts.between(start, end)).all()
+
+    scored = _rank_candidates(tx, tx_dt, ((s, s.datetime_ts) for s in candidates), start, end)
+    return _decide(scored)
+
+def _match_sale_cached(db: Session, index, tx: Transaction, amount_tol: float) -> MatchResult | None:
+    """
+    Mismas reglas que match_sale pero contra el SaleIndex de app.sale_cache.
+    Devuelve None si la venta ganadora ya no está abierta en la BD (cache vieja de
+    otro worker): se invalida la entrada y match_sale sigue por la BD.
+    """
+    res = None
     if tx.operation_id:
-        for s in candidates:
-            if s.external_ref and tx.operation_id == s.external_ref:
-                return MatchResult(
-                    s.id, s.id, 100, "matched",
-                    method="strong_id",
-                    needs_review=False,
-                    candidates=[{"sale_id": s.id, "score": 100, "reasons": ["ID de operación coincide exactamente"]}]
-                )
+        s = index.by_ref(tx.operation_id)
+        res = _strong_id_check(tx, s, amount_tol) if s else None
+    if res is None:
+        tx_dt = tx.datetime_ts or _parse_iso(tx.datetime)
+        if not tx_dt:
+            return MatchResult(None, None, 0, "unmatched", method="no_date", needs_review=False)
+        start, end = _date_window(tx_dt)
+        res = _decide(_rank_index_window(index, tx, tx_dt, amount_tol, start, end))
+
+    if res.id is not None:
+        status = db.execute(select(Sale.status).where(Sale.id == res.id)).scalar()
+        if status != "open":
+            metrics.inc("sale_cache.stale")
+            sale_cache.invalidate(tx.tenant_id)
+            return None
+    return res
+
+def _date_window(tx_dt: datetime) -> tuple[datetime, datetime]:
+    """Ventana de fechas [start, end] alrededor de la transacción (DATE_WINDOW_HOURS)."""
+    hours_window = DATE_WINDOW_HOURS / 24.0
+    return tx_dt - timedelta(days=hours_window), tx_dt + timedelta(days=hours_window)
+
+def _strong_id_check(tx: Transaction, s: Sale, amount_tol: float) -> MatchResult | None:
+    """
+    Evalúa la venta cuyo external_ref coincide con el operation_id de la transacción.
+    Con monto igual es un strong ID match; con una diferencia chica (comisiones, hasta
+    STRONG_ID_AMOUNT_TOL_PCT) se reporta aparte como strong_id_amount_diff para revisión.
+    """
+    if s.currency != tx.currency:
+        return None
+    amount = float(tx.amount)
+    diff = abs(float(s.amount) - amount)
+    if diff <= amount_tol:
+        return _strong_id_result(s)
+    if diff <= abs(amount) * STRONG_ID_AMOUNT_TOL_PCT / 100:
+        return MatchResult(
+            s.id, s.id, 95, "matched",
+            method="strong_id_amount_diff",
+            needs_review=True,
+            candidates=[{
+                "sale_id": s.id,
+                "score": 95,
+                "reasons": [
+                    "ID de operación coincide exactamente",
+                    f"Diferencia de monto de {diff:.2f} (posible comisión)",
+                ],
+            }],
+        )
+    return None
+
+def _strong_id_result(s: Sale) -> MatchResult:
+    return MatchResult(
+        s.id, s.id, 100, "matched",
+        method="strong_id",
+        needs_review=False,
+        candidates=[{"sale_id": s.id, "score": 100, "reasons": ["ID de operación coincide exactamente"]}]
+    )
+
+def _tx_features(tx: Transaction, tx_dt: datetime) -> TxFeatures:
+    return TxFeatures(
+        amount=float(tx.amount),
+        dt=tx_dt,
+        payer_cuit=tx.payer_cuit,
+        suffix=extract_visible_suffix(tx.payer_cuit_masked) if tx.payer_cuit_masked else None,
+        concept_lower=tx.concept.lower() if tx.concept else None,
+        phone_concept=digits_only(tx.concept),
+        phone_payer=digits_only(tx.payer_cuit),
+        tokens=set(t for t in normalize_name(tx.payer_name).split() if len(t) > 2),
+    )
+
+def _rank_index_window(index, tx: Transaction, tx_dt: datetime, amount_tol: float, start: datetime, end: datetime) -> list:
+    """
+    Ranking de los candidatos de un SaleIndex (re-match, cache de ventas) dentro de la
+    ventana. Con muchos candidatos usa los arrays que el índice guarda por bucket.
+    """
+    amount = float(tx.amount)
+    if VECTOR_SCORE_MIN_CANDIDATES > 0:
+        parts = index.window_arrays(tx.currency, amount, amount_tol, start, end, VECTOR_SCORE_MIN_CANDIDATES)
+        if parts is not None:
+            return rank_arrays(_tx_features(tx, tx_dt), parts)
+    return _rank_candidates(tx, tx_dt, index.in_window(tx.currency, amount, amount_tol, start, end), start, end)
+
+def _rank_candidates(tx: Transaction, tx_dt: datetime, candidates, start: datetime, end: datetime) -> list:
+    """
+    Calcula el score de cada candidato (pares (sale, sale_dt)) dentro de la ventana
+    y los devuelve ordenados de mejor a peor.
+    Compartido por match_sale y el re-match batch (app.rematch) para que ambos
+    caminos tomen exactamente las mismas decisiones.
+
+    Del lado de la venta usa las features precalculadas (customer_name_tokens,
+    customer_phone_digits, external_ref_lower); las de la transacción se calculan
+    una sola vez antes del loop. No se vectoriza acá: armar los SaleArrays desde filas
+    sueltas del ORM cuesta más que este loop (benchmarks.run, db_vector_speedup); el
+    scoring vectorizado se usa sólo con los arrays cacheados de _rank_index_window.
+    """
+    f = _tx_features(tx, tx_dt)
+
+    tx_amount = f.amount
+    tx_suffix = f.suffix
+    tx_concept_lower = f.concept_lower
+    tx_phone_concept = f.phone_concept
+    tx_phone_payer = f.phone_payer
+    tx_tokens = f.tokens
 
     # Calcular scores para todos los candidatos
     scored = []
-    for s in candidates:
-        s_dt = _parse_iso(s.datetime)
+    for s, s_dt in candidates:
         if not s_dt or not (start <= s_dt <= end):
             continue
         
@@ -121,42 +230,31 @@ def match_sale(db: Session, tx: Transaction, days_window: int = 2, amount_tol: f
             score += 20
             reasons.append("CUIT cliente coincide")
             evidence_types.append(("cuit_exact", 100))
-        elif tx.payer_cuit_masked and s.customer_cuit:
-            suffix = extract_visible_suffix(tx.payer_cuit_masked)
-            if suffix and s.customer_cuit.endswith(suffix):
-                score += 10
-                reasons.append("Últimos dígitos del CUIT coinciden")
-                evidence_types.append(("cuit_suffix", 50))
+        elif tx_suffix and s.customer_cuit and s.customer_cuit.endswith(tx_suffix):
+            score += 10
+            reasons.append("Últimos dígitos del CUIT coinciden")
+            evidence_types.append(("cuit_suffix", 50))
         
         # Puntuación por referencia externa
-        if s.external_ref and tx.concept:
-            if s.external_ref.lower() in tx.concept.lower():
+        if s.external_ref_lower and tx_concept_lower:
+            if s.external_ref_lower in tx_concept_lower:
                 score += 15
                 reasons.append("Referencia en concepto")
                 evidence_types.append(("ref_match", 90))
         
         # Puntuación por teléfono (evidencia fuerte)
-        if s.customer_phone:
-            s_phone = re.sub(r"\D", "", s.customer_phone)
-            # Buscar en distintos campos
-            tx_phone_concept = re.sub(r"\D", "", tx.concept or "")
-            tx_phone_payer = re.sub(r"\D", "", tx.payer_cuit or "")
-            
-            if s_phone and (
-                (tx_phone_concept and s_phone in tx_phone_concept) or
-                (tx_phone_payer and s_phone == tx_phone_payer)
-            ):
-                score += 15
-                reasons.append("Teléfono cliente coincide")
-                evidence_types.append(("phone_match", 80))
+        s_phone = s.customer_phone_digits
+        if s_phone and (
+            (tx_phone_concept and s_phone in tx_phone_concept) or
+            (tx_phone_payer and s_phone == tx_phone_payer)
+        ):
+            score += 15
+            reasons.append("Teléfono cliente coincide")
+            evidence_types.append(("phone_match", 80))
         
         # Puntuación por nombre
-        norm_tx = normalize_name(tx.payer_name)
-        norm_sale = normalize_name(s.customer_name)
-        if norm_tx and norm_sale:
-            tokens_tx = set(t for t in norm_tx.split() if len(t) > 2)
-            tokens_sale = set(t for t in norm_sale.split() if len(t) > 2)
-            intersection = tokens_tx.intersection(tokens_sale)
+        if tx_tokens and s.customer_name_tokens:
+            intersection = tx_tokens.intersection(s.customer_name_tokens.split())
             if intersection:
                 name_match_score = min(10, len(intersection) * 2)
                 score += name_match_score
@@ -164,7 +262,7 @@ def match_sale(db: Session, tx: Transaction, days_window: int = 2, amount_tol: f
                 evidence_types.append(("name_match", 70))
         
         # Monto exacto (ya filtrado, pero es evidencia)
-        if abs(float(s.amount) - float(tx.amount)) < 0.01:
+        if abs(float(s.amount) - tx_amount) < 0.01:
             evidence_types.append(("amount_exact", 60))
         
         # Calcular evidence_rank para tie-break
@@ -173,12 +271,15 @@ def match_sale(db: Session, tx: Transaction, days_window: int = 2, amount_tol: f
         
         scored.append((s, score, reasons, evidence_rank, time_delta))
 
+    # Ordenar por score desc, luego por evidence_rank desc, luego por time_delta asc, luego por sale_id asc
+    scored.sort(key=lambda x: (-x[1], -x[3], x[4], x[0].id))
+    return scored
+
+def _decide(scored: list) -> MatchResult:
+    """Aplica las reglas de auto-match sobre la lista de candidatos ya ordenada."""
     if not scored:
         return MatchResult(None, None, 0, "unmatched", method="no_candidates", needs_review=False)
 
-    # Ordenar por score desc, luego por evidence_rank desc, luego por time_delta asc, luego por sale_id asc
-    scored.sort(key=lambda x: (-x[1], -x[3], x[4], x[0].id))
-    
     best_sale, best_score, best_reasons, best_evidence, best_time_delta = scored[0]
     
     # Preparar candidatos para respuesta (top 3)
@@ -257,25 +358,52 @@ def match_sale(db: Session, tx: Transaction, days_window: int = 2, amount_tol: f
         candidates=candidates_out
     )
 
+def sale_match_updates(tx: Transaction, res: MatchResult) -> dict:
+    """Campos de Transaction que cambian al aplicar un resultado de match_sale."""
+    updates = {
+        "match_score": res.score,
+        "match_status": res.status,
+        "match_method": res.method,
+        "matched_sale_id": tx.matched_sale_id,
+        "needs_review": tx.needs_review,
+    }
+    if res.status == "matched" and res.id:
+        updates["matched_sale_id"] = res.id
+        updates["needs_review"] = res.needs_review
+    elif res.status == "ambiguous":
+        updates["needs_review"] = True
+    return updates
+
+def apply_sale_match(db: Session, tx: Transaction, res: MatchResult) -> None:
+    """Aplica el resultado a la transacción y marca la venta ganadora como matched."""
+    for field, value in sale_match_updates(tx, res).items():
+        setattr(tx, field, value)
+    if res.status == "matched" and res.id:
+        db.query(Sale).filter(Sale.id == res.id).update({"status": "matched"}, synchronize_session="fetch")
+        sale_cache.touch(db, tx.tenant_id)
+
 def match_counterparty(db: Session, tenant_id: int, name: str | None, cuit: str | None, cuit_masked: str | None) -> MatchResult:
     if cuit:
         cand = db.query(Counterparty).filter(Counterparty.tenant_id == tenant_id, Counterparty.cuit == cuit).first()
         if cand:
-            return MatchResult(cand.id, cand.id, 100, "matched", [{"counterparty_id": cand.id, "score": 100, "reasons": ["CUIT exacto"]}])
+            return MatchResult(cand.id, cand.id, 100, "matched", candidates=[{"counterparty_id": cand.id, "score": 100, "reasons": ["CUIT exacto"]}])
 
     norm = normalize_name(name or "")
     suffix = extract_visible_suffix(cuit_masked)
 
-    q = db.query(Counterparty).filter(Counterparty.tenant_id == tenant_id)
+    candidates = []
     if suffix:
-        q = q.filter(Counterparty.cuit_suffix == suffix)
-
-    candidates = q.all()
+        candidates = db.query(Counterparty).filter(
+            Counterparty.tenant_id == tenant_id, Counterparty.cuit_suffix == suffix
+        ).all()
     if not candidates and norm:
-        candidates = db.query(Counterparty).filter(Counterparty.tenant_id == tenant_id).all()
+        # Índice invertido: sólo contrapartes que comparten algún token (o trigrama) del nombre
+        ids = counterparty_index.candidate_ids(db, tenant_id, norm)
+        if ids:
+            candidates = db.query(Counterparty).filter(Counterparty.id.in_(ids)).all()
 
     if not candidates:
-        return MatchResult(None, None, 0, "unmatched", [])
+        return MatchResult(None, None, 0, "unmatched", candidates=[])
 
     def name_score(a: str, b: str) -> int:
         ta = set([t for t in a.split() if len(t) > 2])
@@ -295,6 +423,11 @@ def match_counterparty(db: Session, tenant_id: int, name: str | None, cuit: str
             if name_s > 0:
                 score += name_s
                 reasons.append("Nombre coincide parcialmente")
+            elif counterparty_index.COUNTERPARTY_TRIGRAMS:
+                sim = counterparty_index.trigram_similarity(norm, c.normalized_name)
+                if sim >= counterparty_index.COUNTERPARTY_TRIGRAM_MIN_SIM:
+                    score += int(sim * 55)
+                    reasons.append("Nombre similar (trigramas)")
         scored.append((c, score, reasons))
 
     scored.sort(key=lambda x: x[1], reverse=True)
@@ -306,9 +439,56 @@ def match_counterparty(db: Session, tenant_id: int, name: str | None, cuit: str
     ]
     
     if len(scored) > 1 and (scored[0][1] - scored[1][1]) < 10:
-        return MatchResult(None, None, best_score, "ambiguous", candidates_out)
+        return MatchResult(None, None, best_score, "ambiguous", candidates=candidates_out)
     
     if best_score >= 85:
-        return MatchResult(best.id, best.id, best_score, "matched", candidates_out)
+        return MatchResult(best.id, best.id, best_score, "matched", candidates=candidates_out)
     else:
-        return MatchResult(None, None, best_score, "unmatched", candidates_out)
+        return MatchResult(None, None, best_score, "unmatched", candidates=candidates_out)
+
+REVERSE_MATCH_STATUSES = ("unmatched", "ambiguous")
+
+def reverse_match_sale(db: Session, sale: Sale, amount_tol: float = 0.01) -> list[int]:
+    """
+    Matching desde el lado de la venta: cuando se carga una venta, busca transacciones
+    unmatched/ambiguous del tenant que podrían corresponderle (operation_id == external_ref,
+    o misma moneda con monto y fecha dentro de la ventana) y las vuelve a pasar por
+    match_sale, con las mismas reglas que el camino normal. Sólo se aplica el resultado
+    cuando la venta ganadora es la nueva: las demás transacciones quedan como estaban
+    (cargar una venta no re-matchea transacciones contra otras ventas).
+    Las candidatas se procesan por id; la venta se marca matched con la primera que la gane.
+    La venta tiene que estar en la sesión con id (flush). Devuelve los ids vinculados a la venta.
+    """
+    if sale.amount is None or sale.status != "open":
+        return []
+    base = (
+        Transaction.tenant_id == sale.tenant_id,
+        Transaction.match_status.in_(REVERSE_MATCH_STATUSES),
+    )
+    txs = []
+    if sale.external_ref:
+        txs += db.query(Transaction).filter(*base, Transaction.operation_id == sale.external_ref).order_by(Transaction.id).all()
+    if sale.datetime_ts:
+        start, end = _date_window(sale.datetime_ts)
+        amount = float(sale.amount)
+        # Usa ix_transactions_reverse (tenant, moneda, estado, monto, fecha)
+        txs += db.query(Transaction).filter(
+            *base,
+            Transaction.currency == sale.currency,
+            Transaction.amount >= amount - amount_tol,
+            Transaction.amount <= amount + amount_tol,
+            Transaction.datetime_ts.between(start, end),
+        ).order_by(Transaction.id).all()
+
+    linked, seen = [], set()
+    for tx in txs:
+        if tx.id in seen:
+            continue
+        seen.add(tx.id)
+        res = match_sale(db, tx, amount_tol=amount_tol)
+        if res.status == "matched" and res.id == sale.id:
+            apply_sale_match(db, tx, res)
+            linked.append(tx.id)
+            # La venta ya no está abierta: ninguna otra candidata puede ganarla
+            break
+    return linked
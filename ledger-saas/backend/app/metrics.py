@@ -0,0 +1,45 @@
+"""
+Métricas en proceso (contadores, gauges y observaciones de duración).
+
+Livianas y sin dependencias: cada worker de uvicorn tiene las suyas y se exponen
+en GET /metrics (main.py) como JSON.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+_gauges: dict[str, float] = {}
+_observations: dict[str, dict] = {}
+
+def inc(name: str, n: int = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+def observe(name: str, value: float) -> None:
+    """Registra una observación (ej. duración en ms): count, sum y max."""
+    with _lock:
+        o = _observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        o["count"] += 1
+        o["sum"] += value
+        o["max"] = max(o["max"], value)
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "observations": {
+                k: {**v, "avg": round(v["sum"] / v["count"], 3) if v["count"] else None}
+                for k, v in _observations.items()
+            },
+        }
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
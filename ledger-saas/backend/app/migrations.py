@@ -0,0 +1,153 @@
+"""
+Migraciones livianas e idempotentes para BDs existentes.
+
+`Base.metadata.create_all` crea tablas nuevas pero no agrega columnas ni índices
+a tablas que ya existen. Este módulo completa esa parte y corre los backfills de
+columnas derivadas, así no hace falta borrar `app.db` para tomar cambios de modelos.
+Se ejecuta al iniciar la app (main.py), después de create_all.
+"""
+import logging
+from sqlalchemy import bindparam, inspect, or_, select, update
+from sqlalchemy.engine import Engine
+
+from .db import Base
+from . import counterparty_index
+from .models import Sale, Transaction
+from .normalize import parse_iso, name_tokens, digits_only
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK = 1000
+
+def _add_missing_columns(engine: Engine) -> None:
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.warning(f"⚠️  Cannot add NOT NULL column {table.name}.{column.name} without default")
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.exec_driver_sql(ddl)
+                logger.info(f"✅ Added column {table.name}.{column.name}")
+
+def _create_missing_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                # Ej: índice único sobre datos viejos con duplicados; la app sigue funcionando
+                logger.warning(f"⚠️  Could not create index {index.name}: {str(e)}")
+
+def _backfill_datetime_ts(engine: Engine) -> None:
+    """Completa datetime_ts a partir del string ISO `datetime` en ventas y transacciones."""
+    for model in (Sale, Transaction):
+        table = model.__table__
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    select(table.c.id, table.c.datetime)
+                    .where(
+                        table.c.id > last_id,
+                        table.c.datetime_ts.is_(None),
+                        table.c.datetime.is_not(None),
+                    )
+                    .order_by(table.c.id)
+                    .limit(BACKFILL_CHUNK)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                params = []
+                for r in rows:
+                    ts = parse_iso(r.datetime)
+                    if ts is not None:
+                        params.append({"row_id": r.id, "ts": ts})
+                if params:
+                    conn.execute(
+                        update(table)
+                        .where(table.c.id == bindparam("row_id"))
+                        .values(datetime_ts=bindparam("ts")),
+                        params,
+                    )
+
+def _backfill_sale_features(engine: Engine) -> None:
+    """Completa las features de matching precalculadas de ventas cargadas antes de existir."""
+    t = Sale.__table__
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(t.c.id, t.c.customer_name, t.c.customer_phone, t.c.external_ref)
+                .where(
+                    t.c.id > last_id,
+                    or_(
+                        t.c.customer_name.is_not(None) & t.c.customer_name_tokens.is_(None),
+                        t.c.customer_phone.is_not(None) & t.c.customer_phone_digits.is_(None),
+                        t.c.external_ref.is_not(None) & t.c.external_ref_lower.is_(None),
+                    ),
+                )
+                .order_by(t.c.id)
+                .limit(BACKFILL_CHUNK)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            conn.execute(
+                update(t)
+                .where(t.c.id == bindparam("row_id"))
+                .values(
+                    customer_name_tokens=bindparam("tokens"),
+                    customer_phone_digits=bindparam("phone"),
+                    external_ref_lower=bindparam("ref"),
+                ),
+                [
+                    {
+                        "row_id": r.id,
+                        "tokens": name_tokens(r.customer_name) if r.customer_name is not None else None,
+                        "phone": digits_only(r.customer_phone) if r.customer_phone is not None else None,
+                        "ref": r.external_ref.lower() if r.external_ref is not None else None,
+                    }
+                    for r in rows
+                ],
+            )
+
+def _backfill_matched_sales(engine: Engine) -> None:
+    """Marca como matched las ventas ya vinculadas antes de que el matching actualizara Sale.status."""
+    sales, txs = Sale.__table__, Transaction.__table__
+    linked = select(txs.c.matched_sale_id).where(
+        txs.c.match_status == "matched",
+        txs.c.matched_sale_id.is_not(None),
+    )
+    with engine.begin() as conn:
+        conn.execute(
+            update(sales)
+            .where(sales.c.status == "open", sales.c.id.in_(linked))
+            .values(status="matched")
+        )
+
+def _backfill_counterparty_tokens(engine: Engine) -> None:
+    """Arma el índice invertido de nombres para contrapartes creadas antes de existir."""
+    with engine.begin() as conn:
+        n = counterparty_index.backfill(conn, BACKFILL_CHUNK)
+    if n:
+        logger.info(f"✅ Indexed {n} counterparties")
+
+def run_migrations(engine: Engine) -> None:
+    _add_missing_columns(engine)
+    _create_missing_indexes(engine)
+    _backfill_datetime_ts(engine)
+    _backfill_sale_features(engine)
+    _backfill_matched_sales(engine)
+    _backfill_counterparty_tokens(engine)
@@ -1,7 +1,8 @@
 from datetime import datetime
-from sqlalchemy import String, Numeric, Boolean, Integer, ForeignKey, UniqueConstraint, DateTime, func
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import String, Text, Numeric, Boolean, Integer, ForeignKey, UniqueConstraint, Index, DateTime, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 from .db import Base
+from .normalize import parse_iso, name_tokens, digits_only
 
 class TimestampMixin:
     """Mixin para agregar created_at y updated_at a modelos.
@@ -12,6 +13,19 @@ class TimestampMixin:
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
+class DatetimeTsMixin:
+    """Mixin para modelos con `datetime` ISO en string (Sale, Transaction).
+    
+    Mantiene `datetime_ts` como timestamp real e indexado, para que la ventana de
+    fechas del matching se pueda aplicar en la BD en vez de parsear en Python.
+    """
+    datetime_ts: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, index=True)
+
+    @validates("datetime")
+    def _sync_datetime_ts(self, key, value):
+        self.datetime_ts = parse_iso(value)
+        return value
+
 class Tenant(Base, TimestampMixin):
     __tablename__ = "tenants"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -39,6 +53,11 @@ class User(Base, TimestampMixin):
 
 class Counterparty(Base, TimestampMixin):
     __tablename__ = "counterparties"
+    __table_args__ = (
+        # Lookups de match_counterparty por CUIT completo y por últimos dígitos
+        Index("ix_counterparties_tenant_cuit", "tenant_id", "cuit"),
+        Index("ix_counterparties_tenant_suffix", "tenant_id", "cuit_suffix"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     tenant_id: Mapped[int] = mapped_column(Integer, ForeignKey("tenants.id"))
 
@@ -52,8 +71,29 @@ class Counterparty(Base, TimestampMixin):
 
     tenant = relationship("Tenant")
 
-class Sale(Base, TimestampMixin):
+class CounterpartyToken(Base):
+    """Índice invertido token -> contraparte, por tenant.
+    
+    kind "w" = palabra del nombre normalizado (> 2 letras), "t" = trigrama de
+    caracteres (opcional). Lo mantiene app/counterparty_index.py con eventos ORM.
+    """
+    __tablename__ = "counterparty_tokens"
+    __table_args__ = (
+        Index("ix_counterparty_tokens_lookup", "tenant_id", "kind", "token"),
+    )
+    counterparty_id: Mapped[int] = mapped_column(Integer, ForeignKey("counterparties.id"), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(1), primary_key=True)
+    token: Mapped[str] = mapped_column(String(60), primary_key=True)
+    tenant_id: Mapped[int] = mapped_column(Integer, ForeignKey("tenants.id"))
+
+class Sale(Base, TimestampMixin, DatetimeTsMixin):
     __tablename__ = "sales"
+    __table_args__ = (
+        # Query de candidatos de match_sale: tenant + moneda + monto + ventana de fechas
+        Index("ix_sales_candidate", "tenant_id", "currency", "amount", "datetime_ts"),
+        # Strong ID: external_ref único por tenant (lookup O(1) desde operation_id)
+        Index("uq_sales_tenant_external_ref", "tenant_id", "external_ref", unique=True),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     tenant_id: Mapped[int] = mapped_column(Integer, ForeignKey("tenants.id"))
 
@@ -69,8 +109,27 @@ class Sale(Base, TimestampMixin):
 
     status: Mapped[str] = mapped_column(String(20), default="open")  # open/matched
 
-class Transaction(Base, TimestampMixin):
+    # Features de matching precalculadas al escribir (ver _sync_match_features)
+    customer_name_tokens: Mapped[str | None] = mapped_column(String(220), nullable=True)  # tokens normalizados
+    customer_phone_digits: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    external_ref_lower: Mapped[str | None] = mapped_column(String(120), nullable=True)
+
+    @validates("customer_name", "customer_phone", "external_ref")
+    def _sync_match_features(self, key, value):
+        if key == "customer_name":
+            self.customer_name_tokens = name_tokens(value) if value is not None else None
+        elif key == "customer_phone":
+            self.customer_phone_digits = digits_only(value) if value is not None else None
+        elif key == "external_ref":
+            self.external_ref_lower = value.lower() if value is not None else None
+        return value
+
+class Transaction(Base, TimestampMixin, DatetimeTsMixin):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Reverse matching al cargar una venta: pendientes por moneda, monto y fecha
+        Index("ix_transactions_reverse", "tenant_id", "currency", "match_status", "amount", "datetime_ts"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     tenant_id: Mapped[int] = mapped_column(Integer, ForeignKey("tenants.id"))
 
@@ -83,7 +142,7 @@ class Transaction(Base, TimestampMixin):
     amount: Mapped[float | None] = mapped_column(Numeric(14, 2), nullable=True)
     direction: Mapped[str] = mapped_column(String(10), default="unknown")      # debit/credit/unknown
 
-    operation_id: Mapped[str | None] = mapped_column(String(120), nullable=True)
+    operation_id: Mapped[str | None] = mapped_column(String(120), nullable=True, index=True)
     operation_id_type: Mapped[str] = mapped_column(String(40), default="unknown")
 
     payer_name: Mapped[str | None] = mapped_column(String(180), nullable=True)
@@ -170,9 +229,12 @@ class WhatsAppEvent(Base, TimestampMixin):
 
 
 class IncomingMessage(Base, TimestampMixin):
+    """Mensaje entrante de WhatsApp: idempotencia por message_id y cola durable (app.inbound_queue)."""
     __tablename__ = "incoming_messages"
     __table_args__ = (
         UniqueConstraint("tenant_id", "message_id", name="uq_incoming_message"),
+        # Claim de la cola: pendientes por estado y próximo intento
+        Index("ix_incoming_messages_queue", "status", "available_at"),
         {"sqlite_autoincrement": True},
     )
 
@@ -183,7 +245,50 @@ class IncomingMessage(Base, TimestampMixin):
     phone_number_id: Mapped[str | None] = mapped_column(String(40), nullable=True)
     msg_type: Mapped[str | None] = mapped_column(String(20), nullable=True)  # text/document/image
     content: Mapped[str | None] = mapped_column(String(2000), nullable=True)
-    status: Mapped[str] = mapped_column(String(20), default="queued")  # queued/processing/done
+    status: Mapped[str] = mapped_column(String(20), default="queued")  # queued/processing/done/dead
     timestamp: Mapped[str | None] = mapped_column(String(30), nullable=True)
 
+    # Cola (app.inbound_queue): mensaje completo, intentos, backoff y lease del worker
+    payload: Mapped[str | None] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    available_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    lease_owner: Mapped[str | None] = mapped_column(String(80), nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    # Transaction creada para el mensaje (mismo commit): un reintento no la duplica
+    transaction_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("transactions.id"), nullable=True)
+
     tenant = relationship("Tenant")
+
+
+class CacheVersion(Base):
+    """Contador de versión por clave (ej. "sales:<tenant_id>").
+    
+    Las caches en proceso lo comparan para invalidarse cuando otro worker escribe.
+    """
+    __tablename__ = "cache_versions"
+
+    name: Mapped[str] = mapped_column(String(80), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ParseCacheEntry(Base):
+    """Resultado de extracción/parseo de un archivo, por SHA-256 del contenido.
+    
+    kind separa los pipelines (receipt_pdf, sale_pdf, sale_image) y parser_version
+    invalida las entradas cuando cambia el parser. Ver app/parse_cache.py.
+    """
+    __tablename__ = "parse_cache"
+    __table_args__ = (
+        Index("ix_parse_cache_last_used", "last_used_at"),
+    )
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20), primary_key=True)
+    parser_version: Mapped[str] = mapped_column(String(20), primary_key=True)
+    text: Mapped[str | None] = mapped_column(Text, nullable=True)
+    parsed_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+    size_bytes: Mapped[int] = mapped_column(Integer, default=0)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,47 @@
+"""Normalización de valores compartida por modelos y matching."""
+import re
+import unicodedata
+from datetime import datetime, timezone
+
+def normalize_name(s: str) -> str:
+    s = (s or "").strip().lower()
+    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    s = re.sub(r"[^a-z0-9\s]", " ", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    for w in [" sa", " srl", " s a", " s r l"]:
+        s = s.replace(w, "")
+    return s.strip()
+
+def name_tokens(s: str | None) -> str:
+    """Tokens significativos (> 2 letras) del nombre normalizado, únicos y separados por espacio."""
+    return " ".join(sorted(significant_tokens(normalize_name(s))))
+
+def significant_tokens(norm: str | None) -> set[str]:
+    """Tokens (> 2 letras) de un nombre ya normalizado con normalize_name."""
+    return {t for t in (norm or "").split() if len(t) > 2}
+
+def char_trigrams(norm: str | None) -> set[str]:
+    """Trigramas de caracteres de un nombre ya normalizado (con bordes de palabra)."""
+    padded = f" {norm.strip()} " if norm and norm.strip() else ""
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def digits_only(s: str | None) -> str:
+    return re.sub(r"\D", "", s or "")
+
+def parse_iso(dt: str | None) -> datetime | None:
+    """
+    Parsea un string ISO (con o sin hora) a datetime naive.
+    Si trae offset se convierte a UTC para que sea comparable con el resto.
+    """
+    if not dt:
+        return None
+    try:
+        if "T" in dt:
+            parsed = datetime.fromisoformat(dt)
+        else:
+            parsed = datetime.fromisoformat(dt + "T00:00:00")
+    except Exception:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,149 @@
+"""
+OCR de comprobantes en imagen (fotos y capturas de WhatsApp, uploads de /v1/receipts).
+
+- preprocess: orientación EXIF, achica a OCR_MAX_SIDE px, escala de grises,
+  autocontraste y binarización con umbral de Otsu (tesseract rinde mejor y mucho más
+  rápido que con la foto de 12 MP a color)
+- PSM (page segmentation mode) por tipo de documento: primera pasada con
+  OCR_DEFAULT_PSM; si el tipo detectado tiene otro PSM en OCR_PSM_BY_TYPE se repite con
+  ese, y si no se reconoce se reintenta con PSM 11 (texto disperso)
+- Engine: tesserocr (API de tesseract dentro del proceso, se crea una vez por worker y
+  queda "caliente") si está instalado; si no pytesseract (un proceso tesseract por
+  llamada). OCR_ENGINE fuerza uno.
+
+Pensado para correr en los workers de app.executor (parse_cache.receipt_image_async).
+"""
+import os
+from typing import Callable
+
+# Incrementar cuando cambie el preprocesado o la estrategia de PSM (invalida app.parse_cache)
+OCR_VERSION = "1"
+
+def _psm_map(raw: str) -> dict[str, int]:
+    out = {}
+    for item in raw.split(","):
+        if "=" in item:
+            doc_type, psm = item.split("=", 1)
+            out[doc_type.strip()] = int(psm)
+    return out
+
+# Configuración desde .env
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")  # auto | tesserocr | pytesseract
+OCR_LANG = os.getenv("OCR_LANG", "spa")
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1800"))
+OCR_DEFAULT_PSM = int(os.getenv("OCR_DEFAULT_PSM", "4"))
+OCR_PSM_BY_TYPE = _psm_map(os.getenv("OCR_PSM_BY_TYPE", "mp_transfer=4,card_payment=4,galicia_movement=6"))
+SPARSE_PSM = 11
+
+def otsu_threshold(histogram: list[int]) -> int:
+    """Umbral que maximiza la varianza entre clases de un histograma de 256 niveles."""
+    total = sum(histogram)
+    if not total:
+        return 128
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = weight_bg = 0
+    best, threshold = -1.0, 128
+    for i, h in enumerate(histogram):
+        weight_bg += h
+        if not weight_bg:
+            continue
+        weight_fg = total - weight_bg
+        if not weight_fg:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+def preprocess(image):
+    """Imagen PIL → imagen binaria (modo "L", 0 / 255) lista para tesseract."""
+    from PIL import ImageOps
+
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > OCR_MAX_SIDE:
+        image = image.copy()
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+    gray = ImageOps.autocontrast(image.convert("L"))
+    threshold = otsu_threshold(gray.histogram())
+    return gray.point(lambda p: 255 if p > threshold else 0)
+
+class _TesserocrEngine:
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr
+
+        self.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+
+    def text(self, image, psm: int, timeout: float | None = None) -> str:
+        # tesserocr no tiene timeout: el presupuesto se controla entre páginas / en el executor
+        self.api.SetPageSegMode(psm)
+        self.api.SetImage(image)
+        return self.api.GetUTF8Text()
+
+class _PytesseractEngine:
+    name = "pytesseract"
+
+    def text(self, image, psm: int, timeout: float | None = None) -> str:
+        import pytesseract
+
+        return pytesseract.image_to_string(image, lang=OCR_LANG, config=f"--psm {psm}", timeout=timeout or 0)
+
+_engine = None
+
+def get_engine():
+    """Engine del proceso (uno por worker del pool, reutilizado entre imágenes)."""
+    global _engine
+    if _engine is None:
+        if OCR_ENGINE in ("auto", "tesserocr"):
+            try:
+                _engine = _TesserocrEngine()
+            except ImportError:
+                if OCR_ENGINE == "tesserocr":
+                    raise
+        if _engine is None:
+            _engine = _PytesseractEngine()
+    return _engine
+
+def image_text(path: str, psm: int | None = None) -> str:
+    """OCR de un archivo de imagen con preprocesado (sin elegir PSM por tipo)."""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        prepared = preprocess(image)
+    return get_engine().text(prepared, psm or OCR_DEFAULT_PSM, None)
+
+def receipt_image_text(image, classify: Callable[[str], str] | None = None, timeout: float | None = None) -> str:
+    """
+    OCR de un comprobante (imagen PIL): primera pasada con OCR_DEFAULT_PSM y, según lo
+    que detecte classify (default extract.detect_doc), una segunda con el PSM del tipo o
+    PSM 11. timeout (segundos) limita cada llamada al engine cuando el engine lo soporta.
+    """
+    if classify is None:
+        from .extract import detect_doc as classify
+
+    prepared = preprocess(image)
+    engine = get_engine()
+    text = engine.text(prepared, OCR_DEFAULT_PSM, timeout)
+    doc_type = classify(text)
+
+    if doc_type == "unknown":
+        retry = engine.text(prepared, SPARSE_PSM, timeout)
+        return retry if classify(retry) != "unknown" else text
+    psm = OCR_PSM_BY_TYPE.get(doc_type, OCR_DEFAULT_PSM)
+    if psm != OCR_DEFAULT_PSM:
+        retry = engine.text(prepared, psm, timeout)
+        if classify(retry) == doc_type:
+            return retry
+    return text
+
+def receipt_text(path: str, classify: Callable[[str], str] | None = None) -> str:
+    """receipt_image_text de un archivo de imagen."""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.load()
+        return receipt_image_text(image, classify)
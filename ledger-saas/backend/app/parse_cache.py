@@ -0,0 +1,217 @@
+"""
+Cache persistente de extracción + parseo por contenido (SHA-256 del archivo).
+
+El mismo comprobante suele llegar varias veces (upload web, WhatsApp, reenvío del
+cliente). La entrada guarda el texto extraído y el dict parseado, con clave
+(sha256, kind, parser_version); un hit evita todo el trabajo de PDF / OCR.
+
+- kind: "receipt_pdf" / "receipt_image" (/v1/receipts y WhatsApp), "sale_pdf" y "sale_image" (/v1/sales/ingest)
+- parser_version: extract.PARSER_VERSION (+ ocr.OCR_VERSION en imágenes) / ingest.PARSER_VERSION
+- Evicción por tamaño total (PARSE_CACHE_MAX_BYTES), la menos usada primero
+- Hits / misses / evictions en app.metrics (GET /metrics)
+- *_async: la extracción corre en app.executor (fuera del event loop)
+- La clave es el sha256 que calcula app.uploads al guardar el archivo (sin releerlo ni
+  tenerlo en memoria)
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import executor, metrics
+from .models import ParseCacheEntry
+
+# Configuración desde .env
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "true").lower() == "true"
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+def sha256_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def _is_error_text(text: str | None) -> bool:
+    # ingest devuelve los errores de OCR / PDF como texto "[ERROR...]": no se cachean
+    return bool(text) and text.lstrip().startswith("[ERROR")
+
+def _record_rate() -> None:
+    counters = metrics.snapshot()["counters"]
+    hits, misses = counters.get("parse_cache.hits", 0), counters.get("parse_cache.misses", 0)
+    metrics.set_gauge("parse_cache.hit_rate", round(hits / (hits + misses), 4))
+
+def _insert(db: Session, row: dict) -> None:
+    t = ParseCacheEntry.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        ins = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(t).values(**row)
+        db.execute(ins.on_conflict_do_nothing())
+    elif db.get(ParseCacheEntry, (row["sha256"], row["kind"], row["parser_version"])) is None:
+        db.execute(t.insert().values(**row))
+
+def _evict(db: Session) -> None:
+    """Borra las entradas menos usadas hasta quedar bajo PARSE_CACHE_MAX_BYTES."""
+    t = ParseCacheEntry.__table__
+    total = db.execute(select(func.coalesce(func.sum(t.c.size_bytes), 0))).scalar_one()
+    if total <= PARSE_CACHE_MAX_BYTES:
+        return
+    excess = total - PARSE_CACHE_MAX_BYTES
+    victims = []
+    for sha, kind, version, size in db.execute(
+        select(t.c.sha256, t.c.kind, t.c.parser_version, t.c.size_bytes).order_by(t.c.last_used_at, t.c.hits)
+    ):
+        victims.append((sha, kind, version))
+        excess -= size
+        if excess <= 0:
+            break
+    for sha, kind, version in victims:
+        db.execute(delete(t).where(t.c.sha256 == sha, t.c.kind == kind, t.c.parser_version == version))
+    metrics.inc("parse_cache.evictions", len(victims))
+
+def _lookup(db: Session, key: str, kind: str, parser_version: str) -> tuple[str, dict | None] | None:
+    t = ParseCacheEntry.__table__
+    row = db.execute(
+        select(t.c.text, t.c.parsed_json).where(t.c.sha256 == key, t.c.kind == kind, t.c.parser_version == parser_version)
+    ).first()
+    if row is None:
+        metrics.inc("parse_cache.misses")
+        _record_rate()
+        return None
+    db.execute(
+        update(t)
+        .where(t.c.sha256 == key, t.c.kind == kind, t.c.parser_version == parser_version)
+        .values(hits=t.c.hits + 1, last_used_at=datetime.now(timezone.utc))
+    )
+    metrics.inc("parse_cache.hits")
+    _record_rate()
+    return row.text or "", json.loads(row.parsed_json) if row.parsed_json else None
+
+def _store(db: Session, key: str, kind: str, parser_version: str, text: str, parsed: dict | None) -> None:
+    if _is_error_text(text):
+        return
+    now = datetime.now(timezone.utc)
+    parsed_json = json.dumps(parsed, ensure_ascii=False) if parsed is not None else None
+    _insert(db, {
+        "sha256": key,
+        "kind": kind,
+        "parser_version": parser_version,
+        "text": text,
+        "parsed_json": parsed_json,
+        "size_bytes": len((text or "").encode("utf-8")) + len((parsed_json or "").encode("utf-8")),
+        "hits": 0,
+        "created_at": now,
+        "last_used_at": now,
+    })
+    _evict(db)
+
+def cached(
+    db: Session,
+    key: str,
+    kind: str,
+    parser_version: str,
+    compute: Callable[[], tuple[str, dict | None]],
+) -> tuple[str, dict | None]:
+    """
+    Devuelve (texto, parsed) del archivo con SHA-256 `key`, calculándolo con compute()
+    sólo si no está en la cache. Escribe en la sesión del caller (se persiste con su commit).
+    """
+    if not PARSE_CACHE_ENABLED:
+        return compute()
+    hit = _lookup(db, key, kind, parser_version)
+    if hit is not None:
+        return hit
+    text, parsed = compute()
+    _store(db, key, kind, parser_version, text, parsed)
+    return text, parsed
+
+async def cached_async(
+    db: Session,
+    key: str,
+    kind: str,
+    parser_version: str,
+    compute: Callable[[], Awaitable[tuple[str, dict | None]]],
+) -> tuple[str, dict | None]:
+    """cached() con compute asíncrono (extracción en app.executor)."""
+    if not PARSE_CACHE_ENABLED:
+        return await compute()
+    hit = _lookup(db, key, kind, parser_version)
+    if hit is not None:
+        return hit
+    text, parsed = await compute()
+    _store(db, key, kind, parser_version, text, parsed)
+    return text, parsed
+
+def extract_receipt_pdf(path: str) -> tuple[str, dict | None]:
+    """Extracción + parseo de un comprobante PDF (corre en un worker de app.executor)."""
+    from .extract import extract_text_from_pdf, parse_document
+
+    text = extract_text_from_pdf(path)
+    if not text:
+        return "", None
+    return text, parse_document(text)
+
+def extract_receipt_image(path: str) -> tuple[str, dict | None]:
+    """OCR + parseo de un comprobante en imagen (corre en un worker de app.executor)."""
+    from .extract import parse_document
+    from .ocr import receipt_text
+
+    text = receipt_text(path)
+    if not text.strip():
+        return "", None
+    return text, parse_document(text)
+
+def extract_sale_document(path: str, is_pdf: bool) -> tuple[str, dict]:
+    """Extracción + parseo de una venta PDF / imagen (corre en un worker de app.executor)."""
+    from .ingest import extract_text_from_image, extract_text_from_pdf_ingest, parse_sale_from_text
+
+    text = extract_text_from_pdf_ingest(path) if is_pdf else extract_text_from_image(path)
+    return text, parse_sale_from_text(text)
+
+def receipt_pdf(db: Session, path: str, sha256: str) -> tuple[str, dict | None]:
+    """Texto y parseo de un comprobante PDF (parsed None si el PDF no tiene texto)."""
+    from .extract import PARSER_VERSION
+
+    return cached(db, sha256, "receipt_pdf", PARSER_VERSION, lambda: extract_receipt_pdf(path))
+
+async def receipt_pdf_async(db: Session, path: str, sha256: str) -> tuple[str, dict | None]:
+    """receipt_pdf() con la extracción en el pool de procesos (endpoints async)."""
+    from .extract import PARSER_VERSION
+
+    async def compute():
+        return await executor.run(extract_receipt_pdf, path)
+
+    return await cached_async(db, sha256, "receipt_pdf", PARSER_VERSION, compute)
+
+async def receipt_image_async(db: Session, path: str, sha256: str) -> tuple[str, dict | None]:
+    """Texto (OCR) y parseo de un comprobante en imagen, en el pool de procesos."""
+    from .extract import PARSER_VERSION
+    from .ocr import OCR_VERSION
+
+    async def compute():
+        started = time.perf_counter()
+        try:
+            return await executor.run(extract_receipt_image, path)
+        finally:
+            metrics.observe("ocr.image_ms", (time.perf_counter() - started) * 1000)
+
+    return await cached_async(db, sha256, "receipt_image", f"{PARSER_VERSION}.{OCR_VERSION}", compute)
+
+def sale_document(db: Session, path: str, sha256: str, is_pdf: bool) -> tuple[str, dict]:
+    """Texto y parseo de una venta (PDF u imagen) para /v1/sales/ingest."""
+    from .ingest import PARSER_VERSION
+
+    return cached(
+        db, sha256, "sale_pdf" if is_pdf else "sale_image", PARSER_VERSION,
+        lambda: extract_sale_document(path, is_pdf),
+    )
+
+async def sale_document_async(db: Session, path: str, sha256: str, is_pdf: bool) -> tuple[str, dict]:
+    """sale_document() con la extracción / OCR en el pool de procesos."""
+    from .ingest import PARSER_VERSION
+
+    async def compute():
+        return await executor.run(extract_sale_document, path, is_pdf)
+
+    return await cached_async(db, sha256, "sale_pdf" if is_pdf else "sale_image", PARSER_VERSION, compute)
@@ -0,0 +1,165 @@
+"""
+Backends de extracción de texto de PDFs.
+
+- "pymupdf" (default): PyMuPDF (fitz). Mucho más rápido y liviano que pdfplumber para
+  comprobantes de una página. Reconstruye las líneas agrupando palabras por renglón
+  (como pdfplumber), así los parsers de extract.py ven el mismo texto.
+- "pdfplumber": el extractor original; queda como fallback.
+- "ocr": para PDFs sin capa de texto (escaneados): renderiza las páginas y usa app.ocr.
+
+Los backends de texto descartan el texto duplicado que algunos PDFs dibujan superpuesto (efecto
+"negrita": "TToottaall"). Cada backend expone iter_pages(path) (texto por página, lazy)
+y extract_text(path). PDF_TEXT_BACKEND elige el principal.
+"""
+import os
+from typing import Iterator, Protocol
+
+from . import metrics
+
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", "pymupdf")
+FALLBACK_BACKEND = "pdfplumber"
+
+# OCR de PDFs escaneados (backend "ocr")
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "true").lower() == "true"
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "200"))
+PDF_OCR_MAX_PIXELS = int(os.getenv("PDF_OCR_MAX_PIXELS", str(8_000_000)))
+PDF_OCR_CPU_SECONDS = float(os.getenv("PDF_OCR_CPU_SECONDS", "20"))
+
+# Tolerancia (pt) para considerar dos palabras en el mismo renglón
+LINE_TOLERANCE = 3.0
+
+class PdfTextBackend(Protocol):
+    name: str
+
+    def iter_pages(self, path: str) -> Iterator[str]:
+        ...
+
+    def extract_text(self, path: str) -> str:
+        ...
+
+def _join_pages(pages: Iterator[str]) -> str:
+    return "\n".join(t for t in pages if t.strip()).strip()
+
+class PdfplumberBackend:
+    name = "pdfplumber"
+
+    def iter_pages(self, path: str) -> Iterator[str]:
+        import pdfplumber
+
+        with pdfplumber.open(path) as pdf:
+            for page in pdf.pages:
+                try:
+                    yield page.dedupe_chars().extract_text() or ""
+                finally:
+                    # Libera el cache de objetos de la página al avanzar
+                    page.close()
+
+    def extract_text(self, path: str) -> str:
+        return _join_pages(self.iter_pages(path))
+
+class PyMuPDFBackend:
+    name = "pymupdf"
+
+    @staticmethod
+    def _page_text(page) -> str:
+        # words: (x0, y0, x1, y1, texto, bloque, línea, n)
+        words = []
+        for w in sorted(page.get_text("words"), key=lambda w: (round(w[1]), round(w[0]), -len(w[4]))):
+            prev = words[-1] if words else None
+            # Texto superpuesto: misma posición y mismo texto (o prefijo del anterior)
+            if prev and abs(prev[0] - w[0]) < 1 and abs(prev[1] - w[1]) < 1 and prev[4].startswith(w[4]):
+                continue
+            words.append(w)
+
+        lines, current, base = [], [], None
+        for w in sorted(words, key=lambda w: (w[3], w[0])):
+            if base is not None and abs(w[3] - base) > LINE_TOLERANCE:
+                lines.append(current)
+                current, base = [], None
+            if base is None:
+                base = w[3]
+            current.append(w)
+        if current:
+            lines.append(current)
+        return "\n".join(" ".join(w[4] for w in sorted(line, key=lambda w: w[0])) for line in lines)
+
+    def iter_pages(self, path: str) -> Iterator[str]:
+        import fitz
+
+        with fitz.open(path) as doc:
+            for i in range(doc.page_count):
+                page = doc.load_page(i)
+                try:
+                    yield self._page_text(page)
+                finally:
+                    del page
+
+    def extract_text(self, path: str) -> str:
+        return _join_pages(self.iter_pages(path))
+
+def _cpu_seconds() -> float:
+    # Incluye procesos hijos (pytesseract lanza un tesseract por página)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+class PyMuPDFOcrBackend:
+    """
+    PDFs escaneados (sin capa de texto): renderiza cada página con PyMuPDF a
+    PDF_OCR_DPI (acotado a PDF_OCR_MAX_PIXELS) y la pasa por app.ocr. Deja de leer
+    páginas al agotar PDF_OCR_CPU_SECONDS de CPU por documento.
+    """
+    name = "ocr"
+
+    @staticmethod
+    def _render(page):
+        import fitz
+        from PIL import Image
+
+        rect = page.rect
+        zoom = PDF_OCR_DPI / 72
+        pixels = rect.width * zoom * rect.height * zoom
+        if pixels > PDF_OCR_MAX_PIXELS:
+            zoom *= (PDF_OCR_MAX_PIXELS / pixels) ** 0.5
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+    def iter_pages(self, path: str) -> Iterator[str]:
+        import fitz
+        from . import ocr
+
+        started = _cpu_seconds()
+        with fitz.open(path) as doc:
+            for i in range(doc.page_count):
+                remaining = PDF_OCR_CPU_SECONDS - (_cpu_seconds() - started)
+                if remaining <= 0:
+                    metrics.inc("pdf_ocr.budget_exceeded")
+                    return
+                page = doc.load_page(i)
+                try:
+                    image = self._render(page)
+                finally:
+                    del page
+                metrics.inc("pdf_ocr.pages")
+                try:
+                    yield ocr.receipt_image_text(image, timeout=remaining)
+                except RuntimeError as e:
+                    # pytesseract corta con RuntimeError al vencer el timeout
+                    if "timeout" not in str(e).lower():
+                        raise
+                    metrics.inc("pdf_ocr.budget_exceeded")
+                    return
+
+    def extract_text(self, path: str) -> str:
+        return _join_pages(self.iter_pages(path))
+
+BACKENDS: dict[str, PdfTextBackend] = {
+    "pymupdf": PyMuPDFBackend(),
+    "pdfplumber": PdfplumberBackend(),
+    "ocr": PyMuPDFOcrBackend(),
+}
+
+def get_backend(name: str | None = None) -> PdfTextBackend:
+    name = name or PDF_TEXT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend {name!r}; use one of {sorted(BACKENDS)}")
+    return BACKENDS[name]
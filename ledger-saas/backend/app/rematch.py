@@ -0,0 +1,296 @@
+"""
+Re-match batch del backlog de transacciones de un tenant.
+
+En lugar de hacer una query de Sale por cada Transaction (match_sale), carga las
+ventas del tenant una sola vez en un índice en memoria por (moneda, monto) ordenado
+por fecha, puntúa cada transacción unmatched/ambiguous contra ese índice y escribe
+los resultados con updates bulk por chunk.
+
+Usa las mismas reglas (_rank_candidates/_decide) que match_sale, así que las
+decisiones son idénticas a las del camino por transacción.
+
+Modo "assignment": en vez de decidir cada transacción por separado, arma la
+matriz transacción×venta con los mismos scores y la resuelve como asignación
+bipartita de peso máximo (uno a uno), para que dos transferencias idénticas no
+compitan por la misma venta ni queden ambas como ambiguous.
+
+CLI:
+    python -m app.rematch --tenant-id 1 [--mode assignment]
+"""
+import argparse
+import json
+import time
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from .models import Sale, Transaction
+from .sale_index import SaleIndex
+from . import sale_cache
+from .match import (
+    AUTO_MATCH_THRESHOLD,
+    MatchResult,
+    _parse_iso,
+    _date_window,
+    _strong_id_check,
+    _rank_index_window,
+    _decide,
+    sale_match_updates,
+)
+
+REMATCH_STATUSES = ("unmatched", "ambiguous")
+REMATCH_MODES = ("sequential", "assignment")
+SALE_UPDATE_CHUNK = 500
+
+def _indexed_candidates(index: SaleIndex, tx: Transaction, amount_tol: float):
+    """
+    Devuelve (resultado_inmediato, strong, ranked) para la transacción, en el mismo
+    orden de reglas que match_sale. resultado_inmediato != None cuando no hay nada que
+    puntuar (sin monto o sin fecha); strong es el MatchResult de strong ID, si lo hay.
+    """
+    if tx.amount is None:
+        return MatchResult(None, None, 0, "unmatched", method="no_amount", needs_review=False), None, []
+
+    # REGLA 1: Strong ID Match (lookup por external_ref, antes de buscar candidatos)
+    if tx.operation_id:
+        s = index.by_ref(tx.operation_id)
+        strong = _strong_id_check(tx, s, amount_tol) if s else None
+        if strong:
+            return None, strong, []
+
+    tx_dt = tx.datetime_ts or _parse_iso(tx.datetime)
+    if not tx_dt:
+        return MatchResult(None, None, 0, "unmatched", method="no_date", needs_review=False), None, []
+
+    start, end = _date_window(tx_dt)
+    return None, None, _rank_index_window(index, tx, tx_dt, amount_tol, start, end)
+
+def match_sale_indexed(index: SaleIndex, tx: Transaction, amount_tol: float = 0.01) -> MatchResult:
+    """Equivalente a match_sale pero contra un SaleIndex en memoria."""
+    immediate, strong, ranked = _indexed_candidates(index, tx, amount_tol)
+    if immediate:
+        return immediate
+    if strong:
+        return strong
+    return _decide(ranked)
+
+def _mark_sales_matched(db: Session, tenant_id: int, sale_ids: list[int]) -> None:
+    for i in range(0, len(sale_ids), SALE_UPDATE_CHUNK):
+        chunk = sale_ids[i:i + SALE_UPDATE_CHUNK]
+        db.execute(update(Sale).where(Sale.id.in_(chunk)).values(status="matched"))
+    if sale_ids:
+        sale_cache.touch(db, tenant_id)
+
+def _count(stats: dict, res: MatchResult) -> None:
+    stats[res.status] = stats.get(res.status, 0) + 1
+    # Strong ID con diferencia de monto (comisiones): se reportan aparte para revisión
+    if res.method == "strong_id_amount_diff":
+        stats["strong_id_amount_diff"] = stats.get("strong_id_amount_diff", 0) + 1
+
+def _finish_stats(stats: dict, index: SaleIndex, started: float) -> dict:
+    elapsed = time.perf_counter() - started
+    stats["sales_indexed"] = index.size
+    stats["elapsed_ms"] = round(elapsed * 1000, 1)
+    stats["tx_per_sec"] = round(stats["processed"] / elapsed, 1) if elapsed > 0 else None
+    return stats
+
+def _backlog_query(db: Session, tenant_id: int):
+    return (
+        db.query(Transaction)
+        .filter(
+            Transaction.tenant_id == tenant_id,
+            Transaction.match_status.in_(REMATCH_STATUSES),
+        )
+        .order_by(Transaction.id.asc())
+    )
+
+def rematch_tenant(db: Session, tenant_id: int, chunk_size: int = 1000, mode: str = "sequential") -> dict:
+    """
+    Re-matchea todas las transacciones unmatched/ambiguous del tenant.
+    Devuelve estadísticas, incluido el throughput en transacciones por segundo.
+
+    mode="sequential" decide cada transacción en orden de id, igual que si pasaran
+    una por una por match_sale. mode="assignment" resuelve el lote completo como
+    asignación uno a uno (ver assign_tenant).
+    """
+    if mode == "assignment":
+        return assign_tenant(db, tenant_id)
+    if mode != "sequential":
+        raise ValueError(f"mode must be one of {REMATCH_MODES}")
+
+    started = time.perf_counter()
+    index = SaleIndex.load(db, tenant_id)
+
+    stats = {"mode": mode, "processed": 0, "matched": 0, "ambiguous": 0, "unmatched": 0}
+    last_id = 0
+    while True:
+        txs = _backlog_query(db, tenant_id).filter(Transaction.id > last_id).limit(chunk_size).all()
+        if not txs:
+            break
+        last_id = txs[-1].id
+
+        rows = []
+        claimed = []
+        for tx in txs:
+            res = match_sale_indexed(index, tx)
+            rows.append({"id": tx.id, **sale_match_updates(tx, res)})
+            _count(stats, res)
+            if res.status == "matched" and res.id:
+                index.claim(res.id)
+                claimed.append(res.id)
+
+        # Los objetos del chunk no se reutilizan: se sacan de la sesión antes del update bulk
+        db.expunge_all()
+        db.execute(update(Transaction), rows)
+        _mark_sales_matched(db, tenant_id, claimed)
+        db.commit()
+        stats["processed"] += len(rows)
+
+    return _finish_stats(stats, index, started)
+
+# Pesos de la asignación: el score manda; evidence_rank y cercanía en el tiempo desempatan.
+_STRONG_ID_WEIGHT = 1000 * 10**6
+_WEIGHT_CEILING = 2 * _STRONG_ID_WEIGHT
+
+def _edge_weight(score: int, evidence_rank: int, time_delta: float) -> int:
+    hours = min(999, int(time_delta // 3600))
+    return score * 10**6 + evidence_rank * 10**3 + (999 - hours)
+
+def _solve_assignment(edges: dict[int, dict[int, int]]) -> dict[int, int]:
+    """
+    Asignación bipartita de peso máximo sobre una matriz dispersa.
+    edges: tx_id -> {sale_id: peso}. Devuelve tx_id -> sale_id.
+
+    Cada transacción tiene además una columna "sin asignar" propia con peso 0, así
+    siempre existe un matching completo por filas y minimizar (techo - peso)
+    equivale a maximizar el peso total.
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    tx_ids = list(edges)
+    if not tx_ids:
+        return {}
+    sale_ids = sorted({sid for row in edges.values() for sid in row})
+    col_of = {sid: j for j, sid in enumerate(sale_ids)}
+    n_sales = len(sale_ids)
+
+    rows, cols, data = [], [], []
+    for i, tx_id in enumerate(tx_ids):
+        for sid, weight in edges[tx_id].items():
+            rows.append(i)
+            cols.append(col_of[sid])
+            data.append(_WEIGHT_CEILING - weight)
+        rows.append(i)
+        cols.append(n_sales + i)
+        data.append(_WEIGHT_CEILING)
+
+    cost = csr_matrix(
+        (np.asarray(data, dtype=np.float64), (rows, cols)),
+        shape=(len(tx_ids), n_sales + len(tx_ids)),
+    )
+    row_ind, col_ind = min_weight_full_bipartite_matching(cost)
+    return {
+        tx_ids[i]: sale_ids[j]
+        for i, j in zip(row_ind.tolist(), col_ind.tolist())
+        if j < n_sales
+    }
+
+def assign_tenant(db: Session, tenant_id: int, amount_tol: float = 0.01) -> dict:
+    """
+    Re-match del backlog como asignación uno a uno entre transacciones y ventas abiertas.
+
+    1. Cada par (transacción, venta) con score >= AUTO_MATCH_THRESHOLD (o strong ID) es
+       una arista con el score de las reglas existentes.
+    2. Se resuelve la asignación de peso máximo.
+    3. Cada ganador se confirma con _decide sobre sus candidatos menos las ventas que
+       ganaron otras transacciones: si una venta libre le compite sin poder desempatar,
+       queda ambiguous (la asignación no elige al azar entre ventas indistinguibles).
+    4. Las transacciones sin venta asignada ("perdedores") vuelven a pasar por _decide
+       con las ventas que no ganó nadie.
+    """
+    started = time.perf_counter()
+    index = SaleIndex.load(db, tenant_id)
+    txs = _backlog_query(db, tenant_id).all()
+
+    candidates: dict[int, tuple] = {}
+    edges: dict[int, dict[int, int]] = {}
+    immediate: dict[int, MatchResult] = {}
+    for tx in txs:
+        result, strong, ranked = _indexed_candidates(index, tx, amount_tol)
+        if result:
+            immediate[tx.id] = result
+            continue
+        candidates[tx.id] = (strong, ranked)
+        row = {}
+        for s, score, _reasons, evidence_rank, time_delta in ranked:
+            if score >= AUTO_MATCH_THRESHOLD:
+                row[s.id] = _edge_weight(score, evidence_rank, time_delta)
+        if strong:
+            row[strong.id] = _STRONG_ID_WEIGHT
+        if row:
+            edges[tx.id] = row
+
+    assigned = _solve_assignment(edges)
+    taken_by = {sale_id: tx_id for tx_id, sale_id in assigned.items()}
+
+    results: dict[int, MatchResult] = dict(immediate)
+    claimed: set[int] = set()
+    for tx_id, sale_id in assigned.items():
+        strong, ranked = candidates[tx_id]
+        if strong and strong.id == sale_id:
+            results[tx_id] = strong
+            claimed.add(sale_id)
+            continue
+        # Sacar las ventas que ganaron otras transacciones; las libres siguen compitiendo
+        own = [c for c in ranked if taken_by.get(c[0].id, tx_id) == tx_id and c[0].id not in claimed]
+        res = _decide(own)
+        if res.status == "matched" and len(own) < len(ranked):
+            res.method = "assignment"
+        if res.status == "matched":
+            claimed.add(res.id)
+        results[tx_id] = res
+
+    for tx_id, (strong, ranked) in candidates.items():
+        if tx_id in results:
+            continue
+        # Perdedores: se vuelven a evaluar solo contra ventas que siguen libres
+        res = _decide([c for c in ranked if c[0].id not in claimed and c[0].id not in taken_by])
+        if res.status == "matched":
+            claimed.add(res.id)
+        results[tx_id] = res
+
+    stats = {"mode": "assignment", "processed": 0, "matched": 0, "ambiguous": 0, "unmatched": 0}
+    rows = []
+    by_id = {tx.id: tx for tx in txs}
+    for tx_id, res in results.items():
+        rows.append({"id": tx_id, **sale_match_updates(by_id[tx_id], res)})
+        _count(stats, res)
+    stats["processed"] = len(rows)
+    stats["sales_matched"] = len(claimed)
+
+    db.expunge_all()
+    if rows:
+        db.execute(update(Transaction), rows)
+    _mark_sales_matched(db, tenant_id, sorted(claimed))
+    db.commit()
+    return _finish_stats(stats, index, started)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-match batch de transacciones unmatched/ambiguous")
+    parser.add_argument("--tenant-id", type=int, required=True)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--mode", choices=REMATCH_MODES, default="sequential")
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        stats = rematch_tenant(db, args.tenant_id, chunk_size=args.chunk_size, mode=args.mode)
+    finally:
+        db.close()
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from ..db import get_db
 from ..deps import get_current_user
 from ..models import Sale, Transaction
+from ..match import reverse_match_sale
 
 router = APIRouter(prefix="/v1/chat", tags=["chat"])
 
@@ -25,9 +26,13 @@ def chat(payload: ChatIn, db: Session = Depends(get_db), user=Depends(get_curren
         desc = (mm.group(2) or "").strip() or "Venta"
         s = Sale(tenant_id=user.tenant_id, datetime="2025-12-29T00:00:00", amount=amount, currency="ARS", description=desc, status="open")
         db.add(s)
+        db.flush()
+        linked = reverse_match_sale(db, s)
         db.commit()
-        db.refresh(s)
-        return {"reply": f"Creé una venta #{s.id} por ARS {amount:.2f} ({desc}).", "data": {"sale_id": s.id}}
+        reply = f"Creé una venta #{s.id} por ARS {amount:.2f} ({desc})."
+        if linked:
+            reply += f" La vinculé con la transacción #{linked[0]}."
+        return {"reply": reply, "data": {"sale_id": s.id, "linked_transaction_ids": linked}}
 
     if "ultimas" in m or "últimas" in m or "transacciones" in m:
         rows = db.query(Transaction).filter(Transaction.tenant_id == user.tenant_id).order_by(Transaction.id.desc()).limit(10).all()
@@ -1,38 +1,64 @@
+import asyncio
+import json
+import logging
 import os
-from fastapi import APIRouter, UploadFile, File, Depends
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import AsyncIterator
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 from ..db import get_db
 from ..deps import require_role
 from ..models import Transaction, Counterparty
-from ..extract import extract_text_from_pdf, detect_doc, parse_by_type
-from ..match import normalize_name, match_sale, match_counterparty
+from .. import executor, metrics, parse_cache, uploads
+from ..match import normalize_name, match_sale, match_counterparty, apply_sale_match
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-router = APIRouter(prefix="/v1/receipts", tags=["receipts"])
+# POST /v1/receipts/batch: tope de archivos (sueltos + dentro de ZIPs), tamaño de cada ZIP,
+# comprobantes por transacción de BD y extracciones simultáneas (0 = EXTRACT_WORKERS)
+RECEIPTS_BATCH_MAX_FILES = int(os.getenv("RECEIPTS_BATCH_MAX_FILES", "500"))
+RECEIPTS_BATCH_ZIP_MAX_BYTES = int(os.getenv("RECEIPTS_BATCH_ZIP_MAX_BYTES", str(200 * 1024 * 1024)))
+RECEIPTS_BATCH_CHUNK = int(os.getenv("RECEIPTS_BATCH_CHUNK", "25"))
+RECEIPTS_BATCH_CONCURRENCY = int(os.getenv("RECEIPTS_BATCH_CONCURRENCY", "0"))
+# Un chunk incompleto se guarda igual pasado este tiempo (progreso visible con OCR lento)
+BATCH_FLUSH_SECONDS = 1.0
+BATCH_BUSY_RETRIES = 3
 
-@router.post("")
-async def upload_receipt(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    user=Depends(require_role("owner","admin","employee")),
-):
-    filename = file.filename or "upload.bin"
-    path = os.path.join(UPLOAD_DIR, f"t{user.tenant_id}_{filename}")
-    content = await file.read()
-    with open(path, "wb") as f:
-        f.write(content)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
 
-    text = ""
-    if filename.lower().endswith(".pdf"):
-        text = extract_text_from_pdf(path)
+router = APIRouter(prefix="/v1/receipts", tags=["receipts"])
+logger = logging.getLogger(__name__)
 
-    doc_key = detect_doc(text) if text else "unknown"
-    parsed = parse_by_type(doc_key, text) if text else {"needs_review": True, "parse_confidence": 10}
+async def _extract_receipt(db: Session, stored: uploads.StoredFile, filename: str) -> tuple[str, dict | None]:
+    """Texto y parseo según la extensión. ExtractionBusy se propaga (cola llena)."""
+    lower = filename.lower()
+    if lower.endswith(".pdf"):
+        # Mismo archivo ya procesado (web / WhatsApp / reenvío): sin volver a extraer
+        try:
+            return await parse_cache.receipt_pdf_async(db, stored.path, stored.sha256)
+        except TimeoutError:
+            # PDF demasiado pesado / colgado: se guarda igual, para revisión manual
+            return "", None
+    if lower.endswith(IMAGE_EXTENSIONS):
+        try:
+            return await parse_cache.receipt_image_async(db, stored.path, stored.sha256)
+        except executor.ExtractionBusy:
+            raise
+        except Exception as e:
+            # Sin tesseract / OCR colgado: se guarda igual, para revisión manual
+            logger.warning(f"⚠️  OCR failed for {filename}: {str(e)}")
+    return "", None
 
-    tx = Transaction(
-        tenant_id=user.tenant_id,
+def _new_transaction(tenant_id: int, filename: str, text: str, parsed: dict | None) -> Transaction:
+    if parsed is None:
+        parsed = {"needs_review": True, "parse_confidence": 10}
+    return Transaction(
+        tenant_id=tenant_id,
         source_file=filename,
         source_system=parsed.get("source_system","unknown"),
         doc_type=parsed.get("doc_type","unknown"),
@@ -59,12 +85,8 @@ async def upload_receipt(
         needs_review=bool(parsed.get("needs_review", False)),
         parse_confidence=parsed.get("parse_confidence"),
     )
-    db.add(tx)
-    db.commit()
-    db.refresh(tx)
-
-    _resolve_and_match(db, tx, user.tenant_id)
 
+def _receipt_result(tx: Transaction) -> dict:
     return {
         "id": tx.id,
         "match": {"status": tx.match_status, "score": tx.match_score, "sale_id": tx.matched_sale_id},
@@ -73,7 +95,217 @@ async def upload_receipt(
         "needs_review": tx.needs_review,
     }
 
+@router.post("")
+async def upload_receipt(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    user=Depends(require_role("owner","admin","employee")),
+):
+    filename = file.filename or "upload.bin"
+    # Por chunks a disco (hash + límite de tamaño), sin el archivo entero en memoria
+    stored = await uploads.save_upload(file, os.path.join(UPLOAD_DIR, f"t{user.tenant_id}_{os.path.basename(filename)}"))
+
+    try:
+        text, parsed = await _extract_receipt(db, stored, filename)
+    except executor.ExtractionBusy:
+        raise HTTPException(status_code=503, detail="Extraction queue full, retry later")
+
+    tx = _new_transaction(user.tenant_id, filename, text, parsed)
+    db.add(tx)
+    db.commit()
+    db.refresh(tx)
+
+    _resolve_and_match(db, tx, user.tenant_id)
+
+    return _receipt_result(tx)
+
+@dataclass
+class _BatchItem:
+    index: int
+    filename: str
+    stored: uploads.StoredFile | None = None
+    error: str | None = None
+
+def _batch_path(tenant_id: int, filename: str, taken: set[str]) -> str:
+    """Path en UPLOAD_DIR; dos archivos del lote con el mismo nombre no se pisan."""
+    name = f"t{tenant_id}_{filename}"
+    n = 1
+    while name in taken:
+        n += 1
+        name = f"t{tenant_id}_{n}_{filename}"
+    taken.add(name)
+    return os.path.join(UPLOAD_DIR, name)
+
+def _expand_zip(zip_path: str, tenant_id: int, taken: set[str], room: int) -> list[tuple[str, uploads.StoredFile | None, str | None]]:
+    """
+    PDFs e imágenes de un ZIP a UPLOAD_DIR, miembro por miembro y por chunks (el límite
+    UPLOAD_MAX_BYTES se aplica a lo descomprimido). (nombre, archivo, error) por miembro.
+    """
+    out = []
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [
+            info for info in zf.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith("__MACOSX/")
+            and not os.path.basename(info.filename).startswith(".")
+            and info.filename.lower().endswith((".pdf",) + IMAGE_EXTENSIONS)
+        ]
+        if len(members) > room:
+            raise HTTPException(status_code=400, detail=f"Too many files (max {RECEIPTS_BATCH_MAX_FILES})")
+        for info in members:
+            filename = os.path.basename(info.filename)
+            try:
+                with zf.open(info) as src:
+                    stored = uploads.save_chunks(
+                        iter(lambda: src.read(uploads.UPLOAD_CHUNK_BYTES), b""),
+                        _batch_path(tenant_id, filename, taken),
+                        declared_size=info.file_size,
+                    )
+                out.append((filename, stored, None))
+            except uploads.UploadTooLarge as e:
+                out.append((filename, None, e.detail))
+    return out
+
+async def _extract_batch_item(bind: Engine, item: _BatchItem, limit: asyncio.Semaphore) -> tuple[_BatchItem, str, dict | None]:
+    if item.error:
+        return item, "", None
+    async with limit:
+        for attempt in range(BATCH_BUSY_RETRIES):
+            # Sesión propia por archivo: las filas de la cache de parseo se commitean acá,
+            # sin depender del commit / rollback del chunk ni de las demás extracciones
+            with Session(bind=bind, autoflush=False) as db:
+                try:
+                    text, parsed = await _extract_receipt(db, item.stored, item.filename)
+                    db.commit()
+                    return item, text, parsed
+                except executor.ExtractionBusy:
+                    db.rollback()
+                except Exception as e:
+                    # PDF corrupto, etc.: línea de error para este archivo, el lote sigue
+                    db.rollback()
+                    logger.warning(f"⚠️  Extraction failed for {item.filename}: {type(e).__name__}: {str(e)}")
+                    item.error = f"Could not extract receipt: {type(e).__name__}"
+                    return item, "", None
+            # El pool es compartido con los demás requests: esperar y reintentar
+            await asyncio.sleep(0.5 * (attempt + 1))
+    item.error = "Extraction queue full, retry later"
+    return item, "", None
+
+def _store_batch_chunk(bind: Engine, tenant_id: int, results: list[tuple[_BatchItem, str, dict | None]]) -> list[dict]:
+    """
+    Crea, resuelve y matchea un chunk de comprobantes en una sola transacción. Es
+    sincrónico (flush, matching, commit): se corre en un thread con su propia sesión.
+    """
+    lines, txs = [], []
+    with Session(bind=bind, autoflush=False) as db:
+        for item, text, parsed in results:
+            if item.error:
+                lines.append({"index": item.index, "file": item.filename, "status": "error", "error": item.error})
+                continue
+            tx = _new_transaction(tenant_id, item.filename, text, parsed)
+            db.add(tx)
+            txs.append((item, tx))
+        try:
+            db.flush()
+            for _, tx in txs:
+                _resolve_and_match_pending(db, tx, tenant_id)
+            stored = [{"index": item.index, "file": item.filename, "status": "ok", **_receipt_result(tx)} for item, tx in txs]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"❌ Batch chunk failed: {str(e)}")
+            stored = [{"index": item.index, "file": item.filename, "status": "error", "error": "Could not store receipt"} for item, _ in txs]
+    return lines + stored
+
+async def _batch_results(bind: Engine, tenant_id: int, items: list[_BatchItem]) -> AsyncIterator[str]:
+    """
+    Extrae los archivos en paralelo (app.executor) y, a medida que terminan, los guarda
+    por chunks (RECEIPTS_BATCH_CHUNK por transacción, o lo que haya cada
+    BATCH_FLUSH_SECONDS). Una línea NDJSON por archivo y un resumen al final.
+    Cada chunk se guarda en un thread (asyncio.to_thread) para no frenar el event loop
+    mientras las demás extracciones siguen corriendo.
+    """
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(RECEIPTS_BATCH_CONCURRENCY or executor.EXTRACT_WORKERS)
+    tasks = {asyncio.create_task(_extract_batch_item(bind, item, limit)) for item in items}
+    summary = {"summary": True, "files": len(items), "stored": 0, "errors": 0}
+    try:
+        pending, first_at = [], None
+        while tasks:
+            timeout = None if first_at is None else max(0.0, first_at + BATCH_FLUSH_SECONDS - time.perf_counter())
+            done, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            pending.extend(t.result() for t in done)
+            if pending and first_at is None:
+                first_at = time.perf_counter()
+            if pending and (not tasks or len(pending) >= RECEIPTS_BATCH_CHUNK or time.perf_counter() - first_at >= BATCH_FLUSH_SECONDS):
+                for line in await asyncio.to_thread(_store_batch_chunk, bind, tenant_id, pending):
+                    summary["stored" if line["status"] == "ok" else "errors"] += 1
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+                pending, first_at = [], None
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        metrics.inc("receipts.batch_files", len(items))
+        metrics.observe("receipts.batch_ms", summary["elapsed_ms"])
+        yield json.dumps(summary) + "\n"
+    finally:
+        for t in tasks:
+            t.cancel()
+
+@router.post("/batch")
+async def upload_receipts_batch(
+    files: list[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    user=Depends(require_role("owner","admin","employee")),
+):
+    """
+    Varios comprobantes (PDF / imagen) y/o ZIPs en un request. Responde NDJSON: una
+    línea por archivo (mismo contenido que POST /v1/receipts, con index y file) a medida
+    que se procesan, y una última línea {"summary": true, ...}.
+    """
+    tenant_id = user.tenant_id
+    items: list[_BatchItem] = []
+    taken: set[str] = set()
+
+    def add(filename: str, stored: uploads.StoredFile | None, error: str | None = None):
+        if len(items) >= RECEIPTS_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"Too many files (max {RECEIPTS_BATCH_MAX_FILES})")
+        items.append(_BatchItem(len(items), filename, stored, error))
+
+    # Todo a disco antes de responder: el streaming trabaja sólo con paths
+    for file in files:
+        filename = os.path.basename(file.filename or "upload.bin")
+        if filename.lower().endswith(".zip"):
+            zip_stored = await uploads.save_upload(
+                file, os.path.join(UPLOAD_DIR, f"batch_t{tenant_id}_{filename}"), RECEIPTS_BATCH_ZIP_MAX_BYTES
+            )
+            try:
+                members = await asyncio.to_thread(
+                    _expand_zip, zip_stored.path, tenant_id, taken, RECEIPTS_BATCH_MAX_FILES - len(items)
+                )
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Invalid ZIP file: {filename}")
+            finally:
+                os.remove(zip_stored.path)
+            for member in members:
+                add(*member)
+            continue
+        if len(items) >= RECEIPTS_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"Too many files (max {RECEIPTS_BATCH_MAX_FILES})")
+        try:
+            add(filename, await uploads.save_upload(file, _batch_path(tenant_id, filename, taken)))
+        except uploads.UploadTooLarge as e:
+            add(filename, None, e.detail)
+    if not items:
+        raise HTTPException(status_code=400, detail="No receipts in upload")
+
+    return StreamingResponse(_batch_results(db.get_bind(), tenant_id, items), media_type="application/x-ndjson")
+
 def _resolve_and_match(db: Session, tx: Transaction, tenant_id: int):
+    _resolve_and_match_pending(db, tx, tenant_id)
+    db.commit()
+    db.refresh(tx)
+
+def _resolve_and_match_pending(db: Session, tx: Transaction, tenant_id: int):
+    """Contrapartes + match con ventas sin commit (flush): el caller decide la transacción."""
     # Resolver contrapartes (si no existe, crear provisional)
     for side in ["payer", "payee"]:
         name = getattr(tx, f"{side}_name")
@@ -108,21 +340,11 @@ def _resolve_and_match(db: Session, tx: Transaction, tenant_id: int):
                     type="unknown",
                 )
                 db.add(cp)
-                db.commit()
-                db.refresh(cp)
+                db.flush()
                 setattr(tx, f"{side}_counterparty_id", cp.id)
                 tx.needs_review = True
 
     # Match con ventas
     sale_res = match_sale(db, tx)
-    tx.match_score = sale_res.score
-    tx.match_status = sale_res.status
-    tx.match_method = sale_res.method
-    if sale_res.status == "matched" and sale_res.id:
-        tx.matched_sale_id = sale_res.id
-        tx.needs_review = sale_res.needs_review
-    elif sale_res.status == "ambiguous":
-        tx.needs_review = True
-
-    db.commit()
-    db.refresh(tx)
+    apply_sale_match(db, tx, sale_res)
+    db.flush()
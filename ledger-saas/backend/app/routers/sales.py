@@ -5,15 +5,13 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from ..db import get_db
 from ..models import Sale
+from ..match import reverse_match_sale
 from ..deps import get_current_user, require_role
-from ..ingest import (
-    extract_text_from_image,
-    extract_text_from_pdf_ingest,
-    parse_sale_from_text,
-)
+from .. import executor, parse_cache, uploads
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+SALES_BULK_MAX = int(os.getenv("SALES_BULK_MAX", "1000"))
 
 router = APIRouter(prefix="/v1/sales", tags=["sales"])
 
@@ -29,11 +27,44 @@ class SaleIn(BaseModel):
 
 @router.post("")
 def create_sale(payload: SaleIn, db: Session = Depends(get_db), user=Depends(require_role("owner","admin","employee"))):
+    # external_ref es único por tenant (se usa como strong ID en el matching)
+    if payload.external_ref and db.query(Sale.id).filter(
+        Sale.tenant_id == user.tenant_id,
+        Sale.external_ref == payload.external_ref,
+    ).first():
+        raise HTTPException(status_code=409, detail="external_ref already exists for this tenant")
     s = Sale(tenant_id=user.tenant_id, **payload.model_dump(), status="open")
     db.add(s)
+    db.flush()
+    # Transferencias que llegaron antes que la venta
+    linked = reverse_match_sale(db, s)
     db.commit()
-    db.refresh(s)
-    return {"id": s.id}
+    return {"id": s.id, "linked_transaction_ids": linked}
+
+@router.post("/bulk")
+def create_sales_bulk(payload: list[SaleIn], db: Session = Depends(get_db), user=Depends(require_role("owner","admin"))):
+    """Importa varias ventas en una sola transacción y corre el reverse matching de cada una."""
+    if not payload:
+        raise HTTPException(status_code=400, detail="No sales provided")
+    if len(payload) > SALES_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many sales (max {SALES_BULK_MAX})")
+    refs = [p.external_ref for p in payload if p.external_ref]
+    if len(refs) != len(set(refs)):
+        raise HTTPException(status_code=409, detail="Duplicate external_ref in payload")
+    if refs:
+        existing = [r for (r,) in db.query(Sale.external_ref).filter(
+            Sale.tenant_id == user.tenant_id,
+            Sale.external_ref.in_(refs),
+        ).all()]
+        if existing:
+            raise HTTPException(status_code=409, detail=f"external_ref already exists for this tenant: {', '.join(sorted(existing))}")
+
+    sales = [Sale(tenant_id=user.tenant_id, **p.model_dump(), status="open") for p in payload]
+    db.add_all(sales)
+    db.flush()
+    results = [{"id": s.id, "linked_transaction_ids": reverse_match_sale(db, s)} for s in sales]
+    db.commit()
+    return {"created": len(results), "sales": results}
 
 @router.get("")
 def list_sales(db: Session = Depends(get_db), user=Depends(get_current_user)):
@@ -50,6 +81,7 @@ async def ingest_sale(
     Endpoint para subir una imagen o PDF de venta.
     Extrae información automáticamente y retorna un draft para revisión.
     """
+    stored = None
     try:
         if not file.filename:
             raise HTTPException(status_code=400, detail="Nombre de archivo requerido")
@@ -66,20 +98,18 @@ async def ingest_sale(
                 detail="Formato no soportado. Use PDF o imagen (JPG, PNG, etc.)"
             )
         
-        # Guardar archivo temporalmente
-        temp_path = os.path.join(UPLOAD_DIR, f"ingest_t{user.tenant_id}_{file.filename}")
-        content = await file.read()
-        with open(temp_path, "wb") as f:
-            f.write(content)
-        
-        # Extraer texto
-        if is_pdf:
-            raw_text = extract_text_from_pdf_ingest(temp_path)
-        else:
-            raw_text = extract_text_from_image(temp_path)
-        
-        # Parsear información
-        parsed = parse_sale_from_text(raw_text)
+        # Guardar archivo por chunks (SHA-256 + límite de tamaño, sin copia en memoria)
+        temp_path = os.path.join(UPLOAD_DIR, f"ingest_t{user.tenant_id}_{os.path.basename(file.filename)}")
+        stored = await uploads.save_upload(file, temp_path)
+
+        # Extraer texto y parsear información (cache por SHA-256 del archivo)
+        try:
+            raw_text, parsed = await parse_cache.sale_document_async(db, stored.path, stored.sha256, is_pdf)
+        except executor.ExtractionBusy:
+            raise HTTPException(status_code=503, detail="Demasiados archivos en proceso, reintentar")
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail="El archivo tardó demasiado en procesarse")
+        db.commit()
         
         # Si no se detectó fecha, usar la actual
         if not parsed.get("datetime"):
@@ -105,11 +135,10 @@ async def ingest_sale(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al procesar archivo: {str(e)}")
     finally:
-        # Opcionalmente eliminar archivo temporal
+        # Eliminar el archivo temporal (el path que se escribió, no uno armado con el nombre del cliente)
         try:
-            temp_path = os.path.join(UPLOAD_DIR, f"ingest_t{user.tenant_id}_{file.filename}")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            if stored is not None and os.path.exists(stored.path):
+                os.remove(stored.path)
         except:
             pass
 
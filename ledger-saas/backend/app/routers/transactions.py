@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from ..db import get_db
-from ..deps import get_current_user
+from ..deps import get_current_user, require_role
 from ..models import Transaction
+from ..rematch import rematch_tenant, REMATCH_MODES
 
 router = APIRouter(prefix="/v1/transactions", tags=["transactions"])
 
@@ -28,3 +29,13 @@ def list_transactions(db: Session = Depends(get_db), user=Depends(get_current_us
             "needs_review": r.needs_review,
         })
     return out
+
+@router.post("/rematch")
+def rematch_transactions(mode: str = "sequential", db: Session = Depends(get_db), user=Depends(require_role("owner","admin"))):
+    """
+    Re-matchea en batch todas las transacciones unmatched/ambiguous del tenant.
+    mode=assignment resuelve el lote como asignación uno a uno transacción ↔ venta.
+    """
+    if mode not in REMATCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(REMATCH_MODES)}")
+    return rematch_tenant(db, user.tenant_id, mode=mode)
@@ -1,10 +1,15 @@
+import asyncio
 import os
-import tempfile
-import requests
+import time
+import httpx
 import logging
 import json
+import zlib
+from dataclasses import dataclass
 from fastapi import APIRouter, Depends, Request, HTTPException
 from fastapi.responses import PlainTextResponse
+from sqlalchemy import and_, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from datetime import datetime
 
@@ -19,7 +24,7 @@ from ..models import (
     IncomingMessage,
     Tenant,
 )
-from ..extract import extract_text_from_pdf, detect_doc, parse_by_type
+from .. import executor, http_client, inbound_queue, metrics, parse_cache, routing_cache, uploads
 from .receipts import _resolve_and_match
 
 router = APIRouter(prefix="/webhooks/whatsapp", tags=["whatsapp"])
@@ -31,13 +36,22 @@ BACKEND_SHARED_SECRET = os.getenv("BACKEND_SHARED_SECRET", "ledger_saas_backend_
 # Meta Cloud API
 META_WA_TOKEN = os.getenv("META_WA_TOKEN", "")
 META_API_VERSION = os.getenv("META_API_VERSION", "v20.0")
+# Base de la Graph API (un servidor local en tests / benchmarks: benchmarks/fake_graph.py)
+META_GRAPH_URL = os.getenv("META_GRAPH_URL", "https://graph.facebook.com").rstrip("/")
+META_MEDIA_URL_TTL_SECONDS = float(os.getenv("META_MEDIA_URL_TTL_SECONDS", "240"))
+META_MEDIA_URL_CACHE_MAX = 1000
+
+# Lotes reenviados por Vercel (POST /meta/cloud/batch): eventos y bytes por lote
+WEBHOOK_BATCH_MAX_EVENTS = int(os.getenv("WEBHOOK_BATCH_MAX_EVENTS", "100"))
+WEBHOOK_BATCH_MAX_BYTES = int(os.getenv("WEBHOOK_BATCH_MAX_BYTES", str(1024 * 1024)))
+WEBHOOK_BATCH_MAX_DECOMPRESSED_BYTES = int(os.getenv("WEBHOOK_BATCH_MAX_DECOMPRESSED_BYTES", str(8 * 1024 * 1024)))
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 def _route_tenant_by_provider(db: Session, provider: str, external_id: str) -> int | None:
-    ch = db.query(Channel).filter(Channel.kind == "whatsapp", Channel.provider == provider, Channel.external_id == external_id).first()
-    return ch.tenant_id if ch else None
+    # Cacheado en proceso (app.routing_cache); se invalida al editar channels / tenants
+    return routing_cache.tenant_id_for(db, provider, external_id)
 
 
 def _resolve_tenant(db: Session, phone_number_id: str | None, fallback_tenant_id: str | None) -> int | None:
@@ -48,73 +62,132 @@ def _resolve_tenant(db: Session, phone_number_id: str | None, fallback_tenant_id
         except Exception:
             logger.warning(f"⚠️  Invalid tenant id header: {fallback_tenant_id}")
 
-    # 2) Channel lookup (preferred)
-    if phone_number_id:
-        ch = db.query(Channel).filter(
-            Channel.kind == "whatsapp",
-            Channel.provider == "meta",
-            Channel.external_id == phone_number_id,
-        ).first()
-        if ch:
-            return ch.tenant_id
-
-    # 3) Tenant direct mapping
+    # 2) Channel lookup (preferred), 3) Tenant direct mapping — sin queries si está en cache
     if phone_number_id:
-        tenant = db.query(Tenant).filter(Tenant.phone_number_id == phone_number_id).first()
-        if tenant:
-            return tenant.id
+        return _route_tenant_by_provider(db, "meta", phone_number_id)
 
     return None
 
-def _message_already_processed(db: Session, tenant_id: int | None, message_id: str) -> bool:
-    """Verificar si un mensaje ya fue procesado (idempotencia por message_id)."""
-    existing = db.query(IncomingMessage).filter(
-        IncomingMessage.message_id == message_id,
-        IncomingMessage.tenant_id == tenant_id,
-    ).first()
-    return existing is not None
-
-def _record_inbound_message(
-    db: Session,
-    message_id: str,
-    sender_wa_id: str | None,
-    phone_number_id: str | None,
-    tenant_id: int | None,
-    msg_type: str | None,
-    content: str | None,
-    status: str = "received",
-) -> IncomingMessage | None:
-    """Registrar mensaje entrante en tabla de idempotencia."""
+def _flatten_changes(payload: dict, default_phone_number_id: str | None) -> list[tuple[str | None, dict]]:
+    """
+    (phone_number_id, value) de todos los entry / changes del payload. Meta puede agrupar
+    varios en una entrega; cada change trae su phone_number_id en value.metadata.
+    """
+    changes = []
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            phone_number_id = (value.get("metadata") or {}).get("phone_number_id") or default_phone_number_id
+            changes.append((phone_number_id, value))
+    return changes
+
+def _known_message_ids(db: Session, pairs: list[tuple[int | None, str]]) -> set[tuple[int | None, str]]:
+    """
+    (tenant_id, message_id) ya registrados, en una sola query para todo el lote. Filtra
+    por el par completo para que use el índice único (tenant_id, message_id).
+    """
+    if not pairs:
+        return set()
+    t = IncomingMessage.__table__
+    tenant_ids = {tenant_id for tenant_id, _ in pairs if tenant_id is not None}
+    message_ids = {message_id for _, message_id in pairs}
+    conditions = []
+    if tenant_ids:
+        # tenant_id IN + message_id IN: búsqueda por el índice (un IN de tuplas no lo usa en SQLite)
+        conditions.append(and_(t.c.tenant_id.in_(tenant_ids), t.c.message_id.in_(message_ids)))
+    if any(tenant_id is None for tenant_id, _ in pairs):
+        conditions.append(and_(t.c.tenant_id.is_(None), t.c.message_id.in_(message_ids)))
+    rows = db.execute(select(t.c.tenant_id, t.c.message_id).where(or_(*conditions)))
+    # El IN cruzado puede traer pares que no son del lote: sólo interesan los del lote
+    return {(tenant_id, message_id) for tenant_id, message_id in rows} & set(pairs)
+
+def _insert_inbound_messages(db: Session, rows: list[dict]) -> set[tuple[int | None, str]]:
+    """
+    Registrar los mensajes nuevos en un solo INSERT (idempotencia por uq_incoming_message).
+    Los que otro request registró entre el chequeo y el insert se ignoran. Devuelve los
+    (tenant_id, message_id) efectivamente insertados.
+    """
+    if not rows:
+        return set()
+    t = IncomingMessage.__table__
+    dialect = db.get_bind().dialect.name
     try:
-        inbound = IncomingMessage(
-            tenant_id=tenant_id,
-            message_id=message_id,
-            sender_wa_id=sender_wa_id,
-            phone_number_id=phone_number_id,
-            msg_type=msg_type,
-            content=content,
-            created_at=datetime.utcnow().isoformat(),
-            status=status,
-        )
-        db.add(inbound)
+        if dialect in ("sqlite", "postgresql"):
+            ins = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(t).values(rows)
+            ins = ins.on_conflict_do_nothing().returning(t.c.tenant_id, t.c.message_id)
+            inserted = {(tenant_id, message_id) for tenant_id, message_id in db.execute(ins)}
+        else:
+            db.execute(t.insert(), rows)
+            inserted = {(r["tenant_id"], r["message_id"]) for r in rows}
         db.commit()
-        return inbound
     except Exception as e:
-        logger.warning(f"⚠️  Could not record inbound message {message_id}: {str(e)}")
+        # Se propaga: el webhook responde 500 y el forwarder reintenta
+        logger.error(f"❌ Could not record inbound messages: {str(e)}")
         db.rollback()
+        raise
+    return inserted
+
+def _media_extension(content_type: str) -> str:
+    content_type = content_type.lower()
+    if "pdf" in content_type:
+        return "pdf"
+    if "jpeg" in content_type or "jpg" in content_type:
+        return "jpg"
+    if "png" in content_type:
+        return "png"
+    return "bin"
+
+# URL de descarga por media id: Meta la deja válida ~5 minutos
+_media_urls: dict[tuple[str, str], tuple[str, float]] = {}
+
+def _cached_media_url(key: tuple[str, str]) -> str | None:
+    hit = _media_urls.get(key)
+    if hit and hit[1] > time.monotonic():
+        metrics.inc("meta_media.url_cache_hits")
+        return hit[0]
+    _media_urls.pop(key, None)
+    return None
+
+def _remember_media_url(key: tuple[str, str], url: str) -> None:
+    if len(_media_urls) >= META_MEDIA_URL_CACHE_MAX:
+        now = time.monotonic()
+        expired = [k for k, (_, exp) in _media_urls.items() if exp <= now]
+        # Sin vencidas: se descarta la mitad más vieja (orden de inserción)
+        for k in expired or list(_media_urls)[: len(_media_urls) // 2]:
+            _media_urls.pop(k, None)
+    _media_urls[key] = (url, time.monotonic() + META_MEDIA_URL_TTL_SECONDS)
+
+async def _meta_media_url(media_id: str, token: str, version: str, refresh: bool = False) -> str | None:
+    key = (version, media_id)
+    if not refresh:
+        cached = _cached_media_url(key)
+        if cached:
+            return cached
+    url = f"{META_GRAPH_URL}/{version}/{media_id}"
+    logger.info(f"📥 Fetching media URL from {url}")
+    data = await http_client.get_json(url, headers={"Authorization": f"Bearer {token}"})
+    media_url = data.get("url")
+    if not media_url:
+        logger.error(f"❌ No URL in media response: {data}")
         return None
+    _remember_media_url(key, media_url)
+    return media_url
 
-def download_meta_media(media_id: str, token: str = None, version: str = None) -> tuple[bytes, str, str] | None:
+async def download_meta_media(
+    media_id: str, dest_stem: str, token: str = None, version: str = None
+) -> tuple[uploads.StoredFile, str] | None:
     """
-    Descargar media desde Meta Cloud API.
+    Descargar media desde Meta Cloud API a UPLOAD_DIR (streaming por el cliente HTTP
+    compartido, sin cargarla en memoria). La URL del media se cachea mientras es válida.
     
     Args:
         media_id: ID del media en Meta
+        dest_stem: nombre del archivo sin extensión (la extensión sale del content-type)
         token: META_WA_TOKEN (si es None, usa env)
         version: META_API_VERSION (si es None, usa env o default)
     
     Returns:
-        (bytes, filename, content_type) o None si falla
+        (StoredFile, content_type) o None si falla (o si supera UPLOAD_MAX_BYTES)
     """
     if not token:
         token = META_WA_TOKEN
@@ -125,111 +198,47 @@ def download_meta_media(media_id: str, token: str = None, version: str = None) -
         logger.error("❌ META_WA_TOKEN not set, cannot download media")
         return None
     
+    def dest(content_type: str) -> str:
+        return os.path.join(UPLOAD_DIR, f"{dest_stem}.{_media_extension(content_type)}")
+    
     try:
-        # Step 1: Get media URL from Graph API
-        url = f"https://graph.facebook.com/{version}/{media_id}"
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        logger.info(f"📥 Fetching media URL from {url}")
-        resp = requests.get(url, headers=headers, timeout=30)
-        resp.raise_for_status()
-        
-        data = resp.json()
-        media_url = data.get("url")
-        
-        if not media_url:
-            logger.error(f"❌ No URL in media response: {data}")
-            return None
-        
-        logger.info(f"📥 Got media URL: {media_url[:80]}...")
-        
-        # Step 2: Download file from URL
-        resp = requests.get(media_url, headers=headers, timeout=30)
-        resp.raise_for_status()
-        
-        media_bytes = resp.content
-        content_type = resp.headers.get("Content-Type", "application/octet-stream").lower()
-        
-        # Infer filename from content-type
-        filename = f"media_{media_id}"
-        if "pdf" in content_type:
-            filename += ".pdf"
-        elif "jpeg" in content_type or "jpg" in content_type:
-            filename += ".jpg"
-        elif "png" in content_type:
-            filename += ".png"
-        else:
-            filename += ".bin"
+        for refresh in (False, True):
+            media_url = await _meta_media_url(media_id, token, version, refresh)
+            if not media_url:
+                return None
+            try:
+                stored, content_type = await http_client.download(
+                    media_url, dest, headers={"Authorization": f"Bearer {token}"}
+                )
+                break
+            except httpx.HTTPStatusError as e:
+                # URL cacheada vencida / revocada: una vez más con una URL nueva
+                if refresh or e.response.status_code not in (401, 403, 404, 410):
+                    raise
         
-        logger.info(f"✅ Downloaded media: {filename} ({len(media_bytes)} bytes, type: {content_type})")
-        return media_bytes, filename, content_type
+        logger.info(f"✅ Downloaded media: {os.path.basename(stored.path)} ({stored.size} bytes, type: {content_type})")
+        return stored, content_type
         
     except Exception as e:
         logger.error(f"❌ Error downloading media {media_id}: {str(e)}")
         return None
 
-@router.post("/twilio", response_class=PlainTextResponse)
-async def twilio_inbound(request: Request, db: Session = Depends(get_db)):
-    """Twilio envía application/x-www-form-urlencoded."""
-    form = await request.form()
-    from_phone = str(form.get("From") or "")
-    to_phone = str(form.get("To") or "sandbox")
-    body = str(form.get("Body") or "")
-    num_media = int(form.get("NumMedia") or 0)
-    media_url = str(form.get("MediaUrl0") or "")
-
-    tenant_id = _route_tenant_by_provider(db, "twilio", "sandbox")
-    if tenant_id is None:
-        raise HTTPException(status_code=400, detail="Channel not configured")
-
-    # POC: si hay media, intentamos descargarlo (requiere SID/Auth Token)
-    filename = "whatsapp_message.txt"
-    parsed = {"needs_review": True, "parse_confidence": 10}
-    text = ""
-
-    if num_media > 0 and media_url:
-        sid = os.getenv("TWILIO_ACCOUNT_SID", "")
-        token = os.getenv("TWILIO_AUTH_TOKEN", "")
-        if not sid or not token:
-            # sin credenciales: guardamos la URL como referencia
-            filename = "whatsapp_media_url.txt"
-            text = f"TWILIO_MEDIA_URL={media_url}"
-        else:
-            r = requests.get(media_url, auth=(sid, token), timeout=30)
-            r.raise_for_status()
-            # Twilio media puede ser pdf/jpg. Inferimos por content-type.
-            ctype = (r.headers.get("Content-Type") or "").lower()
-            ext = "bin"
-            if "pdf" in ctype:
-                ext = "pdf"
-            elif "jpeg" in ctype or "jpg" in ctype:
-                ext = "jpg"
-            elif "png" in ctype:
-                ext = "png"
-            filename = f"whatsapp_{tenant_id}_{abs(hash(media_url))}.{ext}"
-            path = os.path.join(UPLOAD_DIR, filename)
-            with open(path, "wb") as f:
-                f.write(r.content)
-
-            if ext == "pdf":
-                text = extract_text_from_pdf(path)
-                doc_key = detect_doc(text) if text else "unknown"
-                parsed = parse_by_type(doc_key, text) if text else parsed
-            else:
-                # imágenes: OCR/visión pendiente
-                parsed = {"source_system":"whatsapp","doc_type":"image","needs_review": True, "parse_confidence": 20}
-
+def _create_media_transaction(db: Session, tenant_id: int | None, source_file: str, parsed: dict, text: str, concept_fallback: str, inbound: IncomingMessage | None = None) -> Transaction:
+    """
+    Transaction de un documento / imagen recibido por Meta Cloud API. Con inbound, el
+    mensaje de la cola queda vinculado a la Transaction en el mismo commit.
+    """
     tx = Transaction(
-        tenant_id=tenant_id,
-        source_file=filename,
+        tenant_id=tenant_id or 1,
+        source_file=source_file,
         source_system="whatsapp",
-        doc_type=parsed.get("doc_type","unknown"),
+        doc_type=parsed.get("doc_type", "document"),
         datetime=parsed.get("datetime"),
-        currency=parsed.get("currency","ARS"),
+        currency=parsed.get("currency", "ARS"),
         amount=parsed.get("amount"),
-        direction=parsed.get("direction","unknown"),
+        direction=parsed.get("direction", "unknown"),
         operation_id=parsed.get("operation_id"),
-        operation_id_type=parsed.get("operation_id_type","unknown"),
+        operation_id_type=parsed.get("operation_id_type", "unknown"),
         payer_name=parsed.get("payer_name"),
         payer_cuit=parsed.get("payer_cuit"),
         payer_cuit_masked=parsed.get("payer_cuit_masked"),
@@ -242,17 +251,201 @@ async def twilio_inbound(request: Request, db: Session = Depends(get_db)):
         payee_bank=parsed.get("payee_bank"),
         payee_account_type=parsed.get("payee_account_type"),
         payee_account_id=parsed.get("payee_account_id"),
-        concept=parsed.get("concept") or body[:300] if body else None,
+        concept=parsed.get("concept") or concept_fallback[:300],
         raw_text=(text[:1900] if text else None),
         needs_review=bool(parsed.get("needs_review", True)),
         parse_confidence=parsed.get("parse_confidence", 10),
     )
     db.add(tx)
+    if inbound is not None:
+        db.flush()
+        inbound.transaction_id = tx.id
     db.commit()
     db.refresh(tx)
+    return tx
+
+QUEUED_MESSAGE_TYPES = ("document", "image")
+
+async def process_inbound_message(db: Session, inbound: IncomingMessage) -> None:
+    """
+    Procesa un mensaje encolado (worker de app.inbound_queue): descarga la media,
+    extrae, parsea, crea la Transaction y matchea. Una excepción = reintento con backoff.
+    """
+    message = json.loads(inbound.payload or "{}")
+    tenant_id = inbound.tenant_id
+    msg_id = inbound.message_id or str(inbound.id)
+    msg_type = message.get("type")
+    stem = f"whatsapp_{tenant_id}_{msg_id.replace('/', '_')}"
+
+    # Reintento después de crear la Transaction (ej. cayó antes de marcar done)
+    if inbound.transaction_id is not None:
+        logger.info(f"  ↩️  Message {msg_id} already has a transaction, skipping")
+        return
+
+    if msg_type == "document":
+        msg_content = message.get("document", {})
+        doc_id = msg_content.get("id")
+        doc_filename = msg_content.get("filename", "document")
+        logger.info(f"  📄 Document: {doc_filename} (ID: {doc_id})")
+
+        # Descargar media (directo a UPLOAD_DIR)
+        result = await download_meta_media(doc_id, stem)
+        if not result:
+            raise RuntimeError(f"Could not download document {doc_filename}")
+        stored, content_type = result
+        safe_filename = os.path.basename(stored.path)
+        logger.info(f"  💾 Saved to {safe_filename}")
+
+        # Extraer y parsear PDF
+        text = ""
+        parsed = {"needs_review": True, "parse_confidence": 10, "source_system": "whatsapp", "doc_type": "document"}
+        if "pdf" in content_type:
+            try:
+                text, pdf_parsed = await parse_cache.receipt_pdf_async(db, stored.path, stored.sha256)
+                if pdf_parsed:
+                    parsed = pdf_parsed
+                    logger.info(f"  ✅ Parsed as {parsed.get('doc_type')}: {parsed.get('concept', '')[:80]}")
+            except executor.ExtractionBusy:
+                raise
+            except Exception as e:
+                logger.error(f"  ❌ Error extracting PDF: {str(e)}")
+        concept_fallback = doc_filename
+
+    elif msg_type == "image":
+        msg_content = message.get("image", {})
+        image_id = msg_content.get("id")
+        logger.info(f"  🖼️  Image ID: {image_id}")
+
+        result = await download_meta_media(image_id, stem)
+        if not result:
+            raise RuntimeError(f"Could not download image {image_id}")
+        stored, content_type = result
+        safe_filename = os.path.basename(stored.path)
+
+        # OCR + parseo (mismo registro de formatos que los PDFs)
+        text = ""
+        parsed = {"needs_review": True, "parse_confidence": 10, "source_system": "whatsapp", "doc_type": "image"}
+        try:
+            text, image_parsed = await parse_cache.receipt_image_async(db, stored.path, stored.sha256)
+            if image_parsed:
+                parsed = image_parsed
+                logger.info(f"  ✅ OCR parsed as {parsed.get('doc_type')}")
+        except executor.ExtractionBusy:
+            raise
+        except Exception as e:
+            logger.error(f"  ❌ Error in OCR: {str(e)}")
+        concept_fallback = msg_content.get("caption") or ""
+
+    else:
+        return
 
+    tx = _create_media_transaction(db, tenant_id, safe_filename, parsed, text, concept_fallback, inbound)
+    logger.info(f"  📦 Created Transaction {tx.id}")
     _resolve_and_match(db, tx, tenant_id)
 
+async def _download_twilio_media(media_url: str, tenant_id: int, sid: str, token: str) -> uploads.StoredFile | None:
+    """Media de Twilio a UPLOAD_DIR por el cliente HTTP compartido. None si es demasiado grande."""
+    def dest(content_type: str) -> str:
+        # Twilio media puede ser pdf/jpg. Inferimos por content-type.
+        return os.path.join(UPLOAD_DIR, f"whatsapp_{tenant_id}_{abs(hash(media_url))}.{_media_extension(content_type)}")
+
+    try:
+        stored, _ = await http_client.download(media_url, dest, auth=(sid, token))
+        return stored
+    except uploads.UploadTooLarge:
+        logger.warning(f"⚠️  Media too large, not downloaded: {media_url}")
+        return None
+
+async def _twilio_media_document(db: Session, media_url: str, stored: uploads.StoredFile | None) -> tuple[str, str, dict]:
+    """(filename, texto, parsed) de un adjunto de Twilio."""
+    parsed = {"needs_review": True, "parse_confidence": 10}
+    if stored is None:
+        # Demasiado grande: guardamos la URL como referencia
+        return "whatsapp_media_url.txt", f"TWILIO_MEDIA_URL={media_url}", parsed
+    filename = os.path.basename(stored.path)
+    ext = filename.rsplit(".", 1)[-1]
+    text = ""
+    if ext == "pdf":
+        try:
+            text, pdf_parsed = await parse_cache.receipt_pdf_async(db, stored.path, stored.sha256)
+            parsed = pdf_parsed or parsed
+        except (executor.ExtractionBusy, TimeoutError) as e:
+            # Se guarda igual (needs_review) para no perder el comprobante
+            logger.warning(f"⚠️  Extraction skipped for {filename}: {type(e).__name__}")
+    elif ext in ("jpg", "png"):
+        parsed = {"source_system":"whatsapp","doc_type":"image","needs_review": True, "parse_confidence": 20}
+        try:
+            text, image_parsed = await parse_cache.receipt_image_async(db, stored.path, stored.sha256)
+            parsed = image_parsed or parsed
+        except Exception as e:
+            # Sin tesseract / cola llena / timeout: se guarda igual (needs_review)
+            logger.warning(f"⚠️  OCR skipped for {filename}: {type(e).__name__}")
+    return filename, text, parsed
+
+@router.post("/twilio", response_class=PlainTextResponse)
+async def twilio_inbound(request: Request, db: Session = Depends(get_db)):
+    """Twilio envía application/x-www-form-urlencoded."""
+    form = await request.form()
+    from_phone = str(form.get("From") or "")
+    to_phone = str(form.get("To") or "sandbox")
+    body = str(form.get("Body") or "")
+    num_media = int(form.get("NumMedia") or 0)
+    media_urls = [str(form.get(f"MediaUrl{i}")) for i in range(num_media) if form.get(f"MediaUrl{i}")]
+
+    tenant_id = _route_tenant_by_provider(db, "twilio", "sandbox")
+    if tenant_id is None:
+        raise HTTPException(status_code=400, detail="Channel not configured")
+
+    # POC: si hay media, intentamos descargarlo (requiere SID/Auth Token); un comprobante por adjunto
+    documents = [("whatsapp_message.txt", "", {"needs_review": True, "parse_confidence": 10})]
+
+    if media_urls:
+        sid = os.getenv("TWILIO_ACCOUNT_SID", "")
+        token = os.getenv("TWILIO_AUTH_TOKEN", "")
+        if not sid or not token:
+            # sin credenciales: guardamos la URL como referencia
+            text = "\n".join(f"TWILIO_MEDIA_URL={u}" for u in media_urls)
+            documents = [("whatsapp_media_url.txt", text, {"needs_review": True, "parse_confidence": 10})]
+        else:
+            # Adjuntos en paralelo (conexiones reusadas del pool del cliente HTTP)
+            stored = await asyncio.gather(*(_download_twilio_media(u, tenant_id, sid, token) for u in media_urls))
+            documents = await asyncio.gather(*(_twilio_media_document(db, u, f) for u, f in zip(media_urls, stored)))
+
+    for filename, text, parsed in documents:
+        tx = Transaction(
+            tenant_id=tenant_id,
+            source_file=filename,
+            source_system="whatsapp",
+            doc_type=parsed.get("doc_type","unknown"),
+            datetime=parsed.get("datetime"),
+            currency=parsed.get("currency","ARS"),
+            amount=parsed.get("amount"),
+            direction=parsed.get("direction","unknown"),
+            operation_id=parsed.get("operation_id"),
+            operation_id_type=parsed.get("operation_id_type","unknown"),
+            payer_name=parsed.get("payer_name"),
+            payer_cuit=parsed.get("payer_cuit"),
+            payer_cuit_masked=parsed.get("payer_cuit_masked"),
+            payer_bank=parsed.get("payer_bank"),
+            payer_account_type=parsed.get("payer_account_type"),
+            payer_account_id=parsed.get("payer_account_id"),
+            payee_name=parsed.get("payee_name"),
+            payee_cuit=parsed.get("payee_cuit"),
+            payee_cuit_masked=parsed.get("payee_cuit_masked"),
+            payee_bank=parsed.get("payee_bank"),
+            payee_account_type=parsed.get("payee_account_type"),
+            payee_account_id=parsed.get("payee_account_id"),
+            concept=parsed.get("concept") or body[:300] if body else None,
+            raw_text=(text[:1900] if text else None),
+            needs_review=bool(parsed.get("needs_review", True)),
+            parse_confidence=parsed.get("parse_confidence", 10),
+        )
+        db.add(tx)
+        db.commit()
+        db.refresh(tx)
+
+        _resolve_and_match(db, tx, tenant_id)
+
     # Respuesta TwiML simplificada (texto plano; Twilio acepta)
     return "OK"
 
@@ -365,6 +558,161 @@ async def meta_cloud_health(db: Session = Depends(get_db)):
     }
 
 
+@dataclass
+class _MetaEvent:
+    """Un evento reenviado por Vercel, ya aplanado (todos los entry / changes)."""
+    tenant_id: int | None
+    phone_number_id: str | None
+    request_id: str | None
+    changes: list[tuple[str | None, dict]]
+    messages: list[tuple[int | None, str | None, dict]]  # (tenant_id, phone_number_id, message)
+    statuses: list[dict]
+    contacts: list[dict]
+    raw: WhatsAppEvent
+
+def _parse_meta_event(db: Session, body: dict, headers, tenants: dict) -> _MetaEvent:
+    """
+    Sobre de Vercel → _MetaEvent. tenants cachea la resolución de tenant por
+    (tenant header, phone_number_id) dentro del request / lote.
+    """
+    tenant_header = body.get("tenant_id") or headers.get("x-tenant-id")
+    phone_number_id = body.get("phone_number_id") or headers.get("x-phone-number-id")
+    payload = body.get("payload") or {}
+    timestamp_str = body.get("timestamp", datetime.utcnow().isoformat())
+
+    def tenant_for(phone_id: str | None) -> int | None:
+        key = (tenant_header, phone_id)
+        if key not in tenants:
+            tenants[key] = _resolve_tenant(db, phone_id, tenant_header)
+        return tenants[key]
+
+    tenant_id = tenant_for(phone_number_id)
+    logger.info(
+        f"📱 Meta Cloud Event - tenant: {tenant_id}, phone_number_id: {phone_number_id}"
+    )
+
+    changes = _flatten_changes(payload, phone_number_id)
+    messages, statuses, contacts = [], [], []
+    for change_phone_id, value in changes:
+        for message in value.get("messages") or []:
+            messages.append((tenant_for(change_phone_id), change_phone_id, message))
+        statuses.extend(value.get("statuses") or [])
+        contacts.extend(value.get("contacts") or [])
+
+    # Evento crudo para debugging/traceability (lo persiste quien llama)
+    first = messages[0][2] if messages else {}
+    raw = WhatsAppEvent(
+        tenant_id=tenant_id,
+        phone_number_id=phone_number_id,
+        wa_from=first.get("from"),
+        message_id=first.get("id"),
+        timestamp=timestamp_str,
+        raw_payload=json.dumps(payload)[:3800],
+    )
+
+    # Procesar contactos (solo log, el modelo de Counterparty no incluye campos WA)
+    for contact in contacts:
+        contact_name = contact.get("profile", {}).get("name", "Unknown")
+        contact_wa_id = contact.get("wa_id")
+        logger.info(f"👤 Contact: {contact_name} ({contact_wa_id})")
+
+    # Procesar cambios de estado
+    for status in statuses:
+        status_id = status.get("id")
+        status_value = status.get("status")  # sent, delivered, read, failed
+        recipient_id = status.get("recipient_id")
+        logger.info(
+            f"✓ Status - id: {status_id}, status: {status_value}, recipient: {recipient_id}"
+        )
+
+    return _MetaEvent(
+        tenant_id=tenant_id,
+        phone_number_id=phone_number_id,
+        request_id=body.get("request_id") or headers.get("x-request-id"),
+        changes=changes,
+        messages=messages,
+        statuses=statuses,
+        contacts=contacts,
+        raw=raw,
+    )
+
+def _save_raw_events(db: Session, events: list[_MetaEvent]) -> None:
+    """WhatsAppEvent de todos los eventos en una sola transacción (best effort)."""
+    try:
+        db.add_all([event.raw for event in events])
+        db.commit()
+    except Exception as e:
+        logger.warning(f"⚠️  Could not persist WhatsAppEvent: {str(e)}")
+        db.rollback()
+
+def _register_messages(db: Session, events: list[_MetaEvent]) -> list[list[dict]]:
+    """
+    Idempotencia por message_id para todos los mensajes de los eventos: una query IN y
+    un INSERT. Devuelve, por evento, el resultado de cada mensaje
+    (queued / done / duplicate / ignored). Despierta a los workers si se encoló algo.
+    """
+    known = _known_message_ids(db, [(tenant_id, m["id"]) for e in events for tenant_id, _, m in e.messages if m.get("id")])
+    results, rows = [], []
+    for event in events:
+        event_results = []
+        results.append(event_results)
+        for msg_tenant_id, msg_phone_id, message in event.messages:
+            msg_id = message.get("id")
+            msg_type = message.get("type")
+            logger.info(f"📨 Message - id: {msg_id}, type: {msg_type}, from: {message.get('from')}")
+            result = {"id": msg_id, "type": msg_type, "tenant_id": msg_tenant_id}
+            event_results.append(result)
+            if not msg_id:
+                result["status"] = "ignored"
+                continue
+            if (msg_tenant_id, msg_id) in known:
+                logger.info(f"  ↩️  Message {msg_id} already processed, skipping")
+                result["status"] = "duplicate"
+                continue
+            known.add((msg_tenant_id, msg_id))
+            if msg_type == "text":
+                logger.info(f"  📝 Text: {message.get('text', {}).get('body', '')[:100]}...")
+
+            # Texto: sin trabajo pendiente; documento / imagen: a la cola
+            needs_work = msg_type in QUEUED_MESSAGE_TYPES
+            result["status"] = "queued" if needs_work else "done"
+            rows.append({
+                "tenant_id": msg_tenant_id,
+                "message_id": msg_id,
+                "sender_wa_id": message.get("from"),
+                "phone_number_id": msg_phone_id,
+                "msg_type": msg_type,
+                "content": json.dumps(message).replace("\\n", " ")[:500],
+                "status": result["status"],
+                "payload": json.dumps(message) if needs_work else None,
+            })
+
+    # Si el insert falla se propaga (500): la fila de la cola es el único registro del mensaje
+    inserted = _insert_inbound_messages(db, rows)
+    queued = 0
+    for result in (r for event_results in results for r in event_results):
+        if result["status"] in ("queued", "done") and (result["tenant_id"], result["id"]) not in inserted:
+            # Lo registró otro request entre el chequeo y el insert (reintento concurrente)
+            result["status"] = "duplicate"
+        queued += result["status"] == "queued"
+    if queued:
+        # Despierta a todos los workers: los mensajes se procesan en paralelo
+        inbound_queue.notify()
+    return results
+
+def _event_ack(event: _MetaEvent, results: list[dict]) -> dict:
+    return {
+        "status": "received",
+        "tenant_id": event.tenant_id,
+        "phone_number_id": event.phone_number_id,
+        "changes_processed": len(event.changes),
+        "messages_processed": len(event.messages),
+        "messages_queued": sum(r["status"] == "queued" for r in results),
+        "statuses_processed": len(event.statuses),
+        "contacts_processed": len(event.contacts),
+        "messages": results,
+    }
+
 @router.post("/meta/cloud")
 async def receive_meta_cloud_events(
     request: Request,
@@ -394,185 +742,122 @@ async def receive_meta_cloud_events(
         logger.error(f"❌ Invalid JSON: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    # Extraer datos
-    tenant_header = body.get("tenant_id") or request.headers.get("x-tenant-id")
-    phone_number_id = body.get("phone_number_id") or request.headers.get("x-phone-number-id")
-    payload = body.get("payload", {})
-    timestamp_str = body.get("timestamp", datetime.utcnow().isoformat())
-
-    tenant_id = _resolve_tenant(db, phone_number_id, tenant_header)
-
-    logger.info(
-        f"📱 Meta Cloud Event - tenant: {tenant_id}, phone_number_id: {phone_number_id}"
-    )
-
-    # Extraer datos del payload
     try:
-        entry = payload.get("entry", [{}])[0]
-        change = entry.get("changes", [{}])[0]
-        value = change.get("value", {})
-
-        messages = value.get("messages", [])
-        statuses = value.get("statuses", [])
-        contacts = value.get("contacts", [])
+        event = _parse_meta_event(db, body, request.headers, {})
+        _save_raw_events(db, [event])
+        results = _register_messages(db, [event])[0]
 
-        # Persist raw event for debugging/traceability
-        try:
-            evt = WhatsAppEvent(
-                tenant_id=tenant_id,
-                phone_number_id=phone_number_id,
-                wa_from=messages[0].get("from") if messages else None,
-                message_id=messages[0].get("id") if messages else None,
-                timestamp=timestamp_str,
-                raw_payload=json.dumps(payload)[:3800],
-            )
-            db.add(evt)
-            db.commit()
-        except Exception as e:
-            logger.warning(f"⚠️  Could not persist WhatsAppEvent: {str(e)}")
-            db.rollback()
-
-        # Procesar contactos (solo log, el modelo de Counterparty no incluye campos WA)
-        for contact in contacts:
-            contact_name = contact.get("profile", {}).get("name", "Unknown")
-            contact_wa_id = contact.get("wa_id")
-            logger.info(f"👤 Contact: {contact_name} ({contact_wa_id})")
+        logger.info(
+            f"✅ Meta event processed - tenant: {event.tenant_id}, changes: {len(event.changes)}, messages: {len(event.messages)}"
+        )
+        return _event_ack(event, results)
 
-        # Procesar mensajes
-        for message in messages:
-            msg_id = message.get("id")
-            msg_type = message.get("type")
-            from_wa_id = message.get("from")
+    except Exception as e:
+        logger.error(f"❌ Error processing Meta event: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
-            logger.info(f"📨 Message - id: {msg_id}, type: {msg_type}, from: {from_wa_id}")
 
-            # Verificar idempotencia por message_id
-            if _message_already_processed(db, tenant_id, msg_id):
-                logger.info(f"  ↩️  Message {msg_id} already processed, skipping")
-                continue
+def _batch_limits() -> dict:
+    return {
+        "max_events": WEBHOOK_BATCH_MAX_EVENTS,
+        "max_bytes": WEBHOOK_BATCH_MAX_BYTES,
+        "max_decompressed_bytes": WEBHOOK_BATCH_MAX_DECOMPRESSED_BYTES,
+        "content_encodings": ["identity", "gzip"],
+    }
 
-            # Registrar mensaje en tabla de idempotencia
-            _record_inbound_message(
-                db,
-                message_id=msg_id,
-                sender_wa_id=from_wa_id,
-                phone_number_id=phone_number_id,
-                tenant_id=tenant_id,
-                msg_type=msg_type,
-                content=json.dumps(message).replace("\\n", " ")[:500],
-                status="received",
-            )
-
-            # Procesar según tipo
-            if msg_type == "text":
-                msg_content = message.get("text", {})
-                text_body = msg_content.get("body", "")
-                logger.info(f"  📝 Text: {text_body[:100]}...")
-
-            elif msg_type == "document":
-                msg_content = message.get("document", {})
-                doc_id = msg_content.get("id")
-                doc_filename = msg_content.get("filename", "document")
-                logger.info(f"  📄 Document: {doc_filename} (ID: {doc_id})")
-                
-                # Descargar media
-                result = download_meta_media(doc_id)
-                if not result:
-                    logger.warning(f"  ❌ Could not download document {doc_filename}")
-                    continue
-                
-                media_bytes, local_filename, content_type = result
-                
-                # Guardar archivo
-                safe_filename = f"whatsapp_{tenant_id}_{msg_id.replace('/', '_')}.pdf"
-                file_path = os.path.join(UPLOAD_DIR, safe_filename)
-                try:
-                    with open(file_path, "wb") as f:
-                        f.write(media_bytes)
-                    logger.info(f"  💾 Saved to {safe_filename}")
-                except Exception as e:
-                    logger.error(f"  ❌ Error saving file: {str(e)}")
-                    continue
-                
-                # Extraer y parsear PDF
-                text = ""
-                parsed = {"needs_review": True, "parse_confidence": 10, "source_system": "whatsapp", "doc_type": "document"}
-                
-                if "pdf" in content_type:
-                    try:
-                        text = extract_text_from_pdf(file_path)
-                        if text:
-                            doc_key = detect_doc(text)
-                            parsed = parse_by_type(doc_key, text)
-                            logger.info(f"  ✅ Parsed as {parsed.get('doc_type')}: {parsed.get('concept', '')[:80]}")
-                    except Exception as e:
-                        logger.error(f"  ❌ Error extracting PDF: {str(e)}")
-                
-                # Crear Transaction
-                tx = Transaction(
-                    tenant_id=tenant_id or 1,
-                    source_file=safe_filename,
-                    source_system="whatsapp",
-                    doc_type=parsed.get("doc_type", "document"),
-                    datetime=parsed.get("datetime"),
-                    currency=parsed.get("currency", "ARS"),
-                    amount=parsed.get("amount"),
-                    direction=parsed.get("direction", "unknown"),
-                    operation_id=parsed.get("operation_id"),
-                    operation_id_type=parsed.get("operation_id_type", "unknown"),
-                    payer_name=parsed.get("payer_name"),
-                    payer_cuit=parsed.get("payer_cuit"),
-                    payer_cuit_masked=parsed.get("payer_cuit_masked"),
-                    payer_bank=parsed.get("payer_bank"),
-                    payer_account_type=parsed.get("payer_account_type"),
-                    payer_account_id=parsed.get("payer_account_id"),
-                    payee_name=parsed.get("payee_name"),
-                    payee_cuit=parsed.get("payee_cuit"),
-                    payee_cuit_masked=parsed.get("payee_cuit_masked"),
-                    payee_bank=parsed.get("payee_bank"),
-                    payee_account_type=parsed.get("payee_account_type"),
-                    payee_account_id=parsed.get("payee_account_id"),
-                    concept=parsed.get("concept") or doc_filename[:300],
-                    raw_text=(text[:1900] if text else None),
-                    needs_review=bool(parsed.get("needs_review", True)),
-                    parse_confidence=parsed.get("parse_confidence", 10),
-                )
-                db.add(tx)
-                db.commit()
-                db.refresh(tx)
-                logger.info(f"  📦 Created Transaction {tx.id}")
-                
-                # Resolver y matchear
-                _resolve_and_match(db, tx, tenant_id)
-
-            elif msg_type == "image":
-                msg_content = message.get("image", {})
-                image_id = msg_content.get("id")
-                logger.info(f"  🖼️  Image ID: {image_id}")
-                # TODO: Descargar via Graph API y procesar con OCR
-
-        # Procesar cambios de estado
-        for status in statuses:
-            status_id = status.get("id")
-            status_value = status.get("status")  # sent, delivered, read, failed
-            recipient_id = status.get("recipient_id")
-            logger.info(
-                f"✓ Status - id: {status_id}, status: {status_value}, recipient: {recipient_id}"
-            )
+def _batch_too_large(reason: str) -> HTTPException:
+    metrics.inc("whatsapp.batch_rejected")
+    return HTTPException(status_code=413, detail={"error": reason, "limits": _batch_limits()})
+
+async def _read_batch_body(request: Request) -> bytes:
+    """Body del lote con tope de bytes (antes y después de descomprimir gzip)."""
+    declared = int(request.headers.get("content-length") or 0)
+    if declared > WEBHOOK_BATCH_MAX_BYTES:
+        raise _batch_too_large("Batch body too large")
+    raw = bytearray()
+    async for chunk in request.stream():
+        raw.extend(chunk)
+        if len(raw) > WEBHOOK_BATCH_MAX_BYTES:
+            raise _batch_too_large("Batch body too large")
+
+    encoding = request.headers.get("content-encoding", "identity").lower()
+    if encoding in ("", "identity"):
+        return bytes(raw)
+    if encoding != "gzip":
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+    try:
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = inflater.decompress(bytes(raw), WEBHOOK_BATCH_MAX_DECOMPRESSED_BYTES + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    if len(data) > WEBHOOK_BATCH_MAX_DECOMPRESSED_BYTES:
+        raise _batch_too_large("Decompressed batch too large")
+    return data
+
+@router.get("/meta/cloud/batch")
+async def meta_cloud_batch_limits():
+    """Límites del endpoint de lotes (para que el relay arme lotes que entren)."""
+    return _batch_limits()
+
+@router.post("/meta/cloud/batch")
+async def receive_meta_cloud_batch(
+    request: Request,
+    db: Session = Depends(get_db),
+    auth: dict = Depends(verify_webhook_auth),
+):
+    """
+    Lote de eventos de Meta Cloud API reenviados por Vercel (opcionalmente con
+    Content-Encoding: gzip). Cada evento es el mismo sobre que /meta/cloud:
 
-        logger.info(
-            f"✅ Meta event processed - tenant: {tenant_id}, messages: {len(messages)}"
-        )
+    {"events": [{"tenant_id": ..., "phone_number_id": ..., "payload": {...}, "request_id": ...}, ...]}
 
-        return {
-            "status": "received",
-            "tenant_id": tenant_id,
-            "phone_number_id": phone_number_id,
-            "messages_processed": len(messages),
-            "statuses_processed": len(statuses),
-            "contacts_processed": len(contacts),
-        }
+    Los WhatsAppEvent del lote se guardan en una sola transacción y la idempotencia de
+    todos los mensajes es una query + un insert. Responde un ack por evento (en orden).
+    Límites: GET /meta/cloud/batch (WEBHOOK_BATCH_MAX_EVENTS / _MAX_BYTES; 413 si se pasan).
+    """
+    started = time.perf_counter()
+    raw = await _read_batch_body(request)
+    try:
+        body = json.loads(raw or b"{}")
+    except ValueError as e:
+        logger.error(f"❌ Invalid JSON: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    envelopes = body.get("events") if isinstance(body, dict) else body
+    if not isinstance(envelopes, list):
+        raise HTTPException(status_code=400, detail="Expected {\"events\": [...]}")
+    if len(envelopes) > WEBHOOK_BATCH_MAX_EVENTS:
+        raise _batch_too_large(f"Too many events ({len(envelopes)})")
+
+    acks: list[dict] = [{"index": i} for i in range(len(envelopes))]
+    events: list[tuple[int, _MetaEvent]] = []
+    tenants: dict = {}
+    for i, envelope in enumerate(envelopes):
+        if not isinstance(envelope, dict) or not isinstance(envelope.get("payload"), dict):
+            acks[i].update(status="invalid", error="Missing payload")
+            continue
+        acks[i]["request_id"] = envelope.get("request_id")
+        try:
+            events.append((i, _parse_meta_event(db, envelope, request.headers, tenants)))
+        except Exception as e:
+            logger.warning(f"⚠️  Invalid event {i} in batch: {str(e)}")
+            acks[i].update(status="invalid", error=str(e)[:200])
 
+    try:
+        _save_raw_events(db, [event for _, event in events])
+        results = _register_messages(db, [event for _, event in events])
     except Exception as e:
-        logger.error(f"❌ Error processing Meta event: {str(e)}")
+        logger.error(f"❌ Error processing Meta batch: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+
+    for (i, event), event_results in zip(events, results):
+        acks[i].update(_event_ack(event, event_results))
+
+    metrics.inc("whatsapp.batch_events", len(envelopes))
+    metrics.observe("whatsapp.batch_ms", (time.perf_counter() - started) * 1000)
+    logger.info(f"✅ Meta batch processed - events: {len(envelopes)}, valid: {len(events)}")
+    return {
+        "status": "received",
+        "events": len(envelopes),
+        "messages_queued": sum(a.get("messages_queued", 0) for a in acks),
+        "acks": acks,
+    }
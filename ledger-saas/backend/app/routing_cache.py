@@ -0,0 +1,110 @@
+"""
+Cache en proceso del ruteo de webhooks de WhatsApp: (provider, external_id) → tenant_id.
+
+El ruteo (tabla channels y, para Meta, tenants.phone_number_id) cambia muy de vez en
+cuando, así que cada webhook lo resuelve en memoria en vez de consultar la BD:
+
+- cada entrada vive ROUTING_CACHE_TTL_SECONDS; los números desconocidos también se
+  cachean (negativo) por ROUTING_CACHE_NEGATIVE_TTL_SECONDS, para no consultar la BD en
+  cada evento de un número sin configurar
+- toda escritura de Channel / Tenant por el ORM (flush) incrementa la versión "routing"
+  en cache_versions dentro de la misma transacción y vacía la cache local. Los scripts
+  o updates bulk que no pasan por el ORM llaman a touch()
+- cada ROUTING_CACHE_VERSION_CHECK_SECONDS se compara la versión con la de la BD, así
+  los cambios hechos por otros workers / procesos se toman sin reiniciar
+
+Métricas: routing_cache.hits, routing_cache.negative_hits, routing_cache.misses.
+"""
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import cache_version, metrics
+from .models import Channel, Tenant
+
+# Configuración desde .env
+ROUTING_CACHE_ENABLED = os.getenv("ROUTING_CACHE_ENABLED", "true").lower() == "true"
+ROUTING_CACHE_TTL_SECONDS = float(os.getenv("ROUTING_CACHE_TTL_SECONDS", "300"))
+ROUTING_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("ROUTING_CACHE_NEGATIVE_TTL_SECONDS", "30"))
+ROUTING_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("ROUTING_CACHE_VERSION_CHECK_SECONDS", "5"))
+ROUTING_CACHE_MAX_ENTRIES = int(os.getenv("ROUTING_CACHE_MAX_ENTRIES", "10000"))
+
+VERSION_KEY = "routing"
+
+_lock = threading.Lock()
+_entries: dict[tuple[str, str], tuple[int | None, float]] = {}  # key → (tenant_id, expira)
+_version: int | None = None
+_checked_at = 0.0
+
+def _load(db: Session, provider: str, external_id: str) -> int | None:
+    ch = db.query(Channel).filter(
+        Channel.kind == "whatsapp",
+        Channel.provider == provider,
+        Channel.external_id == external_id,
+    ).first()
+    if ch:
+        return ch.tenant_id
+    if provider == "meta":
+        # Mapeo directo en el tenant (map_phone_to_tenant.py / seed)
+        tenant = db.query(Tenant).filter(Tenant.phone_number_id == external_id).first()
+        if tenant:
+            return tenant.id
+    return None
+
+def _check_version(db: Session, now: float) -> None:
+    """Vacía la cache si otro worker cambió el ruteo (como mucho una query cada N segundos)."""
+    global _version, _checked_at
+    if now - _checked_at < ROUTING_CACHE_VERSION_CHECK_SECONDS:
+        return
+    version = cache_version.get(db, VERSION_KEY)
+    with _lock:
+        if version != _version:
+            _entries.clear()
+            _version = version
+        _checked_at = now
+
+def tenant_id_for(db: Session, provider: str, external_id: str) -> int | None:
+    """Tenant del canal de WhatsApp (provider, external_id), o None si no está configurado."""
+    if not ROUTING_CACHE_ENABLED:
+        return _load(db, provider, external_id)
+    now = time.monotonic()
+    _check_version(db, now)
+    key = (provider, external_id)
+    hit = _entries.get(key)
+    if hit and hit[1] > now:
+        metrics.inc("routing_cache.hits" if hit[0] is not None else "routing_cache.negative_hits")
+        return hit[0]
+
+    metrics.inc("routing_cache.misses")
+    tenant_id = _load(db, provider, external_id)
+    ttl = ROUTING_CACHE_TTL_SECONDS if tenant_id is not None else ROUTING_CACHE_NEGATIVE_TTL_SECONDS
+    with _lock:
+        if len(_entries) >= ROUTING_CACHE_MAX_ENTRIES:
+            _entries.clear()
+        _entries[key] = (tenant_id, now + ttl)
+    return tenant_id
+
+def invalidate() -> None:
+    """Vacía la cache local (sin tocar la versión en BD)."""
+    with _lock:
+        _entries.clear()
+
+def touch(db: Session) -> None:
+    """Marca el ruteo como modificado para todos los workers (escrituras fuera del flush del ORM)."""
+    cache_version.bump(db.connection(), VERSION_KEY)
+    invalidate()
+
+def clear() -> None:
+    global _version, _checked_at
+    with _lock:
+        _entries.clear()
+        _version = None
+        _checked_at = 0.0
+
+@event.listens_for(Session, "after_flush")
+def _on_flush(session, flush_context):
+    if any(isinstance(obj, (Channel, Tenant)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        cache_version.bump(session.connection(), VERSION_KEY)
+        invalidate()
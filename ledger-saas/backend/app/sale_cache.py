@@ -0,0 +1,150 @@
+"""
+Cache en proceso de ventas abiertas por tenant para el matching online (opcional).
+
+Con SALE_CACHE_ENABLED=true, match_sale busca candidatos en un SaleIndex en memoria
+(buckets por moneda y monto, ordenados por fecha) armado con snapshots de las ventas
+abiertas del tenant, en vez de consultar la BD en cada comprobante.
+
+Consistencia:
+- Toda escritura de Sale por el ORM (flush) incrementa la versión "sales:<tenant>"
+  en cache_versions dentro de la misma transacción e invalida la entrada local.
+  Los updates bulk (apply_sale_match, re-match) llaman a touch() explícitamente.
+- Cada SALE_CACHE_VERSION_CHECK_SECONDS se compara la versión cacheada con la de la
+  BD, así los cambios hechos por otros workers se toman sin reiniciar.
+- match_sale confirma en BD que la venta ganadora siga abierta antes de devolverla.
+
+Memoria: LRU entre tenants con tope total de ventas (SALE_CACHE_MAX_SALES).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from . import cache_version, metrics
+from .models import Sale
+from .sale_index import SaleIndex
+
+# Configuración desde .env
+SALE_CACHE_ENABLED = os.getenv("SALE_CACHE_ENABLED", "false").lower() == "true"
+SALE_CACHE_MAX_SALES = int(os.getenv("SALE_CACHE_MAX_SALES", "200000"))
+SALE_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("SALE_CACHE_VERSION_CHECK_SECONDS", "2"))
+
+@dataclass(slots=True)
+class SaleSnapshot:
+    """Copia desacoplada de la sesión con lo que usan _strong_id_check y _rank_candidates."""
+    id: int
+    currency: str
+    amount: float
+    datetime_ts: datetime | None
+    external_ref: str | None
+    external_ref_lower: str | None
+    customer_cuit: str | None
+    customer_phone_digits: str | None
+    customer_name_tokens: str | None
+
+_SNAPSHOT_COLUMNS = [getattr(Sale, f) for f in SaleSnapshot.__dataclass_fields__]
+
+@dataclass
+class _Entry:
+    index: SaleIndex | None  # None = tenant más grande que el tope (no se cachea)
+    version: int
+    checked_at: float
+
+    @property
+    def size(self) -> int:
+        return self.index.size if self.index else 0
+
+_lock = threading.Lock()
+_entries: "OrderedDict[int, _Entry]" = OrderedDict()
+_total_sales = 0
+
+def _version_key(tenant_id: int) -> str:
+    return f"sales:{tenant_id}"
+
+def _load(db: Session, tenant_id: int) -> SaleIndex:
+    rows = db.execute(
+        select(*_SNAPSHOT_COLUMNS).where(Sale.tenant_id == tenant_id, Sale.status == "open")
+    ).all()
+    return SaleIndex([SaleSnapshot(*r) for r in rows])
+
+def _drop(tenant_id: int) -> None:
+    global _total_sales
+    entry = _entries.pop(tenant_id, None)
+    if entry:
+        _total_sales -= entry.size
+
+def _store(tenant_id: int, entry: _Entry) -> None:
+    global _total_sales
+    _drop(tenant_id)
+    _entries[tenant_id] = entry
+    _total_sales += entry.size
+    while _total_sales > SALE_CACHE_MAX_SALES and len(_entries) > 1:
+        evicted, _ = next(iter(_entries.items()))
+        _drop(evicted)
+        metrics.inc("sale_cache.evictions")
+    metrics.set_gauge("sale_cache.sales", _total_sales)
+    metrics.set_gauge("sale_cache.tenants", len(_entries))
+
+def get_index(db: Session, tenant_id: int) -> SaleIndex | None:
+    """SaleIndex de ventas abiertas del tenant, o None si la cache está deshabilitada."""
+    if not SALE_CACHE_ENABLED:
+        return None
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(tenant_id)
+        if entry:
+            _entries.move_to_end(tenant_id)
+    fresh = entry is not None and now - entry.checked_at < SALE_CACHE_VERSION_CHECK_SECONDS
+    if not fresh:
+        version = cache_version.get(db, _version_key(tenant_id))
+        if entry and entry.version == version:
+            entry.checked_at = now
+            fresh = True
+    if fresh:
+        metrics.inc("sale_cache.hits" if entry.index is not None else "sale_cache.bypass")
+        return entry.index
+
+    metrics.inc("sale_cache.misses")
+    index = _load(db, tenant_id)
+    if index.size > SALE_CACHE_MAX_SALES:
+        # Un tenant más grande que el tope no se cachea (match_sale va a la BD);
+        # se recuerda hasta que cambie la versión para no recargarlo en cada request
+        index = None
+    with _lock:
+        _store(tenant_id, _Entry(index, version, now))
+    return index
+
+def invalidate(tenant_id: int) -> None:
+    """Descarta la entrada local del tenant (sin tocar la versión en BD)."""
+    with _lock:
+        _drop(tenant_id)
+
+def touch(db: Session, tenant_id: int) -> None:
+    """Marca las ventas del tenant como modificadas (para updates bulk fuera del flush del ORM)."""
+    if not SALE_CACHE_ENABLED:
+        return
+    cache_version.bump(db.connection(), _version_key(tenant_id))
+    invalidate(tenant_id)
+
+def clear() -> None:
+    global _total_sales
+    with _lock:
+        _entries.clear()
+        _total_sales = 0
+
+@event.listens_for(Session, "after_flush")
+def _on_flush(session, flush_context):
+    if not SALE_CACHE_ENABLED:
+        return
+    tenants = {
+        obj.tenant_id
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, Sale) and obj.tenant_id is not None
+    }
+    for tenant_id in tenants:
+        cache_version.bump(session.connection(), _version_key(tenant_id))
+        invalidate(tenant_id)
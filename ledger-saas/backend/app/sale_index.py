@@ -0,0 +1,128 @@
+"""
+Índice en memoria de ventas abiertas de un tenant por (moneda, monto), ordenado por fecha.
+
+Lo usan el re-match batch (app.rematch) y la cache de ventas del matching online
+(app.sale_cache). Acepta tanto objetos Sale como snapshots con los mismos atributos
+(id, currency, amount, external_ref, datetime_ts y las features de matching).
+
+Para el scoring vectorizado (app.vector_score) guarda, de forma lazy, los SaleArrays
+de cada bucket: la ventana de fechas es un rango contiguo del bucket, así que sólo
+se arman una vez por índice.
+"""
+import math
+from bisect import bisect_left, bisect_right
+from sqlalchemy.orm import Session
+
+from .models import Sale
+from .vector_score import SaleArrays
+
+def _cents(amount) -> int:
+    return int(round(float(amount) * 100))
+
+class SaleIndex:
+    """Ventas de un tenant indexadas por (currency, monto en centavos), ordenadas por fecha."""
+
+    def __init__(self, sales: list[Sale]):
+        # (currency, cents) -> lista de (sale_dt, sale) ordenada por fecha (solo fechas válidas)
+        self._dated: dict[tuple[str, int], list[tuple]] = {}
+        # external_ref -> venta (regla de strong ID; único por tenant)
+        self._by_ref: dict[str, Sale] = {}
+        # Ventas reclamadas durante el re-match (se excluyen como candidatas)
+        self.claimed: set[int] = set()
+        self.size = 0
+
+        for s in sales:
+            if s.amount is None:
+                continue
+            key = (s.currency, _cents(s.amount))
+            if s.external_ref and (s.external_ref not in self._by_ref or s.id < self._by_ref[s.external_ref].id):
+                self._by_ref[s.external_ref] = s
+            if s.datetime_ts:
+                self._dated.setdefault(key, []).append((s.datetime_ts, s))
+            self.size += 1
+
+        self._dates: dict[tuple[str, int], list] = {}
+        for key, bucket in self._dated.items():
+            bucket.sort(key=lambda x: (x[0], x[1].id))
+            self._dates[key] = [dt for dt, _ in bucket]
+        # sale_id -> (bucket, posición) para marcar reclamadas en los arrays
+        self._position = {s.id: (key, i) for key, bucket in self._dated.items() for i, (_, s) in enumerate(bucket)}
+
+        # (currency, cents) -> SaleArrays del bucket y máscara de ventas reclamadas
+        self._arrays: dict[tuple[str, int], SaleArrays] = {}
+        self._claimed_mask: dict[tuple[str, int], object] = {}
+
+    @classmethod
+    def load(cls, db: Session, tenant_id: int) -> "SaleIndex":
+        """Carga las ventas abiertas del tenant (mismo universo que match_sale)."""
+        return cls(db.query(Sale).filter(Sale.tenant_id == tenant_id, Sale.status == "open").all())
+
+    def claim(self, sale_id: int) -> None:
+        self.claimed.add(sale_id)
+        key, i = self._position.get(sale_id, (None, None))
+        if key in self._claimed_mask:
+            self._claimed_mask[key][i] = True
+
+    def _keys(self, currency: str, amount: float, amount_tol: float):
+        lo = math.floor((amount - amount_tol) * 100)
+        hi = math.ceil((amount + amount_tol) * 100)
+        return [(currency, c) for c in range(lo, hi + 1)]
+
+    def _amount_ok(self, s: Sale, amount: float, amount_tol: float) -> bool:
+        # Mismo filtro que la query de match_sale
+        return s.id not in self.claimed and amount - amount_tol <= float(s.amount) <= amount + amount_tol
+
+    def by_ref(self, external_ref: str) -> Sale | None:
+        s = self._by_ref.get(external_ref)
+        return s if s is not None and s.id not in self.claimed else None
+
+    def in_window(self, currency: str, amount: float, amount_tol: float, start, end) -> list[tuple]:
+        out = []
+        for key in self._keys(currency, amount, amount_tol):
+            bucket = self._dated.get(key)
+            if not bucket:
+                continue
+            dates = self._dates[key]
+            lo = bisect_left(dates, start)
+            hi = bisect_right(dates, end)
+            out.extend(
+                (s, s_dt) for s_dt, s in bucket[lo:hi] if self._amount_ok(s, amount, amount_tol)
+            )
+        return out
+
+    def _bucket_arrays(self, key) -> SaleArrays:
+        arrays = self._arrays.get(key)
+        if arrays is None:
+            import numpy as np
+
+            arrays = SaleArrays([(s, s_dt) for s_dt, s in self._dated[key]])
+            self._claimed_mask[key] = np.isin(arrays.ids, list(self.claimed)) if self.claimed else np.zeros(len(arrays), dtype=bool)
+            self._arrays[key] = arrays
+        return arrays
+
+    def window_arrays(self, currency: str, amount: float, amount_tol: float, start, end, min_rows: int) -> list | None:
+        """
+        Igual que in_window pero como [(SaleArrays, filas)] para app.vector_score.
+        Devuelve None si la ventana tiene menos de min_rows ventas (conviene el loop escalar).
+        """
+        import numpy as np
+
+        spans = []
+        for key in self._keys(currency, amount, amount_tol):
+            if key not in self._dated:
+                continue
+            dates = self._dates[key]
+            lo, hi = bisect_left(dates, start), bisect_right(dates, end)
+            if hi > lo:
+                spans.append((key, lo, hi))
+        if sum(hi - lo for _, lo, hi in spans) < min_rows:
+            return None
+
+        parts = []
+        for key, lo, hi in spans:
+            arrays = self._bucket_arrays(key)
+            amounts = arrays.amounts[lo:hi]
+            # Mismo filtro que _amount_ok
+            keep = (amount - amount_tol <= amounts) & (amounts <= amount + amount_tol) & ~self._claimed_mask[key][lo:hi]
+            parts.append((arrays, np.flatnonzero(keep) + lo))
+        return parts
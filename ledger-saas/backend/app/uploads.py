@@ -0,0 +1,121 @@
+"""
+Guardado de archivos subidos / descargados sin tenerlos enteros en memoria.
+
+Los uploads (/v1/receipts, /v1/sales/ingest) y la media de WhatsApp (Twilio / Meta) se
+escriben por chunks (UPLOAD_CHUNK_BYTES) a un archivo temporal en el mismo directorio
+del destino, calculando el SHA-256 mientras se escribe (clave de app.parse_cache), y al
+terminar se renombran atómicamente (os.replace): nunca queda un archivo a medio escribir
+con el nombre final. Pasado UPLOAD_MAX_BYTES se corta la lectura, se borra el temporal
+y se responde 413 (UploadTooLarge).
+
+La extracción trabaja después sobre el path (app.executor), no sobre una copia en memoria.
+"""
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterable, Iterable
+
+from fastapi import HTTPException, UploadFile
+
+from . import metrics
+
+# Configuración desde .env
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+
+class UploadTooLarge(HTTPException):
+    """Archivo de más de UPLOAD_MAX_BYTES (413)."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+
+@dataclass(frozen=True)
+class StoredFile:
+    path: str
+    sha256: str
+    size: int
+
+class _AtomicWriter:
+    """Temporal junto al destino + SHA-256 incremental + límite de tamaño."""
+
+    def __init__(self, dest_path: str, max_bytes: int | None = None, declared_size: int | None = None):
+        self.dest_path = dest_path
+        self.max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+        # Tamaño anunciado (Content-Length / UploadFile.size): se rechaza sin leer nada
+        if self.max_bytes and declared_size and declared_size > self.max_bytes:
+            metrics.inc("uploads.too_large")
+            raise UploadTooLarge(self.max_bytes)
+        self.hash = hashlib.sha256()
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path) or ".", prefix=".upload-", suffix=".part")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            metrics.inc("uploads.too_large")
+            raise UploadTooLarge(self.max_bytes)
+        self.hash.update(chunk)
+        self.file.write(chunk)
+
+    def commit(self) -> StoredFile:
+        self.file.close()
+        try:
+            os.replace(self.tmp_path, self.dest_path)
+        except OSError:
+            self.abort()
+            raise
+        metrics.observe("uploads.bytes", self.size)
+        return StoredFile(self.dest_path, self.hash.hexdigest(), self.size)
+
+    def abort(self) -> None:
+        self.file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+async def save_upload(file: UploadFile, dest_path: str, max_bytes: int | None = None) -> StoredFile:
+    """Guarda un UploadFile en dest_path por chunks. UploadTooLarge si se pasa del límite."""
+    writer = _AtomicWriter(dest_path, max_bytes, file.size)
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+async def save_stream(
+    chunks: AsyncIterable[bytes],
+    dest_path: str,
+    max_bytes: int | None = None,
+    declared_size: int | None = None,
+) -> StoredFile:
+    """save_upload() para iteradores async (body de una respuesta httpx)."""
+    writer = _AtomicWriter(dest_path, max_bytes, declared_size)
+    try:
+        async for chunk in chunks:
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+def save_chunks(
+    chunks: Iterable[bytes],
+    dest_path: str,
+    max_bytes: int | None = None,
+    declared_size: int | None = None,
+) -> StoredFile:
+    """save_upload() para iteradores síncronos (ej. miembros de un ZIP)."""
+    writer = _AtomicWriter(dest_path, max_bytes, declared_size)
+    try:
+        for chunk in chunks:
+            if chunk:
+                writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
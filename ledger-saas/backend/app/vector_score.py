@@ -0,0 +1,226 @@
+"""
+Scoring vectorizado (NumPy) de candidatos de match_sale.
+
+Con muchas ventas del mismo monto (ej. una suscripción de precio fijo) cada
+transacción trae cientos de candidatos y el loop de _rank_candidates domina el
+tiempo del request. Acá las ventas se pasan a arrays (SaleArrays: timestamps en
+microsegundos, ids de vocabulario para CUIT / sufijo / teléfono / referencia y
+tokens de nombre en formato CSR) y los componentes de fecha, CUIT, referencia,
+teléfono y nombre se calculan juntos.
+
+Produce exactamente la misma lista que _rank_candidates (mismos scores, reasons,
+evidence_rank, time_delta y orden). Se usa sólo con los SaleArrays que SaleIndex
+(re-match y cache de ventas) guarda por bucket, desde VECTOR_SCORE_MIN_CANDIDATES
+candidatos en la ventana: armarlos por llamada desde filas del ORM (camino de la BD de
+match_sale) no le gana al loop escalar (benchmarks.run, db_vector_speedup).
+NumPy se importa de forma lazy.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+
+_EPOCH = datetime(1970, 1, 1)
+_DATE_POINTS = (0, 25, 15, 5)
+
+# Código de reasons por fila: bits de fecha (2), CUIT (2), referencia, teléfono y nombre
+_DATE_REASONS = {0: None, 1: "Mismo día", 2: "Diferencia de 1 día", 3: "Diferencia de 2 días"}
+_CUIT_REASONS = {0: None, 1: "CUIT cliente coincide", 2: "Últimos dígitos del CUIT coinciden"}
+_REASONS: dict[int, tuple] = {}
+for _date in range(4):
+    for _cuit in range(3):
+        for _ref in range(2):
+            for _phone in range(2):
+                for _name in range(2):
+                    _REASONS[_date | _cuit << 2 | _ref << 4 | _phone << 5 | _name << 6] = tuple(r for r in (
+                        _DATE_REASONS[_date],
+                        _CUIT_REASONS[_cuit],
+                        "Referencia en concepto" if _ref else None,
+                        "Teléfono cliente coincide" if _phone else None,
+                        "Nombre coincide parcialmente" if _name else None,
+                    ) if r)
+
+def _micros(dt: datetime) -> int:
+    d = dt - _EPOCH
+    return (d.days * 86400 + d.seconds) * 10**6 + d.microseconds
+
+def _vocab_id(vocab: dict, value) -> int:
+    if not value:
+        return -1
+    i = vocab.get(value)
+    if i is None:
+        i = vocab[value] = len(vocab)
+    return i
+
+def _substring_hits(text: str | None, vocab: dict, lengths: set[int]) -> list[int]:
+    """Ids del vocabulario que son substring de text (costo según len(text), no según ventas)."""
+    if not text or not vocab:
+        return []
+    hits = set()
+    for n in lengths:
+        for i in range(len(text) - n + 1):
+            j = vocab.get(text[i:i + n])
+            if j is not None:
+                hits.add(j)
+    return list(hits)
+
+@dataclass
+class TxFeatures:
+    """Features de la transacción, calculadas una vez en _rank_candidates."""
+    amount: float
+    dt: datetime
+    payer_cuit: str | None
+    suffix: str | None
+    concept_lower: str | None
+    phone_concept: str
+    phone_payer: str
+    tokens: set
+
+class SaleArrays:
+    """Ventas (con fecha) en formato columnar para scoring vectorizado."""
+
+    def __init__(self, pairs: list[tuple]):
+        import numpy as np
+
+        n = len(pairs)
+        self.sales = [s for s, _ in pairs]
+        self.cuit_vocab, self.suffix_vocab, self.ref_vocab, self.phone_vocab, self.token_vocab = {}, {}, {}, {}, {}
+        self.ids = np.empty(n, dtype=np.int64)
+        self.micros = np.empty(n, dtype=np.int64)
+        self.days = np.empty(n, dtype=np.int64)
+        self.amounts = np.empty(n, dtype=np.float64)
+        self.cuit_ids = np.empty(n, dtype=np.int64)
+        self.suffix4_ids = np.empty(n, dtype=np.int64)
+        self.suffix5_ids = np.empty(n, dtype=np.int64)
+        self.ref_ids = np.empty(n, dtype=np.int64)
+        self.phone_ids = np.empty(n, dtype=np.int64)
+        token_ids, token_rows = [], []
+
+        for i, (s, s_dt) in enumerate(pairs):
+            self.ids[i] = s.id
+            self.micros[i] = _micros(s_dt)
+            self.days[i] = s_dt.toordinal()
+            self.amounts[i] = float(s.amount)
+            cuit = s.customer_cuit
+            self.cuit_ids[i] = _vocab_id(self.cuit_vocab, cuit)
+            # Sufijos de 4 y 5 caracteres: equivalen a customer_cuit.endswith(tx_suffix)
+            self.suffix4_ids[i] = _vocab_id(self.suffix_vocab, cuit[-4:] if cuit and len(cuit) >= 4 else None)
+            self.suffix5_ids[i] = _vocab_id(self.suffix_vocab, cuit[-5:] if cuit and len(cuit) >= 5 else None)
+            self.ref_ids[i] = _vocab_id(self.ref_vocab, s.external_ref_lower)
+            self.phone_ids[i] = _vocab_id(self.phone_vocab, s.customer_phone_digits)
+            if s.customer_name_tokens:
+                for t in set(s.customer_name_tokens.split()):
+                    token_ids.append(_vocab_id(self.token_vocab, t))
+                    token_rows.append(i)
+
+        self.token_ids = np.array(token_ids, dtype=np.int64)
+        # CSR: los tokens de la fila i son token_ids[token_indptr[i]:token_indptr[i + 1]]
+        self.token_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.array(token_rows, dtype=np.int64), minlength=n), out=self.token_indptr[1:])
+        self.ref_lengths = {len(v) for v in self.ref_vocab}
+        self.phone_lengths = {len(v) for v in self.phone_vocab}
+
+    def __len__(self) -> int:
+        return len(self.sales)
+
+    def _shared_tokens(self, rows, tx_token_ids: list[int]):
+        """Tokens de nombre compartidos con la transacción, por fila de `rows` (sólo recorre esas filas)."""
+        import numpy as np
+
+        m = len(rows)
+        starts = self.token_indptr[rows]
+        counts = self.token_indptr[rows + 1] - starts
+        total = int(counts.sum())
+        if not tx_token_ids or not total:
+            return np.zeros(m, dtype=np.int64)
+        offsets = np.cumsum(counts) - counts
+        positions = np.repeat(starts - offsets, counts) + np.arange(total)
+        owner = np.repeat(np.arange(m), counts)
+        return np.bincount(owner[np.isin(self.token_ids[positions], tx_token_ids)], minlength=m)
+
+    def score(self, tx: TxFeatures, rows):
+        """
+        (score, evidence_rank, time_delta_us, reasons_code) para las filas `rows`.
+        Cada array del bucket se recorta a `rows` antes de calcular: el costo es el de la
+        ventana de fechas, no el del bucket entero.
+        """
+        import numpy as np
+
+        rows = np.asarray(rows, dtype=np.int64)
+        m = len(rows)
+        score = np.full(m, 60, dtype=np.int64)
+
+        # Fecha (días calendario)
+        delta_days = np.abs(self.days[rows] - tx.dt.toordinal())
+        date_code = np.select([delta_days == 0, delta_days == 1, delta_days == 2], [1, 2, 3], 0)
+        score += np.array(_DATE_POINTS)[date_code]
+
+        # CUIT exacto o sufijo visible (evidencia fuerte)
+        cuit_exact = self.cuit_ids[rows] == self.cuit_vocab.get(tx.payer_cuit, -2) if tx.payer_cuit else np.zeros(m, dtype=bool)
+        suffix_ids = self.suffix4_ids if tx.suffix and len(tx.suffix) == 4 else self.suffix5_ids
+        suffix_id = self.suffix_vocab.get(tx.suffix, -2) if tx.suffix else -2
+        cuit_suffix = ~cuit_exact & (suffix_ids[rows] == suffix_id)
+        score += np.where(cuit_exact, 20, np.where(cuit_suffix, 10, 0))
+        evidence = np.where(cuit_exact, 100, np.where(cuit_suffix, 50, 0))
+
+        # Referencia externa dentro del concepto
+        ref_match = np.isin(self.ref_ids[rows], _substring_hits(tx.concept_lower, self.ref_vocab, self.ref_lengths))
+        score += np.where(ref_match, 15, 0)
+        evidence = np.maximum(evidence, np.where(ref_match, 90, 0))
+
+        # Teléfono: dentro del concepto o igual al del pagador
+        phone_hits = _substring_hits(tx.phone_concept, self.phone_vocab, self.phone_lengths)
+        if tx.phone_payer and tx.phone_payer in self.phone_vocab:
+            phone_hits.append(self.phone_vocab[tx.phone_payer])
+        phone_match = np.isin(self.phone_ids[rows], phone_hits)
+        score += np.where(phone_match, 15, 0)
+        evidence = np.maximum(evidence, np.where(phone_match, 80, 0))
+
+        # Nombre: tokens compartidos (CSR token_ids / token_indptr)
+        inter = self._shared_tokens(rows, [self.token_vocab[t] for t in tx.tokens if t in self.token_vocab])
+        name_match = inter > 0
+        score += np.minimum(10, inter * 2)
+        evidence = np.maximum(evidence, np.where(name_match, 70, 0))
+
+        # Monto exacto (ya filtrado, pero es evidencia)
+        evidence = np.maximum(evidence, np.where(np.abs(self.amounts[rows] - tx.amount) < 0.01, 60, 0))
+
+        codes = (
+            date_code
+            | np.where(cuit_exact, 1, np.where(cuit_suffix, 2, 0)) << 2
+            | ref_match.astype(np.int64) << 4
+            | phone_match.astype(np.int64) << 5
+            | name_match.astype(np.int64) << 6
+        )
+        time_delta_us = np.abs(self.micros[rows] - _micros(tx.dt))
+        return score, evidence, time_delta_us, codes
+
+def rank_arrays(tx: TxFeatures, parts: list[tuple]) -> list:
+    """
+    Ranking (misma salida que _rank_candidates) de las filas elegidas de uno o más
+    SaleArrays: parts = [(arrays, rows), ...] con rows índices numpy de filas.
+    """
+    import numpy as np
+
+    parts = [(a, rows) for a, rows in parts if len(rows)]
+    if not parts:
+        return []
+    scored = [a.score(tx, rows) for a, rows in parts]
+    score, evidence, delta, codes = (np.concatenate(col) for col in zip(*scored))
+    ids = np.concatenate([a.ids[rows] for a, rows in parts])
+    sales = [a.sales[i] for a, rows in parts for i in rows.tolist()]
+
+    # Mismo orden que el camino escalar: score desc, evidence desc, time_delta asc, sale_id asc
+    order = np.lexsort((ids, delta, -evidence, -score))
+    score_l, evidence_l, delta_l, codes_l = score.tolist(), evidence.tolist(), delta.tolist(), codes.tolist()
+    return [
+        (sales[i], score_l[i], list(_REASONS[codes_l[i]]), evidence_l[i], delta_l[i] / 10**6)
+        for i in order.tolist()
+    ]
+
+def rank_candidates_vectorized(tx: TxFeatures, candidates: list, start: datetime, end: datetime) -> list:
+    """Ranking vectorizado de pares (sale, sale_dt) sueltos (arma los arrays en el momento)."""
+    import numpy as np
+
+    pairs = [(s, s_dt) for s, s_dt in candidates if s_dt and start <= s_dt <= end]
+    if not pairs:
+        return []
+    return rank_arrays(tx, [(SaleArrays(pairs), np.arange(len(pairs)))])
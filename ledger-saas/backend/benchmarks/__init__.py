@@ -0,0 +1 @@
+"""Benchmarks de matching (ver benchmarks/run.py)."""
@@ -0,0 +1,151 @@
+"""
+Servidor local que imita la Graph API de Meta para descargas de media (tests / benchmarks).
+
+- GET /{version}/{media_id} → {"url": "<base>/media/<media_id>", "mime_type": ...}
+- GET /media/{media_id}     → bytes del media (por chunks), con su Content-Type
+
+Cuenta lookups, descargas y conexiones TCP nuevas (para ver el keep-alive del cliente).
+expire(media_id) hace que la URL ya entregada responda 404 (como una URL vencida de Meta).
+
+Uso:
+    with serve({"m1": (pdf_bytes, "application/pdf")}) as graph:
+        monkeypatch META_GRAPH_URL = graph.url ...
+
+    python -m benchmarks.fake_graph --files 50 --size 300000 --concurrency 8
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+CHUNK = 64 * 1024
+
+@dataclass
+class FakeGraph:
+    media: dict[str, tuple[bytes, str]]
+    url: str = ""
+    lookups: int = 0
+    downloads: int = 0
+    connections: int = 0
+    expired: set[str] = field(default_factory=set)
+
+    def expire(self, media_id: str) -> None:
+        self.expired.add(media_id)
+
+    def app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/media/{media_id}")
+        def media(media_id: str):
+            if media_id not in self.media or media_id in self.expired:
+                raise HTTPException(status_code=404, detail="URL expired")
+            self.downloads += 1
+            data, content_type = self.media[media_id]
+
+            def body():
+                for i in range(0, len(data), CHUNK):
+                    yield data[i:i + CHUNK]
+
+            return StreamingResponse(body(), media_type=content_type, headers={"Content-Length": str(len(data))})
+
+        @app.get("/{version}/{media_id}")
+        def lookup(version: str, media_id: str):
+            if media_id not in self.media:
+                raise HTTPException(status_code=404, detail="Unknown media")
+            self.lookups += 1
+            # URL nueva: la anterior deja de estar vencida
+            self.expired.discard(media_id)
+            return {"url": f"{self.url}/media/{media_id}", "mime_type": self.media[media_id][1], "id": media_id}
+
+        return app
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class _Server(uvicorn.Server):
+    def install_signal_handlers(self):
+        pass
+
+@contextlib.contextmanager
+def serve(media: dict[str, tuple[bytes, str]]):
+    """Levanta el FakeGraph en un thread (puerto libre) mientras dura el with."""
+    graph = FakeGraph(media=dict(media))
+    port = _free_port()
+    graph.url = f"http://127.0.0.1:{port}"
+    server = _Server(uvicorn.Config(graph.app(), host="127.0.0.1", port=port, log_level="warning"))
+
+    # Conexiones TCP aceptadas (para medir el reuso de conexiones)
+    def on_connection(protocol_factory):
+        def factory(*args, **kwargs):
+            graph.connections += 1
+            return protocol_factory(*args, **kwargs)
+        return factory
+
+    config_load = server.config.load
+
+    def load():
+        config_load()
+        server.config.http_protocol_class = on_connection(server.config.http_protocol_class)
+
+    server.config.load = load
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError("Fake Graph server did not start")
+        time.sleep(0.01)
+    try:
+        yield graph
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de descargas de media contra un Graph API local")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--size", type=int, default=300_000, help="Bytes por archivo")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    import tempfile
+    from app import http_client
+    from app.routers import whatsapp
+
+    media = {f"m{i}": (os.urandom(args.size), "application/pdf") for i in range(args.files)}
+    with serve(media) as graph, tempfile.TemporaryDirectory() as tmp:
+        whatsapp.META_GRAPH_URL = graph.url
+        whatsapp.UPLOAD_DIR = tmp
+
+        async def run() -> float:
+            limit = asyncio.Semaphore(args.concurrency)
+
+            async def one(media_id: str):
+                async with limit:
+                    return await whatsapp.download_meta_media(media_id, media_id, token="bench", version="v20.0")
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one(m) for m in media))
+            elapsed = time.perf_counter() - started
+            await http_client.aclose()
+            assert all(results), "Some downloads failed"
+            return elapsed
+
+        elapsed = asyncio.run(run())
+        total_mb = args.files * args.size / 1e6
+        print(f"✅ {args.files} downloads ({total_mb:.1f} MB) in {elapsed * 1000:.0f} ms "
+              f"({total_mb / elapsed:.1f} MB/s), {graph.connections} TCP connections, "
+              f"{graph.lookups} URL lookups")
+
+if __name__ == "__main__":
+    main()
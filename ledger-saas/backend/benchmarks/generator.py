@@ -0,0 +1,217 @@
+"""
+Generador determinístico (con seed) de tenants sintéticos para benchmarks de matching.
+
+Arma ventas, transacciones y contrapartes con la forma de los datos reales:
+- montos repetidos (precio fijo / suscripción) según duplicate_amount_ratio
+- transacciones que corresponden a una venta (con fecha corrida y nombre con ruido),
+  algunas con operation_id == external_ref y otras sin venta asociada
+- CUITs enmascarados (sólo últimos dígitos visibles) según masked_cuit_ratio
+- ruido en nombres: acentos, mayúsculas, tokens faltantes o typos (name_noise)
+
+Inserta por el ORM, así las features de matching y el índice de contrapartes se
+calculan igual que en producción.
+"""
+import random
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+
+from app.models import Counterparty, Sale, Tenant, Transaction
+from app.normalize import normalize_name
+
+FIRST_NAMES = [
+    "María", "José", "Juan", "Ana", "Lucía", "Carlos", "Sofía", "Martín", "Florencia", "Diego",
+    "Valentina", "Pablo", "Camila", "Federico", "Paula", "Gustavo", "Julieta", "Ricardo", "Agustina", "Hernán",
+]
+LAST_NAMES = [
+    "González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez", "Romero", "Sosa",
+    "Álvarez", "Torres", "Ruiz", "Ramírez", "Flores", "Acosta", "Benítez", "Medina", "Herrera", "Suárez",
+    "Aguirre", "Pereyra", "Gutiérrez", "Giménez", "Molina", "Silva", "Castro", "Rojas", "Ortiz", "Núñez",
+]
+COMPANY_WORDS = ["Distribuidora", "Comercial", "Servicios", "Insumos", "Logística", "Textil", "Agro", "Norte", "Sur", "Plata"]
+COMPANY_SUFFIXES = ["S.A.", "S.R.L.", "SAS"]
+FIXED_PRICES = [4500.00, 9900.00, 15000.00, 23000.00]
+
+@dataclass
+class TenantSpec:
+    sales: int = 1000
+    transactions: int = 1000
+    counterparties: int = 1000
+    duplicate_amount_ratio: float = 0.3   # ventas con precio fijo (mismo monto)
+    matched_ratio: float = 0.7            # transacciones que corresponden a una venta
+    strong_id_ratio: float = 0.2          # de esas, con operation_id == external_ref
+    masked_cuit_ratio: float = 0.5        # transacciones/búsquedas con CUIT enmascarado
+    name_noise: float = 0.3               # probabilidad de ruido en cada nombre
+    days: int = 90
+    seed: int = 42
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+class TenantGenerator:
+    def __init__(self, spec: TenantSpec):
+        self.spec = spec
+        self.rnd = random.Random(spec.seed)
+        self.start = datetime(2025, 1, 1, 8, 0)
+
+    def person_name(self) -> str:
+        r = self.rnd
+        parts = [r.choice(FIRST_NAMES)]
+        if r.random() < 0.3:
+            parts.append(r.choice(FIRST_NAMES))
+        parts.append(r.choice(LAST_NAMES))
+        if r.random() < 0.4:
+            parts.append(r.choice(LAST_NAMES))
+        return " ".join(parts)
+
+    def company_name(self) -> str:
+        r = self.rnd
+        return f"{r.choice(COMPANY_WORDS)} {r.choice(LAST_NAMES)} {r.choice(COMPANY_SUFFIXES)}"
+
+    def cuit(self) -> str:
+        r = self.rnd
+        return f"{r.choice(['20', '23', '27', '30'])}{r.randint(10_000_000, 99_999_999)}{r.randint(0, 9)}"
+
+    def masked(self, cuit: str) -> str:
+        return f"{cuit[:2]}-XXXX{cuit[-5:-1]}-{cuit[-1]}"
+
+    def noisy(self, name: str) -> str:
+        """Variante con ruido de un nombre (como lo escribe el banco / el cliente)."""
+        r = self.rnd
+        if r.random() >= self.spec.name_noise:
+            return name
+        tokens = name.split()
+        kind = r.randrange(4)
+        if kind == 0:
+            return normalize_name(name).upper()                    # sin acentos, mayúsculas
+        if kind == 1 and len(tokens) > 2:
+            tokens.pop(r.randrange(1, len(tokens)))                # falta un token
+        elif kind == 2:
+            i = r.randrange(len(tokens))
+            t = tokens[i]
+            if len(t) > 3:
+                j = r.randrange(1, len(t) - 1)
+                tokens[i] = t[:j] + t[j + 1:]                      # typo (letra faltante)
+        else:
+            tokens = tokens[-1:] + tokens[:-1]                     # apellido primero
+        return " ".join(tokens)
+
+    def amount(self) -> float:
+        r = self.rnd
+        if r.random() < self.spec.duplicate_amount_ratio:
+            return r.choice(FIXED_PRICES)
+        return round(r.uniform(500, 250_000), 2)
+
+    def when(self) -> datetime:
+        return self.start + timedelta(minutes=self.rnd.randint(0, self.spec.days * 24 * 60))
+
+    def populate(self, db: Session, tenant_id: int | None = None, chunk: int = 2000) -> dict:
+        """Crea (o completa) el tenant con datos sintéticos. Devuelve ids útiles para medir."""
+        spec, r = self.spec, self.rnd
+        if tenant_id is None:
+            tenant = Tenant(name=f"Bench {spec.seed}")
+            db.add(tenant)
+            db.commit()
+            tenant_id = tenant.id
+
+        def flush(rows: list) -> None:
+            db.add_all(rows)
+            db.commit()
+            rows.clear()
+            db.expunge_all()
+
+        # Contrapartes
+        cp_names = []
+        rows = []
+        for i in range(spec.counterparties):
+            company = r.random() < 0.2
+            name = self.company_name() if company else self.person_name()
+            cuit = self.cuit() if r.random() < 0.8 else None
+            cp_names.append((name, cuit))
+            rows.append(Counterparty(
+                tenant_id=tenant_id,
+                type="company" if company else "person",
+                display_name=name,
+                normalized_name=normalize_name(name),
+                cuit=cuit,
+                cuit_prefix=cuit[:2] if cuit else None,
+                cuit_suffix=cuit[-5:] if cuit else None,
+            ))
+            if len(rows) >= chunk:
+                flush(rows)
+        flush(rows)
+
+        # Ventas
+        sales = []
+        for i in range(spec.sales):
+            name, cuit = r.choice(cp_names) if cp_names and r.random() < 0.6 else (self.person_name(), self.cuit())
+            sale = {
+                "datetime": self.when(),
+                "amount": self.amount(),
+                "customer_name": name,
+                "customer_cuit": cuit if r.random() < 0.5 else None,
+                "customer_phone": f"+54911{r.randint(10_000_000, 99_999_999)}" if r.random() < 0.4 else None,
+                "external_ref": f"V{spec.seed}-{i:07d}",
+            }
+            sales.append(sale)
+            rows.append(Sale(
+                tenant_id=tenant_id,
+                datetime=sale["datetime"].isoformat(timespec="seconds"),
+                amount=sale["amount"],
+                currency="ARS",
+                customer_name=sale["customer_name"],
+                customer_cuit=sale["customer_cuit"],
+                customer_phone=sale["customer_phone"],
+                external_ref=sale["external_ref"],
+            ))
+            if len(rows) >= chunk:
+                flush(rows)
+        flush(rows)
+
+        # Transacciones
+        for i in range(spec.transactions):
+            if sales and r.random() < spec.matched_ratio:
+                sale = r.choice(sales)
+                dt = sale["datetime"] + timedelta(minutes=r.randint(-600, 2880))
+                amount = sale["amount"]
+                name = self.noisy(sale["customer_name"])
+                cuit = sale["customer_cuit"] or self.cuit()
+                op_id = sale["external_ref"] if r.random() < spec.strong_id_ratio else f"OP{r.randint(10**9, 10**10)}"
+            else:
+                dt, amount, name, cuit = self.when(), self.amount(), self.person_name(), self.cuit()
+                op_id = f"OP{r.randint(10**9, 10**10)}"
+            masked = r.random() < spec.masked_cuit_ratio
+            rows.append(Transaction(
+                tenant_id=tenant_id,
+                source_file=f"bench-{i}.pdf",
+                source_system="mercadopago",
+                doc_type="transfer",
+                datetime=dt.isoformat(timespec="seconds"),
+                amount=amount,
+                currency="ARS",
+                direction="credit",
+                operation_id=op_id,
+                payer_name=name,
+                payer_cuit=None if masked else cuit,
+                payer_cuit_masked=self.masked(cuit) if masked else None,
+                concept="Varios",
+            ))
+            if len(rows) >= chunk:
+                flush(rows)
+        flush(rows)
+
+        return {"tenant_id": tenant_id, "counterparty_names": cp_names}
+
+    def counterparty_queries(self, cp_names: list, n: int) -> list[tuple]:
+        """Búsquedas (name, cuit, cuit_masked) con ruido, como las arma _resolve_and_match."""
+        r = self.rnd
+        out = []
+        for _ in range(n):
+            if cp_names and r.random() < 0.8:
+                name, cuit = r.choice(cp_names)
+                name = self.noisy(name)
+            else:
+                name, cuit = self.person_name(), None
+            masked = self.masked(cuit) if cuit and r.random() < self.spec.masked_cuit_ratio else None
+            out.append((name, None, masked))
+        return out
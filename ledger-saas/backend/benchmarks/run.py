@@ -0,0 +1,355 @@
+"""
+Benchmarks de matching (match_sale, re-match batch y match_counterparty).
+
+Para cada tamaño genera un tenant sintético (benchmarks.generator) en una BD nueva y mide:
+- single: match_sale de transacciones sueltas (p50/p95/max en ms)
+- batch: rematch_tenant del backlog completo (ms y tx/seg)
+- counterparty: match_counterparty con nombres con ruido (p50/p95/max en ms)
+- vector: scoring de un bucket grande de ventas del mismo monto (SaleIndex en memoria),
+  vectorizado vs escalar sobre la misma ventana (vector_speedup = escalar / vectorizado)
+- db_vector: lo mismo por el camino de la BD de match_sale (query de la ventana + scoring),
+  donde los SaleArrays se arman en cada llamada (db_vector_speedup). Informativo: con
+  estos números match_sale no vectoriza el camino de la BD (ver _rank_candidates)
+
+Corre contra SQLite y, si BENCH_POSTGRES_URL está definida y responde, también contra
+Postgres (la BD indicada se vacía en cada corrida: usar una BD dedicada).
+
+Uso:
+    python -m benchmarks.run --sizes 1k,10k --out bench.json
+    python -m benchmarks.run --sizes 1k --check benchmarks/thresholds.json
+
+--check compara contra umbrales {"<backend>/<size>/<metric>": máximo} y sale con código 1
+si alguno se supera (para CI). --baseline compara contra otro JSON de resultados con
+tolerancia relativa (--tolerance).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from datetime import timedelta
+from app import match
+from app.db import Base
+from app.match import _rank_candidates, _rank_index_window, _tx_features, match_counterparty, match_sale
+from app.migrations import run_migrations
+from app.models import Sale, Tenant, Transaction
+from app.rematch import rematch_tenant
+from app.sale_cache import SaleSnapshot
+from app.sale_index import SaleIndex
+from app.vector_score import rank_candidates_vectorized
+from .generator import TenantGenerator, TenantSpec
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+# Las métricas "menor es mejor" se comparan con umbrales máximos; tx_per_sec con mínimos
+HIGHER_IS_BETTER = ("batch_tx_per_sec", "vector_speedup")
+
+def _percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+def _timings(values_ms: list[float], prefix: str) -> dict:
+    return {
+        f"{prefix}_p50_ms": round(statistics.median(values_ms), 3) if values_ms else 0.0,
+        f"{prefix}_p95_ms": round(_percentile(values_ms, 95), 3),
+        f"{prefix}_max_ms": round(max(values_ms, default=0.0), 3),
+    }
+
+def _engines(sqlite_dir: str):
+    yield "sqlite", f"sqlite:///{os.path.join(sqlite_dir, 'bench.db')}"
+    pg_url = os.getenv("BENCH_POSTGRES_URL")
+    if pg_url:
+        yield "postgres", pg_url
+
+def bench_vector_scoring(rows: int, samples: int = 50, seed: int = 42) -> dict:
+    """
+    Bucket de `rows` ventas del mismo monto (ej. suscripción de precio fijo) repartidas en
+    el tiempo, con ventanas de fechas de ~1% del bucket (mínimo VECTOR_SCORE_MIN_CANDIDATES).
+    Mide _rank_index_window vectorizado y escalar sobre las mismas transacciones.
+    """
+    rnd = random.Random(seed)
+    window = max(match.VECTOR_SCORE_MIN_CANDIDATES, rows // 100)
+    window_days = 2 * match.DATE_WINDOW_HOURS / 24
+    span = timedelta(days=window_days * rows / window)
+    base = datetime(2024, 1, 1)
+    names = ["juan perez", "maria gomez", "carlos diaz", "ana lopez", "pedro ruiz", "lucia fernandez"]
+    sales = []
+    for i in range(1, rows + 1):
+        cuit = f"20{rnd.randrange(10**8, 10**9)}"
+        sales.append(SaleSnapshot(
+            id=i, currency="ARS", amount=1500.0, datetime_ts=base + span * rnd.random(),
+            external_ref=f"REF{i}", external_ref_lower=f"ref{i}", customer_cuit=cuit,
+            customer_phone_digits=f"11{rnd.randrange(10**7, 10**8)}",
+            customer_name_tokens=f"{rnd.choice(names)} {rnd.choice(names).split()[1]}",
+        ))
+    index = SaleIndex(sales)
+    txs = [
+        Transaction(
+            tenant_id=1, currency="ARS", amount=1500.0,
+            datetime_ts=base + span * (0.1 + 0.8 * rnd.random()),
+            payer_name=rnd.choice(names).title(), payer_cuit_masked=f"20-XXXX{rnd.randrange(1000, 9999)}-1",
+            concept=f"pago ref{rnd.randrange(1, rows)}",
+        )
+        for _ in range(samples)
+    ]
+
+    def timed(min_candidates: int) -> tuple[list[float], list]:
+        previous = match.VECTOR_SCORE_MIN_CANDIDATES
+        match.VECTOR_SCORE_MIN_CANDIDATES = min_candidates
+        try:
+            out, times = [], []
+            for tx in txs:
+                start, end = match._date_window(tx.datetime_ts)
+                t0 = time.perf_counter()
+                ranked = _rank_index_window(index, tx, tx.datetime_ts, 0.01, start, end)
+                times.append((time.perf_counter() - t0) * 1000)
+                out.append([(s.id, score) for s, score, *_ in ranked])
+            return times, out
+        finally:
+            match.VECTOR_SCORE_MIN_CANDIDATES = previous
+
+    timed(window)  # arma los SaleArrays del bucket (una vez por índice, como en el re-match)
+    vector_ms, vector_out = timed(window)
+    scalar_ms, scalar_out = timed(0)
+    if vector_out != scalar_out:
+        raise AssertionError("Vectorized ranking differs from the scalar path")
+    vector_p50, scalar_p50 = statistics.median(vector_ms), statistics.median(scalar_ms)
+    return {
+        "vector_window_rows": window,
+        "vector_score_p50_ms": round(vector_p50, 3),
+        "scalar_score_p50_ms": round(scalar_p50, 3),
+        "vector_speedup": round(scalar_p50 / vector_p50, 2) if vector_p50 else 0.0,
+    }
+
+def bench_db_vector_scoring(db, window: int, samples: int = 50, seed: int = 42) -> dict:
+    """
+    Tenant nuevo con `window` ventas abiertas del mismo monto dentro de la ventana de fechas.
+    Mide la query de candidatos de match_sale + scoring escalar vs vectorizado armando los
+    SaleArrays desde las filas del ORM (lo que costaría vectorizar el camino de la BD).
+    """
+    rnd = random.Random(seed)
+    tenant = Tenant(name=f"Bench vector {seed}")
+    db.add(tenant)
+    db.commit()
+    base = datetime(2024, 6, 1, 12, 0)
+    hours = match.DATE_WINDOW_HOURS
+    names = ["Juan Pérez", "María Gómez", "Carlos Díaz", "Ana López", "Pedro Ruiz"]
+    db.add_all([
+        Sale(
+            tenant_id=tenant.id, currency="ARS", amount=1500.0,
+            datetime=(base + timedelta(hours=hours * (2 * rnd.random() - 1) * 0.9)).isoformat(),
+            customer_name=rnd.choice(names), customer_cuit=f"20{rnd.randrange(10**8, 10**9)}",
+            customer_phone=f"11{rnd.randrange(10**7, 10**8)}", external_ref=f"REF{i}", status="open",
+        )
+        for i in range(window)
+    ])
+    db.commit()
+    txs = [
+        Transaction(
+            tenant_id=tenant.id, currency="ARS", amount=1500.0,
+            datetime_ts=base + timedelta(minutes=rnd.randint(-60, 60)),
+            payer_name=rnd.choice(names), payer_cuit_masked=f"20-XXXX{rnd.randrange(1000, 9999)}-1",
+            concept=f"pago ref{rnd.randrange(window)}",
+        )
+        for _ in range(samples)
+    ]
+
+    def timed(vectorized: bool) -> tuple[list[float], list]:
+        out, times = [], []
+        for tx in txs:
+            start, end = match._date_window(tx.datetime_ts)
+            t0 = time.perf_counter()
+            candidates = db.query(Sale).filter(
+                Sale.tenant_id == tx.tenant_id, Sale.status == "open", Sale.currency == tx.currency,
+                Sale.amount >= 1499.99, Sale.amount <= 1500.01, Sale.datetime_ts.between(start, end),
+            ).all()
+            pairs = [(s, s.datetime_ts) for s in candidates]
+            if vectorized:
+                ranked = rank_candidates_vectorized(_tx_features(tx, tx.datetime_ts), pairs, start, end)
+            else:
+                ranked = _rank_candidates(tx, tx.datetime_ts, pairs, start, end)
+            times.append((time.perf_counter() - t0) * 1000)
+            out.append([(s.id, score) for s, score, *_ in ranked])
+        return times, out
+
+    timed(False)  # calienta la cache de páginas / el identity map
+    vector_ms, vector_out = timed(True)
+    scalar_ms, scalar_out = timed(False)
+    db.rollback()
+    if vector_out != scalar_out:
+        raise AssertionError("Vectorized DB ranking differs from the scalar path")
+    vector_p50, scalar_p50 = statistics.median(vector_ms), statistics.median(scalar_ms)
+    return {
+        "db_window_rows": window,
+        "db_vector_score_p50_ms": round(vector_p50, 3),
+        "db_scalar_score_p50_ms": round(scalar_p50, 3),
+        "db_vector_speedup": round(scalar_p50 / vector_p50, 2) if vector_p50 else 0.0,
+    }
+
+def bench_size(url: str, rows: int, samples: int = 200, seed: int = 42) -> dict:
+    """Genera un tenant de `rows` ventas/transacciones/contrapartes en `url` y lo mide."""
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    spec = TenantSpec(sales=rows, transactions=rows, counterparties=rows, seed=seed)
+    gen = TenantGenerator(spec)
+    db = Session()
+    try:
+        started = time.perf_counter()
+        info = gen.populate(db)
+        generate_ms = (time.perf_counter() - started) * 1000
+        tenant_id = info["tenant_id"]
+
+        # single: match_sale por transacción (sin aplicar el resultado)
+        txs = (
+            db.query(Transaction)
+            .filter(Transaction.tenant_id == tenant_id)
+            .order_by(Transaction.id)
+            .limit(samples)
+            .all()
+        )
+        single = []
+        for tx in txs:
+            t0 = time.perf_counter()
+            match_sale(db, tx)
+            single.append((time.perf_counter() - t0) * 1000)
+        db.rollback()
+
+        # counterparty: resolución por nombre / CUIT enmascarado
+        cp = []
+        for name, cuit, masked in gen.counterparty_queries(info["counterparty_names"], samples):
+            t0 = time.perf_counter()
+            match_counterparty(db, tenant_id, name, cuit, masked)
+            cp.append((time.perf_counter() - t0) * 1000)
+        db.rollback()
+
+        # batch: backlog completo
+        stats = rematch_tenant(db, tenant_id)
+
+        # db_vector: mismo tamaño de ventana que bench_vector_scoring
+        db_vector = bench_db_vector_scoring(db, max(match.VECTOR_SCORE_MIN_CANDIDATES, rows // 100), seed=seed)
+    finally:
+        db.close()
+        engine.dispose()
+
+    return {
+        "generate_ms": round(generate_ms, 1),
+        **_timings(single, "single"),
+        **_timings(cp, "counterparty"),
+        "batch_ms": stats["elapsed_ms"],
+        "batch_tx_per_sec": stats["tx_per_sec"],
+        "batch_matched": stats["matched"],
+        "batch_ambiguous": stats["ambiguous"],
+        **bench_vector_scoring(rows, seed=seed),
+        **db_vector,
+    }
+
+def run_suite(sizes: list[str], samples: int = 200, seed: int = 42, backends: list[str] | None = None) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend, url in _engines(tmp):
+            if backends and backend not in backends:
+                continue
+            for size in sizes:
+                try:
+                    metrics = bench_size(url, SIZES[size], samples=samples, seed=seed)
+                except Exception as e:
+                    # Postgres opcional: si no hay driver o no responde se informa y se sigue
+                    if backend == "sqlite":
+                        raise
+                    print(f"⚠️  {backend} skipped: {str(e)}", file=sys.stderr)
+                    break
+                for metric, value in metrics.items():
+                    results[f"{backend}/{size}/{metric}"] = value
+                print(f"✅ {backend} {size}: {json.dumps(metrics)}", file=sys.stderr)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "samples": samples,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+def check_thresholds(results: dict, thresholds: dict) -> list[str]:
+    """Umbrales absolutos: máximo para tiempos, mínimo para *_tx_per_sec."""
+    failures = []
+    for key, limit in thresholds.items():
+        value = results.get(key)
+        if value is None:
+            continue
+        if key.endswith(HIGHER_IS_BETTER):
+            if value < limit:
+                failures.append(f"{key}: {value} < {limit}")
+        elif value > limit:
+            failures.append(f"{key}: {value} > {limit}")
+    return failures
+
+def compare_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regresiones relativas contra una corrida anterior (sólo métricas de tiempo/throughput)."""
+    failures = []
+    for key, old in baseline.items():
+        new = results.get(key)
+        if new is None or not old or not key.endswith(("_ms", "_tx_per_sec")) or "generate" in key:
+            continue
+        if key.endswith(HIGHER_IS_BETTER):
+            if new < old * (1 - tolerance):
+                failures.append(f"{key}: {new} vs baseline {old}")
+        elif new > old * (1 + tolerance):
+            failures.append(f"{key}: {new} vs baseline {old}")
+    return failures
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de matching sobre tenants sintéticos")
+    parser.add_argument("--sizes", default="1k,10k", help=f"Tamaños separados por coma ({', '.join(SIZES)})")
+    parser.add_argument("--samples", type=int, default=200, help="Transacciones/búsquedas medidas una por una")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", action="append", choices=["sqlite", "postgres"], help="Limitar a un backend")
+    parser.add_argument("--out", help="Archivo JSON de resultados")
+    parser.add_argument("--check", help="JSON de umbrales {\"backend/size/metric\": límite}")
+    parser.add_argument("--baseline", help="JSON de resultados anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Regresión relativa tolerada vs baseline")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes {unknown}; use {list(SIZES)}")
+
+    report = run_suite(sizes, samples=args.samples, seed=args.seed, backends=args.backend)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    failures = []
+    if args.check:
+        with open(args.check, encoding="utf-8") as f:
+            failures += check_thresholds(report["results"], json.load(f))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures += compare_baseline(report["results"], json.load(f)["results"], args.tolerance)
+    for failure in failures:
+        print(f"❌ Regression {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@
 import os
 from app.db import SessionLocal
 from app.models import Tenant, Channel
+from app import routing_cache
 
 db = SessionLocal()
 phone_id = os.environ.get('META_WA_PHONE_NUMBER_ID')
@@ -42,6 +43,8 @@ if not existing_channel:
 else:
     print(f"✅ Channel already exists id={existing_channel.id}")
 
+# Invalidar el ruteo cacheado de los workers del backend
+routing_cache.touch(db)
 db.commit()
 print(f"✅ Mapped phone_number_id {phone_id} -> tenant {tenant.id} ({tenant.name})")
 db.close()
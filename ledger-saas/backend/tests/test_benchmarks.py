@@ -0,0 +1,29 @@
+"""
+Smoke test del paquete de benchmarks (generador + runner) con un tenant chico.
+"""
+
+from benchmarks.generator import TenantGenerator, TenantSpec
+from benchmarks.run import bench_size, check_thresholds, compare_baseline
+
+
+def test_generator_is_deterministic():
+    """Test: mismo seed → mismos nombres con ruido y mismas búsquedas"""
+    a, b = TenantGenerator(TenantSpec(seed=7)), TenantGenerator(TenantSpec(seed=7))
+    names = [(a.person_name(), None) for _ in range(20)]
+    assert names == [(b.person_name(), None) for _ in range(20)]
+    assert a.counterparty_queries(names, 10) == b.counterparty_queries(names, 10)
+
+
+def test_bench_size_and_thresholds(tmp_path):
+    """Test: una corrida chica produce todas las métricas y los umbrales se evalúan"""
+    metrics = bench_size(f"sqlite:///{tmp_path / 'bench.db'}", rows=60, samples=10)
+    for key in ("single_p95_ms", "counterparty_p95_ms", "batch_tx_per_sec", "batch_matched", "vector_speedup"):
+        assert key in metrics
+    assert metrics["batch_matched"] > 0
+
+    results = {f"sqlite/1k/{k}": v for k, v in metrics.items()}
+    assert check_thresholds(results, {"sqlite/1k/single_p95_ms": 10**6}) == []
+    assert check_thresholds(results, {"sqlite/1k/single_p95_ms": -1}) != []
+    assert check_thresholds(results, {"sqlite/1k/batch_tx_per_sec": 10**9}) != []
+    assert check_thresholds(results, {"sqlite/1k/vector_speedup": 10**9}) != []
+    assert compare_baseline(results, results, 0.1) == []
@@ -0,0 +1,112 @@
+"""
+Tests del registro de formatos de comprobante (app.doc_formats).
+"""
+
+import json
+import random
+import re
+import pytest
+from pathlib import Path
+from app import doc_formats, metrics
+from app.doc_formats import DocFormat, Field, const
+from app.extract import detect_doc, parse_by_type
+
+GOLDEN = json.loads((Path(__file__).resolve().parent / "fixtures" / "parsed_receipts.json").read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("name", sorted(GOLDEN))
+def test_registry_matches_golden_parse(name):
+    """Test: detección y campos iguales a los de los parsers anteriores (fixtures + textos sintéticos)"""
+    case = GOLDEN[name]
+    assert detect_doc(case["text"]) == case["doc_type"]
+    assert parse_by_type(case["doc_type"], case["text"]) == case["parsed"]
+
+
+def test_scanner_equals_independent_searches():
+    """Test: los campos (incluido nth) dan lo mismo que re.search / re.findall por patrón"""
+    patterns = [r"ab([0-9]+)", r"b([0-9]{2})", r"\b(x+)\b", r"(?:^|\n)([a-c]+)\n", r"([0-9])a"]
+    fmt = DocFormat(
+        name="test",
+        fingerprints=(),
+        fields=tuple(Field(f"f{i}", p) for i, p in enumerate(patterns)) + (Field("second", patterns[0], nth=2),),
+    )
+    rnd = random.Random(7)
+    for _ in range(300):
+        text = "".join(rnd.choice("ab0123x \nc") for _ in range(rnd.randint(0, 60)))
+        parsed = fmt.parse(text)
+        for i, p in enumerate(patterns):
+            m = re.search(p, text, re.I)
+            assert parsed[f"f{i}"] == (m.group(1).strip() if m else None), (p, text)
+        hits = re.findall(patterns[0], text, re.I)
+        assert parsed["second"] == (hits[1].strip() if len(hits) > 1 else None)
+
+
+def test_field_alternatives_default_and_timing():
+    """Test: alternativas por prioridad, default y tiempo por parser en /metrics"""
+    metrics.reset()
+    fmt = DocFormat(
+        name="banco_test",
+        fingerprints=(("banco test",),),
+        fields=(
+            Field("amount", r"Importe:\s*([0-9]+)", convert=float),
+            Field("operation_id", r"Operación\s*([0-9]+)"),
+            Field("operation_id", r"Op\.\s*([0-9]+)"),
+            Field("direction", r"(débito)", convert=const("debit"), default="unknown"),
+        ),
+        static={"source_system": "banco_test"},
+    )
+    parsed = fmt.parse("Op. 11\nImporte: 500\nOperación 22")
+    assert parsed == {
+        "source_system": "banco_test", "amount": 500.0, "operation_id": "22",
+        "direction": "unknown", "needs_review": False, "parse_confidence": 80,
+    }
+    assert fmt.matches("comprobante banco test") and not fmt.matches("otro banco")
+    assert metrics.snapshot()["observations"]["parser.banco_test_ms"]["count"] == 1
+    assert "banco_test" not in doc_formats.FORMATS
+
+
+def test_automaton_finds_overlapping_phrases():
+    """Test: Aho–Corasick encuentra lo mismo que `in` por frase (incluye solapadas)"""
+    phrases = ["he", "she", "his", "hers", "a", "aab", "ab", "bab"]
+    automaton = doc_formats._Automaton(phrases)
+    rnd = random.Random(3)
+    for _ in range(300):
+        text = "".join(rnd.choice("abehirs") for _ in range(rnd.randint(0, 40)))
+        assert automaton.find(text) == {i for i, p in enumerate(phrases) if p in text}, text
+
+
+def test_classify_ranks_candidates_and_flags_review():
+    """Test: candidatos rankeados; parcial o empatado → needs_review en vez de parsear en silencio"""
+    mp = GOLDEN["t1_comprobante.pdf"]["text"]
+    c = doc_formats.classify(mp)
+    assert (c.doc_type, c.confidence, c.needs_review) == ("mp_transfer", 1.0, False)
+
+    # Sólo uno de los dos grupos del formato tarjeta: no alcanza para clasificarlo
+    partial = "Comprobante de pago\n$ 1.500\nDe\nJuan"
+    c = doc_formats.classify(partial)
+    assert (c.doc_type, c.confidence, c.needs_review) == ("unknown", 0.5, True)
+    assert c.candidates == [("card_payment", 0.5)]
+    parsed = doc_formats.parse_document(partial)
+    assert parsed["needs_review"] is True and parsed["parse_confidence"] <= 40
+    assert parsed["doc_candidates"] == [{"doc_type": "card_payment", "confidence": 0.5}]
+
+    # Dos formatos completos en el mismo texto: ambiguo
+    both = mp + "\n" + GOLDEN["t1_comprobante_137682651903.pdf"]["text"] + "\nTarjeta de crédito"
+    c = doc_formats.classify(both)
+    assert c.needs_review and [n for n, _ in c.candidates][:2] == ["mp_transfer", "card_payment"]
+
+    assert doc_formats.classify("Resumen de cuenta").doc_type == "unknown"
+
+
+def test_single_phrase_is_not_enough_to_classify(monkeypatch):
+    """Test: una sola frase ("mercado pago") no clasifica; con el umbral bajado queda para revisión"""
+    text = "Pagaste con Mercado Pago\n$ 2.000"
+    c = doc_formats.classify(text)
+    assert (c.doc_type, c.confidence, c.needs_review) == ("unknown", 0.5, True)
+    assert doc_formats.detect(text) == "unknown"
+
+    monkeypatch.setattr(doc_formats, "DOC_CLASSIFY_MIN_CONFIDENCE", 0.5)
+    c = doc_formats.classify(text)
+    assert (c.doc_type, c.confidence, c.needs_review) == ("mp_transfer", 0.5, True)
+    parsed = doc_formats.parse_document(text)
+    assert parsed["amount"] == 2000.0 and parsed["needs_review"] is True
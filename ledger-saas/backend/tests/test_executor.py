@@ -0,0 +1,76 @@
+"""
+Tests del executor de extracción (app.executor).
+"""
+
+import asyncio
+import time
+import pytest
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import executor, metrics, parse_cache
+from app.db import Base
+
+MP_PDF = Path(__file__).resolve().parent.parent / "uploads" / "t1_comprobante.pdf"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(executor, "EXTRACT_WORKERS", 1)
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", False)
+    metrics.reset()
+    yield executor
+    executor.shutdown()
+
+
+def test_extraction_runs_in_worker_process(pool):
+    """Test: la extracción en el pool da lo mismo que en el proceso"""
+    result = asyncio.run(executor.run(parse_cache.extract_receipt_pdf, str(MP_PDF)))
+    assert result == parse_cache.extract_receipt_pdf(str(MP_PDF))
+    assert metrics.snapshot()["gauges"]["extract.queue_depth"] == 0
+
+
+def test_timeout_restarts_pool(pool):
+    """Test: una tarea colgada vence, se mata el pool y el siguiente pedido funciona"""
+    async def scenario():
+        with pytest.raises(TimeoutError):
+            await executor.run(time.sleep, 30, timeout=1)
+        return await executor.run(len, "abc")
+
+    assert asyncio.run(scenario()) == 3
+    counters = metrics.snapshot()["counters"]
+    assert counters["extract.timeouts"] == 1 and counters["extract.pool_restarts"] == 1
+
+
+def test_rejects_when_queue_full(pool, monkeypatch):
+    """Test: con EXTRACT_MAX_PENDING tareas en curso se rechaza en vez de encolar sin límite"""
+    monkeypatch.setattr(executor, "EXTRACT_MAX_PENDING", 0)
+    with pytest.raises(executor.ExtractionBusy):
+        asyncio.run(executor.run(len, "abc"))
+    assert metrics.snapshot()["counters"]["extract.rejected"] == 1
+
+
+def test_receipt_pdf_async_uses_parse_cache(monkeypatch):
+    """Test: la variante async guarda y reutiliza la cache de parseo"""
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", True)
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    metrics.reset()
+    sha = parse_cache.sha256_bytes(MP_PDF.read_bytes())
+
+    first = asyncio.run(parse_cache.receipt_pdf_async(db, str(MP_PDF), sha))
+    again = asyncio.run(parse_cache.receipt_pdf_async(db, "/nonexistent.pdf", sha))
+    assert first == again and first[1]["doc_type"] == "transfer"
+    assert metrics.snapshot()["counters"]["parse_cache.hits"] == 1
+    db.close()
+
+
+def test_queue_wait_does_not_count_towards_timeout(pool):
+    """Test: tareas en cola detrás de otras no vencen por la espera ni reinician el pool"""
+    async def scenario():
+        return await asyncio.gather(*(executor.run(time.sleep, 0.5, timeout=1.2) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == [None, None, None]
+    counters = metrics.snapshot()["counters"]
+    assert "extract.timeouts" not in counters and "extract.pool_restarts" not in counters
@@ -0,0 +1,73 @@
+"""
+Tests del cliente HTTP compartido y las descargas de media de WhatsApp (contra benchmarks.fake_graph).
+"""
+
+import asyncio
+import hashlib
+import pytest
+from pathlib import Path
+from app import http_client, metrics
+from app.routers import whatsapp
+from benchmarks.fake_graph import serve
+
+MP_PDF = Path(__file__).resolve().parent.parent / "uploads" / "t1_comprobante.pdf"
+
+
+@pytest.fixture
+def graph(tmp_path, monkeypatch):
+    media = {
+        "pdf-1": (MP_PDF.read_bytes(), "application/pdf"),
+        "img-1": (b"\x89PNG" + b"x" * 300_000, "image/png"),
+    }
+    with serve(media) as fake:
+        monkeypatch.setattr(whatsapp, "META_GRAPH_URL", fake.url)
+        monkeypatch.setattr(whatsapp, "UPLOAD_DIR", str(tmp_path))
+        monkeypatch.setattr(whatsapp, "_media_urls", {})
+        metrics.reset()
+        yield fake
+
+
+def _run(*coros):
+    async def main():
+        try:
+            return await asyncio.gather(*coros)
+        finally:
+            await http_client.aclose()
+    return asyncio.run(main())
+
+
+def test_download_streams_to_disk_and_caches_media_url(graph, tmp_path):
+    """Test: el media se escribe con su SHA-256; la URL se reusa mientras está vigente"""
+    ((stored, content_type),) = _run(whatsapp.download_meta_media("pdf-1", "wa_pdf", token="t", version="v20.0"))
+    ((again, _),) = _run(whatsapp.download_meta_media("pdf-1", "wa_pdf_2", token="t", version="v20.0"))
+    data = MP_PDF.read_bytes()
+    assert content_type == "application/pdf"
+    assert stored.path == str(tmp_path / "wa_pdf.pdf")
+    assert (stored.size, stored.sha256) == (len(data), hashlib.sha256(data).hexdigest())
+    assert Path(stored.path).read_bytes() == data
+    assert again.sha256 == stored.sha256
+    assert (graph.lookups, graph.downloads) == (1, 2)
+    assert metrics.snapshot()["counters"]["meta_media.url_cache_hits"] == 1
+
+
+def test_expired_media_url_is_refreshed(graph):
+    """Test: si la URL cacheada ya no sirve se pide una nueva y se reintenta una vez"""
+    _run(whatsapp.download_meta_media("img-1", "wa_img", token="t", version="v20.0"))
+    graph.expire("img-1")
+    ((stored, content_type),) = _run(whatsapp.download_meta_media("img-1", "wa_img_2", token="t", version="v20.0"))
+    assert content_type == "image/png" and stored.path.endswith("wa_img_2.png")
+    assert (graph.lookups, graph.downloads) == (2, 2)
+    # Media inexistente: None (el worker de la cola lo reintenta)
+    assert _run(whatsapp.download_meta_media("missing", "wa_x", token="t", version="v20.0")) == [None]
+
+
+def test_concurrent_downloads_share_connections(graph, monkeypatch):
+    """Test: descargas simultáneas al mismo host reusan las conexiones (tope por host)"""
+    monkeypatch.setattr(http_client, "HTTP_MAX_PER_HOST", 2)
+    results = _run(*(
+        whatsapp.download_meta_media(media_id, f"wa_{i}", token="t", version="v20.0")
+        for i in range(3) for media_id in ("pdf-1", "img-1")
+    ))
+    assert all(results) and len({r[0].path for r in results}) == 6
+    assert graph.downloads == 6
+    assert graph.connections <= 2
@@ -0,0 +1,262 @@
+"""
+Tests de la cola durable de mensajes de WhatsApp (app.inbound_queue).
+"""
+
+import asyncio
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app import executor, inbound_queue, metrics, uploads
+from app.db import Base, get_db
+from app.models import IncomingMessage, Tenant, Transaction
+from app.routers import whatsapp
+
+MP_PDF = Path(__file__).resolve().parent.parent / "uploads" / "t1_comprobante.pdf"
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'queue.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    db = factory()
+    db.add(Tenant(name="Test Tenant", status="active"))
+    db.commit()
+    db.close()
+    metrics.reset()
+    return factory
+
+
+def _enqueue(factory, message_id="wamid.1", payload=None) -> int:
+    db = factory()
+    row = IncomingMessage(tenant_id=1, message_id=message_id, msg_type="document", status="queued",
+                          payload=json.dumps(payload or {"id": message_id, "type": "document"}))
+    db.add(row)
+    db.commit()
+    row_id = row.id
+    db.close()
+    return row_id
+
+
+def _row(factory, row_id) -> IncomingMessage:
+    db = factory()
+    row = db.get(IncomingMessage, row_id)
+    db.expunge(row)
+    db.close()
+    return row
+
+
+def test_claim_is_exclusive_and_expired_leases_are_reclaimed(session_factory):
+    """Test: un mensaje lo toma un solo worker; con el lease vencido lo retoma otro"""
+    row_id = _enqueue(session_factory)
+    db = session_factory()
+    assert inbound_queue.claim(db, "w1") == [row_id]
+    assert inbound_queue.claim(db, "w2") == []
+    assert inbound_queue.heartbeat(db, row_id, "w1")
+    assert not inbound_queue.heartbeat(db, row_id, "w2")
+
+    # w1 muere: el lease vence y w2 lo retoma (w1 ya no puede completarlo)
+    db.query(IncomingMessage).filter_by(id=row_id).update(
+        {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}
+    )
+    db.commit()
+    assert inbound_queue.claim(db, "w2") == [row_id]
+    assert not inbound_queue.complete(db, row_id, "w1")
+    assert inbound_queue.complete(db, row_id, "w2")
+    db.close()
+    row = _row(session_factory, row_id)
+    assert (row.status, row.attempts, row.lease_owner) == ("done", 2, None)
+
+
+def test_failures_back_off_then_dead_letter(session_factory, monkeypatch):
+    """Test: cada error reencola con backoff; pasado el máximo queda en dead-letter"""
+    monkeypatch.setattr(inbound_queue, "INBOUND_MAX_ATTEMPTS", 2)
+    row_id = _enqueue(session_factory)
+
+    async def boom(db, inbound):
+        raise RuntimeError("Graph API down")
+
+    worker = inbound_queue.Worker(session_factory, boom)
+    assert asyncio.run(worker.run_once())
+    row = _row(session_factory, row_id)
+    assert row.status == "queued" and "Graph API down" in row.last_error
+    assert row.available_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+    # En backoff: no se puede tomar todavía
+    assert not asyncio.run(worker.run_once())
+
+    db = session_factory()
+    db.query(IncomingMessage).filter_by(id=row_id).update({"available_at": None})
+    db.commit()
+    assert asyncio.run(worker.run_once())
+    assert _row(session_factory, row_id).status == "dead"
+    assert metrics.snapshot()["counters"]["inbound.dead"] == 1
+
+    assert inbound_queue.requeue_dead(db) == 1
+    assert _row(session_factory, row_id).status == "queued"
+    db.close()
+
+
+def test_lost_lease_cancels_processing(session_factory, monkeypatch):
+    """Test: si el heartbeat encuentra el lease tomado por otro, se cancela el handler"""
+    monkeypatch.setattr(inbound_queue, "INBOUND_HEARTBEAT_SECONDS", 0.05)
+    row_id = _enqueue(session_factory)
+    finished = []
+
+    async def slow(db, inbound):
+        other = session_factory()
+        other.query(IncomingMessage).filter_by(id=inbound.id).update({"lease_owner": "other"})
+        other.commit()
+        other.close()
+        await asyncio.sleep(5)
+        finished.append(inbound.id)
+
+    assert asyncio.run(inbound_queue.Worker(session_factory, slow).run_once())
+    assert finished == []
+    assert _row(session_factory, row_id).lease_owner == "other"
+    assert metrics.snapshot()["counters"]["inbound.lease_lost"] == 1
+
+
+def test_webhook_enqueues_and_worker_creates_transaction(session_factory, tmp_path, monkeypatch):
+    """Test: el webhook sólo encola; el worker descarga, parsea y crea la Transaction"""
+    monkeypatch.setattr(whatsapp, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", True)
+    downloads = []
+
+    async def fake_download(media_id, dest_stem, token=None, version=None):
+        downloads.append(media_id)
+        stored = uploads.save_chunks([MP_PDF.read_bytes()], str(tmp_path / f"{dest_stem}.pdf"))
+        return stored, "application/pdf"
+
+    monkeypatch.setattr(whatsapp, "download_meta_media", fake_download)
+
+    def db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(whatsapp.router)
+    app.dependency_overrides[get_db] = db
+    message = {"id": "wamid.DOC", "from": "5491100000000", "type": "document",
+               "document": {"id": "media-1", "filename": "comprobante.pdf"}}
+    body = {"tenant_id": "1", "phone_number_id": "123",
+            "payload": {"entry": [{"changes": [{"value": {"messages": [message, {**message, "id": "wamid.TXT", "type": "text"}]}}]}]}}
+    headers = {"Authorization": f"Bearer {whatsapp.BACKEND_SHARED_SECRET}"}
+    with TestClient(app) as client:
+        resp = client.post("/webhooks/whatsapp/meta/cloud", json=body, headers=headers)
+        assert resp.status_code == 200 and resp.json()["messages_queued"] == 1
+        # Reintento del forwarder: no se encola de nuevo
+        assert client.post("/webhooks/whatsapp/meta/cloud", json=body, headers=headers).json()["messages_queued"] == 0
+    assert downloads == []
+
+    worker = inbound_queue.Worker(session_factory, whatsapp.process_inbound_message)
+    assert asyncio.run(worker.run_once())
+    assert not asyncio.run(worker.run_once())
+
+    check = session_factory()
+    statuses = {m.message_id: m.status for m in check.query(IncomingMessage)}
+    assert statuses == {"wamid.DOC": "done", "wamid.TXT": "done"}
+    tx = check.query(Transaction).one()
+    assert tx.source_file == "whatsapp_1_wamid.DOC.pdf"
+    assert tx.amount is not None and tx.doc_type == "transfer"
+    check.close()
+    assert downloads == ["media-1"]
+
+
+def test_retry_skips_only_the_message_with_a_transaction(session_factory, tmp_path, monkeypatch):
+    """Test: el reintento se detecta por el vínculo exacto mensaje → Transaction (no por LIKE)"""
+    monkeypatch.setattr(whatsapp, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", True)
+    downloads = []
+
+    async def fake_download(media_id, dest_stem, token=None, version=None):
+        downloads.append(media_id)
+        stored = uploads.save_chunks([MP_PDF.read_bytes()], str(tmp_path / f"{dest_stem}.pdf"))
+        return stored, "application/pdf"
+
+    monkeypatch.setattr(whatsapp, "download_meta_media", fake_download)
+
+    def process(message_id):
+        row_id = _enqueue(session_factory, message_id, {"id": message_id, "type": "document",
+                                                         "document": {"id": f"m-{message_id}"}})
+        db = session_factory()
+        try:
+            asyncio.run(whatsapp.process_inbound_message(db, db.get(IncomingMessage, row_id)))
+        finally:
+            db.close()
+        return row_id
+
+    first = process("112")
+    # "whatsapp_1_1_2.%" con LIKE también matchea "whatsapp_1_112.pdf" ("_" es comodín)
+    process("1_2")
+    assert downloads == ["m-112", "m-1_2"]
+
+    db = session_factory()
+    row = db.get(IncomingMessage, first)
+    assert row.transaction_id == db.query(Transaction.id).filter(Transaction.source_file == "whatsapp_1_112.pdf").scalar()
+    asyncio.run(whatsapp.process_inbound_message(db, row))
+    db.close()
+    assert downloads == ["m-112", "m-1_2"]
+    check = session_factory()
+    assert check.query(Transaction).count() == 2
+    check.close()
+
+
+def test_webhook_flattens_entries_and_checks_ids_in_bulk(session_factory):
+    """Test: todos los entry/changes se encolan; los ids repetidos se detectan en lote"""
+    _enqueue(session_factory, "wamid.OLD")
+
+    def db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def doc(message_id):
+        return {"id": message_id, "from": "5491100000000", "type": "document", "document": {"id": f"m-{message_id}"}}
+
+    payload = {"entry": [
+        {"changes": [
+            {"value": {"messages": [doc("wamid.A"), doc("wamid.OLD")], "statuses": [{"id": "s1", "status": "read"}]}},
+            {"value": {"messages": [{"id": "wamid.T", "type": "text", "text": {"body": "hola"}}]}},
+        ]},
+        {"changes": [{"value": {"messages": [doc("wamid.B"), doc("wamid.A")]}}]},
+    ]}
+    app = FastAPI()
+    app.include_router(whatsapp.router)
+    app.dependency_overrides[get_db] = db
+    queries = []
+    listener = lambda conn, cursor, statement, *args: queries.append(statement)
+    engine = session_factory.kw["bind"]
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        with TestClient(app) as client:
+            resp = client.post("/webhooks/whatsapp/meta/cloud", json={"tenant_id": "1", "payload": payload},
+                               headers={"Authorization": f"Bearer {whatsapp.BACKEND_SHARED_SECRET}"})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["changes_processed"], data["messages_processed"], data["messages_queued"]) == (3, 5, 2)
+    assert data["statuses_processed"] == 1
+    assert [(m["id"], m["status"]) for m in data["messages"]] == [
+        ("wamid.A", "queued"), ("wamid.OLD", "duplicate"), ("wamid.T", "done"),
+        ("wamid.B", "queued"), ("wamid.A", "duplicate"),
+    ]
+    # Un SELECT ... IN y un INSERT para todo el lote
+    incoming = [q for q in queries if "incoming_messages" in q]
+    assert len(incoming) == 2 and " IN " in incoming[0] and incoming[1].startswith("INSERT")
+
+    check = session_factory()
+    statuses = {m.message_id: m.status for m in check.query(IncomingMessage)}
+    check.close()
+    assert statuses == {"wamid.OLD": "queued", "wamid.A": "queued", "wamid.T": "done", "wamid.B": "queued"}
@@ -71,6 +71,44 @@ def test_strong_id_match(db):
     assert result.score == 100
 
 
+def test_strong_id_fast_path_ignores_window_and_fees(db):
+    """Test: strong ID fuera de la ventana matchea; diferencia de comisión se reporta aparte"""
+    tenant_id = 1
+
+    sale_old = Sale(tenant_id=tenant_id, datetime="2025-11-01T10:00:00", amount=1000.00, currency="ARS",
+                    external_ref="139868096160")
+    sale_fee = Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=1000.00, currency="ARS",
+                    external_ref="OP-FEE")
+    sale_far = Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=2000.00, currency="ARS",
+                    external_ref="OP-FAR")
+    db.add_all([sale_old, sale_fee, sale_far])
+    db.commit()
+
+    tx_old = Transaction(tenant_id=tenant_id, source_file="a.pdf", datetime="2025-12-29T10:05:00",
+                         amount=1000.00, currency="ARS", operation_id="139868096160")
+    tx_fee = Transaction(tenant_id=tenant_id, source_file="b.pdf", datetime="2025-12-29T10:05:00",
+                         amount=985.00, currency="ARS", operation_id="OP-FEE")
+    tx_far = Transaction(tenant_id=tenant_id, source_file="c.pdf", datetime="2025-12-29T10:05:00",
+                         amount=1000.00, currency="ARS", operation_id="OP-FAR")
+    db.add_all([tx_old, tx_fee, tx_far])
+    db.commit()
+
+    result = match_sale(db, tx_old)
+    assert result.method == "strong_id"
+    assert result.sale_id == sale_old.id
+
+    result = match_sale(db, tx_fee)
+    assert result.status == "matched"
+    assert result.method == "strong_id_amount_diff"
+    assert result.sale_id == sale_fee.id
+    assert result.needs_review == True
+
+    # Diferencia de monto grande: no es strong ID
+    result = match_sale(db, tx_far)
+    assert result.method != "strong_id"
+    assert result.sale_id != sale_far.id
+
+
 def test_gap_match(db):
     """Test: Gap Match - top score >= threshold y gap >= AUTO_MATCH_GAP"""
     tenant_id = 1
@@ -324,6 +362,17 @@ def test_normalize_name():
     assert normalize_name(None) == ""
 
 
+def test_sale_match_features_on_write():
+    """Test: features de matching de Sale se calculan al escribir"""
+    sale = Sale(customer_name="JUAN PÉREZ S.A.", customer_phone="+54 9 11 1234-5678", external_ref="VENTA-01")
+    assert sale.customer_name_tokens == "juan perez"
+    assert sale.customer_phone_digits == "5491112345678"
+    assert sale.external_ref_lower == "venta-01"
+
+    sale.customer_phone = None
+    assert sale.customer_phone_digits is None
+
+
 def test_date_window_configuration(db):
     """Test: DATE_WINDOW_HOURS se respeta en búsqueda de candidatos"""
     # Este test verifica que la ventana de fechas es correcta
@@ -367,5 +416,374 @@ def test_date_window_configuration(db):
     assert result.sale_id == sale_new.id
 
 
+def test_rematch_batch_matches_per_transaction_path(db):
+    """Test: el re-match batch toma las mismas decisiones que match_sale"""
+    from app.rematch import rematch_tenant
+
+    tenant_id = 1
+    db.add_all([
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=1000.00, currency="ARS",
+             customer_name="Cliente A", customer_cuit="20123456789"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T14:00:00", amount=1000.00, currency="ARS",
+             customer_name="Cliente B", customer_phone="1123456789"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-20T10:00:00", amount=500.00, currency="ARS",
+             customer_name="Cliente C", external_ref="OP-1"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=700.00, currency="ARS",
+             customer_name="Cliente"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=700.00, currency="ARS",
+             customer_name="Cliente"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=700.01, currency="USD",
+             customer_name="Cliente"),
+    ])
+    db.commit()
+
+    txs = [
+        Transaction(tenant_id=tenant_id, source_file="a.pdf", datetime="2025-12-29T10:05:00", amount=1000.00,
+                    currency="ARS", payer_name="Cliente A", payer_cuit="20123456789"),
+        Transaction(tenant_id=tenant_id, source_file="b.pdf", datetime="2025-12-29T10:05:00", amount=500.00,
+                    currency="ARS", operation_id="OP-1"),
+        Transaction(tenant_id=tenant_id, source_file="c.pdf", datetime="2025-12-29T10:00:00", amount=700.00,
+                    currency="ARS", payer_name="Cliente"),
+        Transaction(tenant_id=tenant_id, source_file="d.pdf", datetime="2025-12-29T10:00:00", amount=700.00,
+                    currency="USD", payer_name="Cliente"),
+        Transaction(tenant_id=tenant_id, source_file="e.pdf", datetime="2026-03-01T10:00:00", amount=1000.00,
+                    currency="ARS"),
+        Transaction(tenant_id=tenant_id, source_file="f.pdf", datetime=None, amount=1000.00, currency="ARS"),
+        Transaction(tenant_id=tenant_id, source_file="g.pdf", datetime="2025-12-29T10:00:00", amount=None),
+    ]
+    db.add_all(txs)
+    db.commit()
+
+    expected = {}
+    for tx in txs:
+        res = match_sale(db, tx)
+        expected[tx.id] = (res.status, res.method, res.score, res.id if res.status == "matched" else None)
+
+    stats = rematch_tenant(db, tenant_id, chunk_size=3)
+    assert stats["processed"] == len(txs)
+    assert stats["tx_per_sec"] is not None
+
+    for tx in db.query(Transaction).all():
+        assert (tx.match_status, tx.match_method, tx.match_score, tx.matched_sale_id) == expected[tx.id]
+
+
+def test_matched_sale_not_claimed_twice(db):
+    """Test: una venta ya matcheada no es candidata para otra transferencia idéntica"""
+    from app.match import apply_sale_match
+
+    tenant_id = 1
+    sale = Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=1000.00, currency="ARS",
+                customer_name="Cliente A", customer_cuit="20123456789")
+    db.add(sale)
+    db.commit()
+
+    txs = []
+    for name in ("a.pdf", "b.pdf"):
+        tx = Transaction(tenant_id=tenant_id, source_file=name, datetime="2025-12-29T10:05:00",
+                         amount=1000.00, currency="ARS", payer_name="Cliente A", payer_cuit="20123456789")
+        db.add(tx)
+        db.commit()
+        apply_sale_match(db, tx, match_sale(db, tx))
+        db.commit()
+        txs.append(tx)
+
+    assert txs[0].match_status == "matched"
+    assert txs[0].matched_sale_id == sale.id
+    assert db.get(Sale, sale.id).status == "matched"
+    assert txs[1].match_status == "unmatched"
+    assert txs[1].matched_sale_id is None
+
+
+def test_assignment_mode_one_to_one(db):
+    """Test: modo assignment reparte transferencias idénticas entre ventas idénticas"""
+    from app.rematch import rematch_tenant
+
+    tenant_id = 1
+    sales = [
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=700.00, currency="ARS",
+             customer_name="Cliente"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=700.00, currency="ARS",
+             customer_name="Cliente"),
+        # Venta única con dos candidatas indistinguibles para una sola transferencia
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=300.00, currency="ARS"),
+        Sale(tenant_id=tenant_id, datetime="2025-12-29T10:00:00", amount=300.00, currency="ARS"),
+    ]
+    db.add_all(sales)
+    db.commit()
+
+    txs = [
+        Transaction(tenant_id=tenant_id, source_file="a.pdf", datetime="2025-12-29T10:00:00", amount=700.00,
+                    currency="ARS", payer_name="Cliente"),
+        Transaction(tenant_id=tenant_id, source_file="b.pdf", datetime="2025-12-29T10:00:00", amount=700.00,
+                    currency="ARS", payer_name="Cliente"),
+        Transaction(tenant_id=tenant_id, source_file="c.pdf", datetime="2025-12-29T10:00:00", amount=300.00,
+                    currency="ARS"),
+    ]
+    db.add_all(txs)
+    db.commit()
+
+    # Decididas de a una, las dos primeras quedan ambiguous
+    assert match_sale(db, txs[0]).status == "ambiguous"
+
+    stats = rematch_tenant(db, tenant_id, mode="assignment")
+    assert stats["matched"] == 2
+
+    t1, t2, t3 = (db.get(Transaction, t.id) for t in txs)
+    assert {t1.match_status, t2.match_status} == {"matched"}
+    assert t1.match_method == t2.match_method == "assignment"
+    assert {t1.matched_sale_id, t2.matched_sale_id} == {sales[0].id, sales[1].id}
+    assert t3.match_status == "ambiguous"
+    assert t3.matched_sale_id is None
+
+    statuses = {s.id: db.get(Sale, s.id).status for s in sales}
+    assert statuses == {sales[0].id: "matched", sales[1].id: "matched", sales[2].id: "open", sales[3].id: "open"}
+
+
+def test_counterparty_token_index(db, monkeypatch):
+    """Test: índice invertido de contrapartes se mantiene en insert/update/delete y filtra candidatos"""
+    from app import counterparty_index
+    from app.match import match_counterparty
+    from app.models import Counterparty, CounterpartyToken
+
+    def tokens(cp_id):
+        return sorted(
+            t.token for t in db.query(CounterpartyToken).filter_by(counterparty_id=cp_id, kind="w")
+        )
+
+    juan = Counterparty(tenant_id=1, display_name="Juan Pérez", normalized_name=normalize_name("Juan Pérez"))
+    ana = Counterparty(tenant_id=1, display_name="Ana Gómez", normalized_name=normalize_name("Ana Gómez"))
+    otro = Counterparty(tenant_id=1, display_name="Distribuidora Norte", normalized_name="distribuidora norte")
+    db.add_all([juan, ana, otro])
+    db.commit()
+    assert tokens(juan.id) == ["juan", "perez"]
+
+    # Sólo comparten tokens con "juan perez" las contrapartes que lo contienen
+    assert counterparty_index.candidate_ids(db, 1, "juan perez") == [juan.id]
+    res = match_counterparty(db, 1, "JUAN PEREZ", None, None)
+    assert res.id is None and res.score == 22  # scoring original: 2 tokens * 11
+    assert [c["counterparty_id"] for c in res.candidates] == [juan.id]
+
+    # Update del nombre reindexa
+    ana.normalized_name = "ana gomez perez"
+    db.commit()
+    assert tokens(ana.id) == ["ana", "gomez", "perez"]
+    # IDF: "juan" es más raro que "perez" → juan primero
+    assert counterparty_index.candidate_ids(db, 1, "juan perez") == [juan.id, ana.id]
+
+    db.delete(juan)
+    db.commit()
+    assert tokens(juan.id) == []
+
+    # Trigramas (opcional): tolera typos sin tokens en común
+    monkeypatch.setattr(counterparty_index, "COUNTERPARTY_TRIGRAMS", True)
+    otro.normalized_name = "distribuidora nortee"
+    db.commit()
+    assert counterparty_index.candidate_ids(db, 1, "distribuidra norte")[0] == otro.id
+    res = match_counterparty(db, 1, "Distribuidra Norte", None, None)
+    assert res.candidates[0]["counterparty_id"] == otro.id
+    assert res.candidates[0]["score"] > 0
+
+
+def test_counterparty_doc_count_per_engine_and_bounded(db, monkeypatch):
+    """Test: N del IDF cacheado por engine, descartado al insertar y acotado en tamaño"""
+    from app import counterparty_index
+    from app.models import Counterparty
+
+    def add(session, tenant_id, name):
+        session.add(Counterparty(tenant_id=tenant_id, display_name=name, normalized_name=normalize_name(name)))
+        session.commit()
+
+    add(db, 1, "Juan Pérez")
+    assert counterparty_index._doc_count(db, 1) == 1
+
+    # Otra BD con el mismo tenant_id no ve el conteo de la primera
+    other_engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=other_engine)
+    other = sessionmaker(bind=other_engine)()
+    for name in ("Ana Gómez", "María López", "Distribuidora Norte"):
+        add(other, 1, name)
+    assert counterparty_index._doc_count(other, 1) == 3
+    assert counterparty_index._doc_count(db, 1) == 1
+
+    # Insertar una contraparte invalida el conteo sin esperar el TTL
+    add(db, 1, "Ana Gómez")
+    assert counterparty_index._doc_count(db, 1) == 2
+    other.close()
+
+    monkeypatch.setattr(counterparty_index, "DOC_COUNT_MAX_TENANTS", 2)
+    for tenant_id in range(10, 15):
+        counterparty_index._doc_count(db, tenant_id)
+    assert len(counterparty_index._doc_counts[db.get_bind()]) <= 2
+
+
+def test_sale_cache_matches_like_db_and_invalidates(db, monkeypatch):
+    """Test: con la cache de ventas habilitada, match_sale decide igual y ve las escrituras"""
+    from app import metrics, sale_cache
+    from app.match import apply_sale_match
+
+    monkeypatch.setattr(sale_cache, "SALE_CACHE_ENABLED", True)
+    monkeypatch.setattr(sale_cache, "SALE_CACHE_VERSION_CHECK_SECONDS", 3600)
+    sale_cache.clear()
+    metrics.reset()
+
+    db.add(Sale(tenant_id=1, datetime="2025-12-29T10:00:00", amount=1000.00, currency="ARS", customer_name="Ana Gómez"))
+    db.commit()
+
+    def tx():
+        return Transaction(
+            tenant_id=1, source_file="t.pdf", datetime="2025-12-29T10:05:00",
+            amount=1000.00, currency="ARS", payer_name="Ana Gómez",
+        )
+
+    t1 = tx()
+    res = match_sale(db, t1)
+    assert res.status == "matched" and res.method == "single_candidate"
+    assert match_sale(db, tx()).id == res.id
+    assert metrics.snapshot()["counters"]["sale_cache.hits"] == 1
+
+    # Venta nueva por el ORM: invalida sin esperar al chequeo de versión → ambiguous
+    db.add(Sale(tenant_id=1, datetime="2025-12-29T10:00:00", amount=1000.00, currency="ARS", customer_name="Ana Gómez"))
+    db.commit()
+    assert match_sale(db, tx()).status == "ambiguous"
+
+    # La venta ganadora sale de las candidatas al aplicarse el match
+    db.add(t1)
+    apply_sale_match(db, t1, res)
+    db.commit()
+    second = match_sale(db, tx())
+    assert second.status == "matched" and second.id != res.id
+
+    # Cambio hecho por otro worker (versión en BD sin invalidar la entrada local)
+    sale_cache.clear()
+    assert match_sale(db, tx()).id == second.id
+    db.query(Sale).filter(Sale.id == second.id).update({"status": "matched"})
+    db.commit()
+    assert match_sale(db, tx()).status == "unmatched"  # venta vieja detectada y descartada
+    assert metrics.snapshot()["counters"]["sale_cache.stale"] == 1
+    sale_cache.clear()
+
+
+def test_vectorized_scoring_parity(db, monkeypatch):
+    """Test: el scoring vectorizado da exactamente el mismo ranking que el loop escalar"""
+    import random
+    from datetime import timedelta
+    from app import match
+    from app.sale_index import SaleIndex
+    from app.vector_score import rank_candidates_vectorized
+
+    rnd = random.Random(7)
+    base = datetime(2025, 12, 29, 10, 0)
+    names = ["Ana Gómez", "Juan Pérez", "María López", None]
+    for i in range(300):
+        db.add(Sale(
+            tenant_id=1,
+            datetime=(base + timedelta(minutes=rnd.randint(-4000, 4000))).isoformat(),
+            amount=rnd.choice([1000.00, 1000.00, 999.99]),
+            currency="ARS",
+            customer_name=rnd.choice(names),
+            customer_cuit=rnd.choice([None, "20-12345678-9", "20123456789", "27-87654321-3"]),
+            customer_phone=rnd.choice([None, "+54 9 11 5555-1234", "11 6666-7777"]),
+            external_ref=rnd.choice([None, f"V-{i}"]),
+        ))
+    db.commit()
+    sales = db.query(Sale).all()
+    index = SaleIndex(sales)
+    for s in sales[::7]:
+        index.claim(s.id)
+
+    def key(ranked):
+        return [(s.id, score, reasons, ev, delta) for s, score, reasons, ev, delta in ranked]
+
+    for k in range(40):
+        tx = Transaction(
+            tenant_id=1, source_file="t.pdf", currency="ARS", amount=1000.00,
+            datetime=(base + timedelta(minutes=rnd.randint(-1500, 1500))).isoformat(),
+            payer_name=rnd.choice(names),
+            payer_cuit=rnd.choice([None, "20-12345678-9", "5491155551234"]),
+            payer_cuit_masked=rnd.choice([None, "XX-XXXX5678-9", "***56789"]),
+            concept=rnd.choice([None, f"pago V-{k} tel 1155551234", "transferencia"]),
+        )
+        tx_dt = tx.datetime_ts
+        start, end = match._date_window(tx_dt)
+        pairs = [(s, s.datetime_ts) for s in sales]
+
+        monkeypatch.setattr(match, "VECTOR_SCORE_MIN_CANDIDATES", 0)
+        scalar = key(match._rank_candidates(tx, tx_dt, pairs, start, end))
+        scalar_index = key(match._rank_index_window(index, tx, tx_dt, 0.01, start, end))
+        monkeypatch.setattr(match, "VECTOR_SCORE_MIN_CANDIDATES", 1)
+        assert key(rank_candidates_vectorized(match._tx_features(tx, tx_dt), pairs, start, end)) == scalar
+        assert key(match._rank_index_window(index, tx, tx_dt, 0.01, start, end)) == scalar_index
+
+    # El camino de la BD de match_sale no arma SaleArrays por llamada (más lento que el loop)
+    def no_vector(*args, **kwargs):
+        raise AssertionError("DB path must not vectorize")
+
+    monkeypatch.setattr(match, "rank_arrays", no_vector)
+    assert match.match_sale(db, tx).candidates
+
+
+def test_reverse_match_on_sale_creation(db):
+    """Test: una transferencia que llegó antes que su venta se vincula al cargar la venta"""
+    from types import SimpleNamespace
+    from app.routers.sales import SaleIn, create_sale, create_sales_bulk
+
+    early = Transaction(
+        tenant_id=1, source_file="t1.pdf", datetime="2025-12-29T10:05:00",
+        amount=1000.00, currency="ARS", payer_name="Ana Gómez",
+    )
+    other = Transaction(
+        tenant_id=1, source_file="t2.pdf", datetime="2025-12-20T10:05:00",
+        amount=1000.00, currency="ARS", payer_name="Ana Gómez",
+    )
+    by_ref = Transaction(
+        tenant_id=1, source_file="t3.pdf", datetime="2026-02-01T10:00:00",
+        amount=2500.00, currency="ARS", operation_id="OP-77",
+    )
+    db.add_all([early, other, by_ref])
+    db.commit()
+    assert match_sale(db, early).status == "unmatched"
+
+    user = SimpleNamespace(tenant_id=1)
+    out = create_sale(SaleIn(datetime="2025-12-29T10:00:00", amount=1000.00, customer_name="Ana Gómez"), db, user)
+    assert out["linked_transaction_ids"] == [early.id]
+    db.refresh(early)
+    db.refresh(other)
+    assert early.match_status == "matched" and early.matched_sale_id == out["id"]
+    assert other.match_status == "unmatched"  # fuera de la ventana de fechas
+    assert db.get(Sale, out["id"]).status == "matched"
+
+    # Bulk: strong ID sin importar la fecha + una venta sin transacciones
+    out = create_sales_bulk([
+        SaleIn(datetime="2025-06-01T00:00:00", amount=2500.00, external_ref="OP-77"),
+        SaleIn(datetime="2025-06-01T00:00:00", amount=10.00),
+    ], db, user)
+    assert [s["linked_transaction_ids"] for s in out["sales"]] == [[by_ref.id], []]
+    db.refresh(by_ref)
+    assert by_ref.match_method == "strong_id"
+
+
+
+def test_reverse_match_leaves_other_transactions_untouched(db):
+    """Test: cargar una venta no re-matchea transacciones que gana otra venta"""
+    from types import SimpleNamespace
+    from app.routers.sales import SaleIn, create_sale
+
+    # Venta vieja cargada sin reverse matching (ej. import directo) y una transferencia
+    # pendiente que hoy la ganaría: no es asunto de la venta nueva
+    old = Sale(tenant_id=1, datetime="2025-12-29T10:00:00", amount=1000.00, currency="ARS",
+               customer_name="Ana Gómez", status="open")
+    pending = Transaction(tenant_id=1, source_file="t1.pdf", datetime="2025-12-29T10:05:00",
+                          amount=1000.00, currency="ARS", payer_name="Ana Gómez", match_status="unmatched")
+    db.add_all([old, pending])
+    db.commit()
+
+    out = create_sale(SaleIn(datetime="2025-12-30T18:00:00", amount=1000.00, customer_name="Pedro Ruiz"),
+                      db, SimpleNamespace(tenant_id=1))
+    assert out["linked_transaction_ids"] == []
+    db.refresh(pending)
+    assert pending.match_status == "unmatched" and pending.matched_sale_id is None
+    assert db.get(Sale, old.id).status == "open"
+    assert db.get(Sale, out["id"]).status == "open"
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
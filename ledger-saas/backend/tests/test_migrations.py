@@ -0,0 +1,51 @@
+"""
+Tests de las migraciones livianas (app.migrations) sobre una BD con schema viejo.
+"""
+
+from sqlalchemy import create_engine, inspect, text
+from app.db import Base
+from app.migrations import run_migrations
+
+
+def test_run_migrations_adds_columns_and_backfills(tmp_path):
+    """Test: BD con schema viejo queda con columnas nuevas, índices y backfills"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # Simular el schema anterior: sin datetime_ts ni índice de candidatos
+        conn.exec_driver_sql("DROP INDEX ix_sales_candidate")
+        conn.exec_driver_sql("DROP INDEX ix_sales_datetime_ts")
+        conn.exec_driver_sql("ALTER TABLE sales DROP COLUMN datetime_ts")
+        for col in ("customer_name_tokens", "customer_phone_digits", "external_ref_lower"):
+            conn.exec_driver_sql(f"ALTER TABLE sales DROP COLUMN {col}")
+        conn.exec_driver_sql(
+            "INSERT INTO sales (tenant_id, datetime, currency, amount, status, customer_name, customer_phone, external_ref) "
+            "VALUES (1, '2025-12-29T10:00:00', 'ARS', 1000, 'open', 'JUAN PÉREZ S.A.', '+54 9 11 1234-5678', 'VENTA-01'), "
+            "(1, 'basura', 'ARS', 500, 'open', NULL, NULL, NULL)"
+        )
+        # Contraparte cargada sin pasar por el ORM: sin tokens en el índice invertido
+        conn.exec_driver_sql(
+            "INSERT INTO counterparties (tenant_id, type, display_name, normalized_name) "
+            "VALUES (1, 'unknown', 'Juan Pérez', 'juan perez')"
+        )
+
+    run_migrations(engine)
+    run_migrations(engine)  # idempotente
+
+    insp = inspect(engine)
+    assert "datetime_ts" in {c["name"] for c in insp.get_columns("sales")}
+    assert "ix_sales_candidate" in {i["name"] for i in insp.get_indexes("sales")}
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT datetime, datetime_ts, customer_name_tokens, customer_phone_digits, external_ref_lower "
+            "FROM sales ORDER BY id"
+        )).all()
+    assert rows[0].datetime_ts.startswith("2025-12-29 10:00:00")
+    assert rows[1].datetime_ts is None
+    assert rows[0].customer_name_tokens == "juan perez"
+    assert rows[0].customer_phone_digits == "5491112345678"
+    assert rows[0].external_ref_lower == "venta-01"
+    assert rows[1].customer_name_tokens is None
+    with engine.connect() as conn:
+        tokens = conn.execute(text("SELECT token FROM counterparty_tokens WHERE kind = 'w' ORDER BY token")).scalars().all()
+    assert tokens == ["juan", "perez"]
@@ -0,0 +1,138 @@
+"""
+Tests del OCR de comprobantes en imagen (app.ocr). El engine se reemplaza por uno falso:
+no requieren tesseract instalado.
+"""
+
+import asyncio
+import json
+import pytest
+from pathlib import Path
+from PIL import Image, ImageDraw
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import executor, metrics, ocr, parse_cache
+from app.db import Base
+
+GOLDEN = json.loads((Path(__file__).resolve().parent / "fixtures" / "parsed_receipts.json").read_text(encoding="utf-8"))
+MP_TEXT = GOLDEN["t1_comprobante.pdf"]["text"]
+GALICIA_TEXT = GOLDEN["t1_Trf Inmed Proveed_2025-12-29.pdf"]["text"]
+
+
+class FakeEngine:
+    name = "fake"
+
+    def __init__(self, by_psm: dict):
+        self.by_psm = by_psm
+        self.calls = []
+
+    def text(self, image, psm, timeout=None):
+        self.calls.append((image.mode, max(image.size), psm))
+        return self.by_psm.get(psm, "")
+
+
+@pytest.fixture
+def photo(tmp_path):
+    """Foto grande a color: fondo gris claro con texto oscuro."""
+    image = Image.new("RGB", (4000, 3000), (200, 190, 180))
+    ImageDraw.Draw(image).rectangle((500, 500, 3500, 900), fill=(30, 30, 40))
+    path = tmp_path / "foto.jpg"
+    image.save(path)
+    return path
+
+
+def test_otsu_threshold_splits_bimodal_histogram():
+    """Test: el umbral de Otsu cae entre los dos modos"""
+    histogram = [0] * 256
+    histogram[40] = 1000
+    histogram[210] = 3000
+    assert 40 <= ocr.otsu_threshold(histogram) < 210
+
+
+def test_preprocess_downscales_and_binarizes(photo):
+    """Test: la imagen queda en grises, binaria y dentro de OCR_MAX_SIDE"""
+    with Image.open(photo) as image:
+        prepared = ocr.preprocess(image)
+    assert prepared.mode == "L" and max(prepared.size) == ocr.OCR_MAX_SIDE
+    assert set(prepared.getdata()) == {0, 255}
+
+
+def test_receipt_text_picks_psm_by_document_type(photo, monkeypatch):
+    """Test: sin tipo reconocido reintenta con PSM 11; con tipo usa el PSM configurado"""
+    engine = FakeEngine({ocr.OCR_DEFAULT_PSM: "ruido", ocr.SPARSE_PSM: MP_TEXT})
+    monkeypatch.setattr(ocr, "_engine", engine)
+    assert ocr.receipt_text(str(photo)) == MP_TEXT
+    assert [psm for _, _, psm in engine.calls] == [ocr.OCR_DEFAULT_PSM, ocr.SPARSE_PSM]
+    assert all(mode == "L" and side <= ocr.OCR_MAX_SIDE for mode, side, _ in engine.calls)
+
+    monkeypatch.setattr(ocr, "OCR_PSM_BY_TYPE", {"galicia_movement": 6})
+    engine = FakeEngine({ocr.OCR_DEFAULT_PSM: GALICIA_TEXT.replace("38.000,00", "38.0O0,00"), 6: GALICIA_TEXT})
+    monkeypatch.setattr(ocr, "_engine", engine)
+    assert ocr.receipt_text(str(photo)) == GALICIA_TEXT
+
+
+def test_receipt_image_async_parses_and_records_latency(photo, monkeypatch):
+    """Test: foto de una transferencia → campos parseados (cacheados) y latencia por imagen"""
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", True)
+    monkeypatch.setattr(ocr, "_engine", FakeEngine({ocr.OCR_DEFAULT_PSM: MP_TEXT}))
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    metrics.reset()
+    sha = parse_cache.sha256_bytes(photo.read_bytes())
+
+    text, parsed = asyncio.run(parse_cache.receipt_image_async(db, str(photo), sha))
+    assert text == MP_TEXT
+    assert parsed == GOLDEN["t1_comprobante.pdf"]["parsed"]
+    assert asyncio.run(parse_cache.receipt_image_async(db, str(photo), sha)) == (text, parsed)
+    assert metrics.snapshot()["observations"]["ocr.image_ms"]["count"] == 1
+    db.close()
+
+
+def _scanned_pdf(path: Path, pages: int) -> str:
+    """PDF sin capa de texto: cada página es sólo una imagen."""
+    import fitz
+
+    image = Image.new("L", (600, 800), 255)
+    ImageDraw.Draw(image).rectangle((50, 50, 550, 150), fill=0)
+    png = path.parent / "scan.png"
+    image.save(png)
+    with fitz.open() as doc:
+        for _ in range(pages):
+            doc.new_page(width=595, height=842).insert_image(fitz.Rect(0, 0, 595, 842), filename=str(png))
+        doc.save(str(path))
+    return str(path)
+
+
+def test_scanned_pdf_is_rasterized_and_ocred(tmp_path, monkeypatch):
+    """Test: PDF escaneado → OCR sólo de las páginas necesarias, a resolución acotada"""
+    from app import extract, pdf_backends
+
+    metrics.reset()
+    engine = FakeEngine({ocr.OCR_DEFAULT_PSM: MP_TEXT})
+    monkeypatch.setattr(ocr, "_engine", engine)
+    monkeypatch.setattr(pdf_backends, "PDF_OCR_MAX_PIXELS", 1_000_000)
+    pdf = _scanned_pdf(tmp_path / "escaneado.pdf", pages=5)
+
+    text = extract.extract_text_from_pdf(pdf)
+    assert text == MP_TEXT
+    assert extract.parse_document(text) == GOLDEN["t1_comprobante.pdf"]["parsed"]
+    counters = metrics.snapshot()["counters"]
+    assert counters["pdf_text.ocr_fallbacks"] == 1 and counters["pdf_ocr.pages"] == 1
+    # 595x842 pt a 200 dpi serían ~2.7 MP: se acota a PDF_OCR_MAX_PIXELS
+    mode, side, _ = engine.calls[0]
+    assert side <= 1190
+
+
+def test_scanned_pdf_respects_cpu_budget(tmp_path, monkeypatch):
+    """Test: sin presupuesto de CPU no se renderiza ni se hace OCR"""
+    from app import extract, pdf_backends
+
+    metrics.reset()
+    engine = FakeEngine({ocr.OCR_DEFAULT_PSM: MP_TEXT})
+    monkeypatch.setattr(ocr, "_engine", engine)
+    monkeypatch.setattr(pdf_backends, "PDF_OCR_CPU_SECONDS", 0)
+    pdf = _scanned_pdf(tmp_path / "escaneado.pdf", pages=2)
+
+    assert extract.extract_text_from_pdf(pdf) == ""
+    assert engine.calls == []
+    assert metrics.snapshot()["counters"]["pdf_ocr.budget_exceeded"] == 1
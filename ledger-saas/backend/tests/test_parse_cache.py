@@ -0,0 +1,58 @@
+"""
+Tests de la cache de parseo por contenido (app.parse_cache).
+"""
+
+import pytest
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import extract, metrics, parse_cache
+from app.db import Base
+from app.models import ParseCacheEntry
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+CARD_PDF = UPLOADS / "t1_comprobante_137682651903.pdf"
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_receipt_hit_skips_extraction(db, monkeypatch):
+    """Test: el mismo PDF (otro nombre / canal) no se vuelve a extraer"""
+    metrics.reset()
+    calls = []
+    real = extract.extract_text_from_pdf
+    monkeypatch.setattr(extract, "extract_text_from_pdf", lambda path: calls.append(path) or real(path))
+    sha = parse_cache.sha256_bytes(CARD_PDF.read_bytes())
+
+    text, parsed = parse_cache.receipt_pdf(db, str(CARD_PDF), sha)
+    db.commit()
+    again_text, again = parse_cache.receipt_pdf(db, "/nonexistent/reenviado.pdf", sha)
+    assert calls == [str(CARD_PDF)]
+    assert (again_text, again) == (text, parsed)
+    assert parsed["doc_type"] == "card_payment" and parsed["amount"] is not None
+    assert metrics.snapshot()["counters"] == {"parse_cache.hits": 1, "parse_cache.misses": 1}
+    assert metrics.snapshot()["gauges"]["parse_cache.hit_rate"] == 0.5
+
+    # Nueva versión del parser: miss
+    monkeypatch.setattr(extract, "PARSER_VERSION", "test-next")
+    parse_cache.receipt_pdf(db, str(CARD_PDF), sha)
+    assert len(calls) == 2
+
+
+def test_size_based_eviction(db, monkeypatch):
+    """Test: al superar el tope se borran las entradas menos usadas"""
+    monkeypatch.setattr(parse_cache, "PARSE_CACHE_MAX_BYTES", 250)
+    for i in range(5):
+        parse_cache.cached(db, parse_cache.sha256_bytes(f"file-{i}".encode()), "receipt_pdf", "1", lambda: ("x" * 100, None))
+        db.commit()
+    assert db.query(ParseCacheEntry).count() == 2
+    # Texto de error (OCR/PDF fallido): no se cachea
+    parse_cache.cached(db, parse_cache.sha256_bytes(b"broken"), "sale_image", "1", lambda: ("[ERROR OCR: boom]", {}))
+    assert db.query(ParseCacheEntry).filter_by(kind="sale_image").count() == 0
@@ -0,0 +1,92 @@
+"""
+Tests de los backends de extracción de PDFs (app.pdf_backends).
+"""
+
+import pytest
+from pathlib import Path
+from app import extract, metrics, pdf_backends
+from app.extract import detect_doc, parse_by_type
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+FIXTURES = sorted(UPLOADS.glob("*.pdf"))
+
+
+@pytest.mark.parametrize("pdf", FIXTURES, ids=lambda p: p.name)
+def test_backends_parse_identical_fields(pdf):
+    """Test: PyMuPDF y pdfplumber dan los mismos campos parseados en cada comprobante"""
+    parsed = {}
+    for name in ("pymupdf", "pdfplumber"):
+        text = pdf_backends.get_backend(name).extract_text(str(pdf))
+        doc_type = detect_doc(text)
+        assert doc_type != "unknown"
+        parsed[name] = parse_by_type(doc_type, text)
+    assert parsed["pymupdf"] == parsed["pdfplumber"]
+
+
+def test_unrecognized_text_falls_back_to_pdfplumber(monkeypatch):
+    """Test: si el texto del backend rápido no se reconoce se usa pdfplumber"""
+    metrics.reset()
+    pdf = str(FIXTURES[0])
+    monkeypatch.setattr(pdf_backends.PyMuPDFBackend, "iter_pages", lambda self, path: iter(["texto ilegible"]))
+
+    text = extract.extract_text_from_pdf(pdf)
+    assert text == pdf_backends.get_backend("pdfplumber").extract_text(pdf)
+    assert metrics.snapshot()["counters"] == {"pdf_text.fallbacks": 1}
+
+
+def _with_filler_pages(src: Path, dest: Path, first_text: str | None, filler: int) -> str:
+    import fitz
+
+    with fitz.open() as doc:
+        if first_text is None:
+            with fitz.open(str(src)) as receipt:
+                doc.insert_pdf(receipt)
+        else:
+            doc.new_page().insert_text((72, 72), first_text)
+        for i in range(filler):
+            doc.new_page().insert_text((72, 72), f"Anexo página {i + 2}")
+        doc.save(str(dest))
+    return str(dest)
+
+
+@pytest.mark.parametrize("backend", ["pymupdf", "pdfplumber"])
+def test_complete_receipt_stops_after_first_page(tmp_path, monkeypatch, backend):
+    """Test: con todos los campos requeridos en la página 1 no se leen las siguientes"""
+    metrics.reset()
+    monkeypatch.setattr(pdf_backends, "PDF_TEXT_BACKEND", backend)
+    receipt = UPLOADS / "t1_comprobante.pdf"
+    pdf = _with_filler_pages(receipt, tmp_path / "largo.pdf", None, 40)
+
+    text = extract.extract_text_from_pdf(pdf)
+    assert text == pdf_backends.get_backend(backend).extract_text(str(receipt))
+    assert metrics.snapshot()["observations"]["pdf_text.pages_read"]["sum"] == 1
+
+
+def test_unknown_document_respects_page_cap(tmp_path, monkeypatch):
+    """Test: un PDF no reconocido se deja de leer en PDF_MAX_PAGES (por backend)"""
+    metrics.reset()
+    monkeypatch.setattr(extract, "PDF_MAX_PAGES", 3)
+    pdf = _with_filler_pages(UPLOADS / "t1_comprobante.pdf", tmp_path / "resumen.pdf", "Resumen de cuenta", 40)
+
+    extract.extract_text_from_pdf(pdf)
+    pages = metrics.snapshot()["observations"]["pdf_text.pages_read"]
+    assert (pages["count"], pages["max"]) == (2, 3)  # pymupdf + fallback pdfplumber
+
+
+def test_scan_closes_backend_on_early_exit(monkeypatch):
+    """Test: al cortar antes, el generador de páginas se cierra (libera el documento)"""
+    monkeypatch.setattr(extract, "PDF_MAX_PAGES", 3)
+    closed = []
+
+    class Backend:
+        name = "fake"
+
+        def iter_pages(self, path):
+            try:
+                while True:
+                    yield "texto sin comprobante"
+            finally:
+                closed.append(path)
+
+    assert extract._scan_pages(Backend(), "x.pdf") == "\n".join(["texto sin comprobante"] * 3)
+    assert closed == ["x.pdf"]
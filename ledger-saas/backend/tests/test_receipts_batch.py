@@ -0,0 +1,165 @@
+"""
+Tests de la carga masiva de comprobantes (POST /v1/receipts/batch).
+"""
+
+import io
+import json
+import zipfile
+import pytest
+from pathlib import Path
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from app import executor
+from app.db import Base, get_db
+from app.deps import get_current_user
+from app.models import Counterparty, ParseCacheEntry, Transaction
+from app.routers import receipts
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+MP_PDF = UPLOADS / "t1_comprobante.pdf"
+CARD_PDF = UPLOADS / "t1_comprobante_137682651903.pdf"
+GALICIA_PDF = UPLOADS / "t1_Trf Inmed Proveed_2025-12-29.pdf"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(receipts, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", True)
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionTest = sessionmaker(bind=engine, autoflush=False)
+
+    def db():
+        session = SessionTest()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(receipts.router)
+    app.dependency_overrides[get_db] = db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(tenant_id=1, role="owner")
+    with TestClient(app) as c:
+        c.session = SessionTest
+        yield c
+
+
+def _zip(entries: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_batch_zip_and_files_stream_ndjson(client, monkeypatch):
+    """Test: ZIP + archivo suelto → una línea por comprobante, guardados por chunk"""
+    monkeypatch.setattr(receipts, "RECEIPTS_BATCH_CHUNK", 2)
+    monkeypatch.setattr(receipts, "BATCH_FLUSH_SECONDS", 60)
+    commits = []
+    # Flushes que insertan comprobantes (las extracciones commitean aparte la cache de parseo)
+    listener = lambda session, ctx: commits.extend(
+        [session] if any(isinstance(o, Transaction) for o in session.new) else []
+    )
+    event.listen(Session, "after_flush", listener)
+    archive = _zip({
+        "enero/comprobante.pdf": MP_PDF.read_bytes(),
+        "febrero/comprobante.pdf": CARD_PDF.read_bytes(),
+        "__MACOSX/enero/._comprobante.pdf": b"resource fork",
+        "notas.txt": b"no es un comprobante",
+    })
+    try:
+        resp = client.post("/v1/receipts/batch", files=[
+            ("files", ("mes.zip", archive, "application/zip")),
+            ("files", (GALICIA_PDF.name, GALICIA_PDF.read_bytes(), "application/pdf")),
+        ])
+    finally:
+        event.remove(Session, "after_flush", listener)
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(l) for l in resp.text.splitlines()]
+    summary = lines.pop()
+    assert summary["summary"] and (summary["files"], summary["stored"], summary["errors"]) == (3, 3, 0)
+    assert sorted(l["index"] for l in lines) == [0, 1, 2]
+    by_index = {l["index"]: l for l in lines}
+    assert by_index[0]["file"] == by_index[1]["file"] == "comprobante.pdf"
+    assert by_index[0]["parsed"]["amount"] is not None and by_index[1]["parsed"]["amount"] is not None
+    assert by_index[0]["parsed"]["amount"] != by_index[1]["parsed"]["amount"]
+    # 3 comprobantes en chunks de 2: dos transacciones de BD
+    assert len(commits) == 2
+
+    db = client.session()
+    assert db.query(Transaction).count() == 3
+    assert {t.id for t in db.query(Transaction)} == {l["id"] for l in lines}
+    assert db.query(Counterparty).count() > 0
+    db.close()
+
+
+def test_batch_rejects_too_many_files(client, monkeypatch):
+    """Test: más de RECEIPTS_BATCH_MAX_FILES (contando los del ZIP) → 400"""
+    monkeypatch.setattr(receipts, "RECEIPTS_BATCH_MAX_FILES", 2)
+    archive = _zip({f"r{i}.pdf": MP_PDF.read_bytes() for i in range(3)})
+    resp = client.post("/v1/receipts/batch", files=[("files", ("mes.zip", archive, "application/zip"))])
+    assert resp.status_code == 400
+    resp = client.post("/v1/receipts/batch", files=[("files", ("x.zip", b"not a zip", "application/zip"))])
+    assert resp.status_code == 400
+
+
+def test_batch_corrupt_file_does_not_abort_stream(client):
+    """Test: un PDF corrupto da una línea de error y el resto del lote se guarda igual"""
+    archive = _zip({"bad.pdf": b"%PDF-1.4\n garbage \x00\x01 not really a pdf", "good.pdf": MP_PDF.read_bytes()})
+    resp = client.post("/v1/receipts/batch", files=[("files", ("mes.zip", archive, "application/zip"))])
+    assert resp.status_code == 200
+    lines = [json.loads(l) for l in resp.text.splitlines()]
+    summary = lines.pop()
+    assert (summary["files"], summary["stored"], summary["errors"]) == (2, 1, 1)
+    by_file = {l["file"]: l for l in lines}
+    assert by_file["bad.pdf"]["status"] == "error" and "error" in by_file["bad.pdf"]
+    assert by_file["good.pdf"]["status"] == "ok" and by_file["good.pdf"]["parsed"]["amount"] is not None
+
+
+def test_failed_chunk_keeps_parse_cache_rows(client, monkeypatch):
+    """Test: si el chunk hace rollback, las filas de la cache de parseo ya extraídas quedan"""
+    def boom(db, tx, tenant_id):
+        raise RuntimeError("matching down")
+
+    monkeypatch.setattr(receipts, "_resolve_and_match_pending", boom)
+    resp = client.post("/v1/receipts/batch", files=[
+        ("files", (MP_PDF.name, MP_PDF.read_bytes(), "application/pdf")),
+        ("files", (CARD_PDF.name, CARD_PDF.read_bytes(), "application/pdf")),
+    ])
+    summary = [json.loads(l) for l in resp.text.splitlines()][-1]
+    assert (summary["stored"], summary["errors"]) == (0, 2)
+    db = client.session()
+    assert db.query(Transaction).count() == 0
+    assert db.query(ParseCacheEntry).count() == 2
+    db.close()
+
+
+def test_chunks_are_stored_off_the_event_loop(client, monkeypatch):
+    """Test: flush / matching / commit de cada chunk corren en un thread, no en el event loop"""
+    import asyncio
+    original = receipts._resolve_and_match_pending
+    on_loop = []
+
+    def spy(db, tx, tenant_id):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return original(db, tx, tenant_id)
+
+    monkeypatch.setattr(receipts, "_resolve_and_match_pending", spy)
+    resp = client.post("/v1/receipts/batch", files=[
+        ("files", (MP_PDF.name, MP_PDF.read_bytes(), "application/pdf")),
+        ("files", (CARD_PDF.name, CARD_PDF.read_bytes(), "application/pdf")),
+    ])
+    summary = [json.loads(l) for l in resp.text.splitlines()][-1]
+    assert summary["stored"] == 2
+    assert on_loop == [False, False]
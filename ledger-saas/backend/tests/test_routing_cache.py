@@ -0,0 +1,87 @@
+"""
+Tests de la cache de ruteo de webhooks por (provider, external_id) (app.routing_cache).
+"""
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app import cache_version, metrics, routing_cache
+from app.db import Base
+from app.models import Channel, Tenant
+from app.routers import whatsapp
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'routing.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    db = factory()
+    db.add_all([Tenant(name="Channel Tenant", status="active"), Tenant(name="Phone Tenant", status="active", phone_number_id="222")])
+    db.flush()
+    db.add(Channel(tenant_id=1, kind="whatsapp", provider="meta", external_id="111"))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(routing_cache, "ROUTING_CACHE_ENABLED", True)
+    routing_cache.clear()
+    metrics.reset()
+    factory.queries = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: factory.queries.append(statement))
+    yield factory
+    routing_cache.clear()
+
+
+def test_hot_path_routing_needs_no_queries(session_factory):
+    """Test: después de la primera resolución (positiva o negativa) no se consulta la BD"""
+    db = session_factory()
+    assert whatsapp._resolve_tenant(db, "111", None) == 1
+    assert whatsapp._resolve_tenant(db, "222", None) == 2
+    assert whatsapp._resolve_tenant(db, "999", None) is None
+    assert whatsapp._route_tenant_by_provider(db, "twilio", "sandbox") is None
+    session_factory.queries.clear()
+
+    for _ in range(3):
+        assert whatsapp._resolve_tenant(db, "111", None) == 1
+        assert whatsapp._resolve_tenant(db, "222", None) == 2
+        assert whatsapp._resolve_tenant(db, "999", None) is None
+    assert session_factory.queries == []
+    counters = metrics.snapshot()["counters"]
+    assert (counters["routing_cache.hits"], counters["routing_cache.negative_hits"]) == (6, 3)
+    db.close()
+
+
+def test_orm_writes_invalidate_and_negative_entries_expire(session_factory, monkeypatch):
+    """Test: crear un Channel invalida la cache; el negativo vence con su TTL"""
+    db = session_factory()
+    assert whatsapp._resolve_tenant(db, "333", None) is None
+    version = cache_version.get(db, routing_cache.VERSION_KEY)
+    db.add(Channel(tenant_id=2, kind="whatsapp", provider="meta", external_id="333"))
+    db.commit()
+    assert cache_version.get(db, routing_cache.VERSION_KEY) == version + 1
+    assert whatsapp._resolve_tenant(db, "333", None) == 2
+
+    monkeypatch.setattr(routing_cache, "ROUTING_CACHE_NEGATIVE_TTL_SECONDS", 0)
+    assert whatsapp._resolve_tenant(db, "444", None) is None
+    session_factory.queries.clear()
+    assert whatsapp._resolve_tenant(db, "444", None) is None
+    assert session_factory.queries  # vencido: se vuelve a consultar
+    db.close()
+
+
+def test_other_workers_changes_are_seen_through_the_version(session_factory, monkeypatch):
+    """Test: un cambio hecho por otro proceso (sin pasar por esta cache) se toma al chequear la versión"""
+    monkeypatch.setattr(routing_cache, "ROUTING_CACHE_VERSION_CHECK_SECONDS", 3600)
+    db = session_factory()
+    assert whatsapp._resolve_tenant(db, "111", None) == 1
+
+    # Otro worker mueve el número al tenant 2 (update bulk + touch, como map_phone_to_tenant.py)
+    other = session_factory()
+    other.query(Channel).filter_by(external_id="111").update({"tenant_id": 2})
+    cache_version.bump(other.connection(), routing_cache.VERSION_KEY)
+    other.commit()
+    other.close()
+
+    assert whatsapp._resolve_tenant(db, "111", None) == 1  # dentro del intervalo de chequeo
+    monkeypatch.setattr(routing_cache, "ROUTING_CACHE_VERSION_CHECK_SECONDS", 0)
+    assert whatsapp._resolve_tenant(db, "111", None) == 2
+    db.close()
@@ -0,0 +1,111 @@
+"""
+Tests del guardado por chunks de uploads / media (app.uploads).
+"""
+
+import asyncio
+import hashlib
+import io
+import pytest
+from starlette.datastructures import UploadFile
+from app import uploads
+
+
+class CountingFile(io.BytesIO):
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.reads.append(len(chunk))
+        return chunk
+
+
+def test_save_upload_streams_and_hashes(tmp_path, monkeypatch):
+    """Test: se escribe por chunks, con el SHA-256 del contenido y sin temporales"""
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 1000)
+    data = bytes(range(256)) * 20
+    raw = CountingFile(data)
+    dest = tmp_path / "t1_comprobante.pdf"
+
+    stored = asyncio.run(uploads.save_upload(UploadFile(raw, filename="comprobante.pdf"), str(dest)))
+    assert stored == uploads.StoredFile(str(dest), hashlib.sha256(data).hexdigest(), len(data))
+    assert dest.read_bytes() == data
+    assert max(raw.reads) == 1000 and len(raw.reads) > 5
+    assert [p.name for p in tmp_path.iterdir()] == [dest.name]
+
+
+def test_too_large_is_cut_early(tmp_path, monkeypatch):
+    """Test: pasado UPLOAD_MAX_BYTES se corta la lectura (413) y no queda nada en disco"""
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 100)
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_BYTES", 250)
+    raw = CountingFile(b"x" * 10_000)
+
+    with pytest.raises(uploads.UploadTooLarge) as err:
+        asyncio.run(uploads.save_upload(UploadFile(raw, filename="big.pdf"), str(tmp_path / "big.pdf")))
+    assert err.value.status_code == 413
+    assert len(raw.reads) == 3
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_declared_size_rejected_without_reading(tmp_path):
+    """Test: con Content-Length mayor al límite no se lee el body"""
+    def body():
+        raise AssertionError("body read")
+        yield b""
+
+    with pytest.raises(uploads.UploadTooLarge):
+        uploads.save_chunks(body(), str(tmp_path / "media.jpg"), max_bytes=10, declared_size=11)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replace_keeps_previous_file_until_done(tmp_path):
+    """Test: un reemplazo fallido deja el archivo anterior intacto"""
+    dest = tmp_path / "media.pdf"
+    dest.write_bytes(b"previous")
+
+    def body():
+        yield b"partial"
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        uploads.save_chunks(body(), str(dest))
+    assert dest.read_bytes() == b"previous"
+    assert [p.name for p in tmp_path.iterdir()] == [dest.name]
+
+
+def test_sale_ingest_removes_the_file_it_wrote(tmp_path, monkeypatch):
+    """Test: /v1/sales/ingest borra el archivo que guardó aunque el nombre traiga carpetas"""
+    from pathlib import Path
+    from types import SimpleNamespace
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app import executor
+    from app.db import Base, get_db
+    from app.deps import get_current_user
+    from app.routers import sales
+
+    monkeypatch.setattr(sales, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(executor, "EXTRACT_INLINE", True)
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionTest = sessionmaker(bind=engine, autoflush=False)
+
+    def db():
+        session = SessionTest()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(sales.router)
+    app.dependency_overrides[get_db] = db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(tenant_id=1, role="owner")
+    pdf = Path(__file__).resolve().parent.parent / "uploads" / "t1_comprobante.pdf"
+    with TestClient(app) as client:
+        resp = client.post("/v1/sales/ingest", files={"file": ("enero/venta.pdf", pdf.read_bytes(), "application/pdf")})
+    assert resp.status_code == 200 and resp.json()["draft"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["test.db"]
@@ -0,0 +1,139 @@
+"""
+Tests del lote de eventos reenviados por Vercel (POST /webhooks/whatsapp/meta/cloud/batch).
+"""
+
+import gzip
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from app import metrics
+from app.db import Base, get_db
+from app.models import IncomingMessage, Tenant, WhatsAppEvent
+from app.routers import whatsapp
+
+HEADERS = {"Authorization": f"Bearer {whatsapp.BACKEND_SHARED_SECRET}"}
+
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'batch.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionTest = sessionmaker(bind=engine, autoflush=False)
+    db = SessionTest()
+    db.add(Tenant(name="Test Tenant", status="active"))
+    db.commit()
+    db.close()
+    metrics.reset()
+
+    def get_test_db():
+        session = SessionTest()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(whatsapp.router)
+    app.dependency_overrides[get_db] = get_test_db
+    with TestClient(app) as c:
+        c.session = SessionTest
+        yield c
+
+
+def _envelope(request_id, *message_ids):
+    messages = [{"id": m, "from": "5491100000000", "type": "document", "document": {"id": f"media-{m}"}}
+                for m in message_ids]
+    return {"tenant_id": "1", "phone_number_id": "123", "request_id": request_id,
+            "payload": {"entry": [{"changes": [{"value": {"messages": messages}}]}]}}
+
+
+def test_gzip_batch_acks_each_event_in_one_transaction(client):
+    """Test: lote gzip → un ack por evento, un commit para los eventos crudos y otro para los mensajes"""
+    events = [_envelope("r1", "wamid.1"), "not an event", _envelope("r2", "wamid.2", "wamid.1")]
+    body = gzip.compress(json.dumps({"events": events}).encode())
+    commits = []
+    listener = lambda session: commits.append(session)
+    event.listen(Session, "after_commit", listener)
+    try:
+        resp = client.post("/webhooks/whatsapp/meta/cloud/batch", content=body,
+                           headers={**HEADERS, "Content-Encoding": "gzip", "Content-Type": "application/json"})
+    finally:
+        event.remove(Session, "after_commit", listener)
+
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["events"], data["messages_queued"]) == (3, 2)
+    acks = data["acks"]
+    assert [a["index"] for a in acks] == [0, 1, 2]
+    assert (acks[0]["request_id"], acks[0]["messages_queued"]) == ("r1", 1)
+    assert acks[1]["status"] == "invalid"
+    assert [(m["id"], m["status"]) for m in acks[2]["messages"]] == [("wamid.2", "queued"), ("wamid.1", "duplicate")]
+    assert len(commits) == 2
+
+    db = client.session()
+    assert db.query(WhatsAppEvent).count() == 2
+    assert {m.message_id for m in db.query(IncomingMessage)} == {"wamid.1", "wamid.2"}
+    db.close()
+
+    # Reenvío del mismo lote: todo duplicado
+    resp = client.post("/webhooks/whatsapp/meta/cloud/batch", json={"events": events}, headers=HEADERS)
+    assert resp.json()["messages_queued"] == 0
+
+
+def test_batch_limits_are_published_and_enforced(client, monkeypatch):
+    """Test: GET publica los límites; más eventos o bytes que el límite → 413"""
+    monkeypatch.setattr(whatsapp, "WEBHOOK_BATCH_MAX_EVENTS", 2)
+    monkeypatch.setattr(whatsapp, "WEBHOOK_BATCH_MAX_DECOMPRESSED_BYTES", 2048)
+    limits = client.get("/webhooks/whatsapp/meta/cloud/batch").json()
+    assert limits["max_events"] == 2 and "gzip" in limits["content_encodings"]
+
+    events = [_envelope(f"r{i}", f"wamid.{i}") for i in range(3)]
+    resp = client.post("/webhooks/whatsapp/meta/cloud/batch", json={"events": events}, headers=HEADERS)
+    assert resp.status_code == 413 and resp.json()["detail"]["limits"]["max_events"] == 2
+
+    # Gzip chico que descomprime por encima del límite
+    bomb = gzip.compress(json.dumps({"events": [], "pad": "x" * 10_000}).encode())
+    resp = client.post("/webhooks/whatsapp/meta/cloud/batch", content=bomb,
+                       headers={**HEADERS, "Content-Encoding": "gzip"})
+    assert resp.status_code == 413
+
+    assert client.post("/webhooks/whatsapp/meta/cloud/batch", json={"events": []}).status_code == 401
+
+
+def test_failed_insert_returns_5xx_so_the_forwarder_retries(client, monkeypatch):
+    """Test: si no se pueden registrar los mensajes, 500 (no "duplicate" con 200)"""
+    def broken_insert(db, rows):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(whatsapp, "_insert_inbound_messages", broken_insert)
+    events = [_envelope("r1", "wamid.1")]
+    assert client.post("/webhooks/whatsapp/meta/cloud/batch", json={"events": events}, headers=HEADERS).status_code == 500
+    assert client.post("/webhooks/whatsapp/meta/cloud", json=events[0], headers=HEADERS).status_code == 500
+    monkeypatch.undo()
+    resp = client.post("/webhooks/whatsapp/meta/cloud", json=events[0], headers=HEADERS)
+    assert resp.status_code == 200 and resp.json()["messages_queued"] == 1
+
+
+def test_known_message_ids_uses_the_unique_index(client):
+    """Test: el chequeo de idempotencia busca por (tenant_id, message_id), sin escanear la tabla"""
+    db = client.session()
+    db.add_all([IncomingMessage(tenant_id=1, message_id="wamid.1", status="done"),
+                IncomingMessage(tenant_id=None, message_id="wamid.2", status="done"),
+                IncomingMessage(tenant_id=2, message_id="wamid.1", status="done")])
+    db.commit()
+    plans = []
+    listener = lambda conn, cursor, statement, params, context, executemany: plans.extend(
+        r[-1] for r in cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", params)
+    ) if "incoming_messages" in statement else None
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        known = whatsapp._known_message_ids(db, [(1, "wamid.1"), (1, "wamid.3"), (None, "wamid.2"), (2, "wamid.9")])
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+    db.close()
+    assert known == {(1, "wamid.1"), (None, "wamid.2")}
+    assert plans and not any(p.startswith("SCAN incoming_messages") for p in plans)
+    assert any("SEARCH incoming_messages" in p for p in plans)